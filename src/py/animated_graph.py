@@ -6,6 +6,8 @@ import math
 import os
 from model.tournesol_dataset.individualcriteriascores import IndividualCriteriaScoresFile
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.diff import apply_diff, diff_datasets
+from model.tournesol_dataset.snapshot import build_snapshot, load_snapshot
 from scripts.force_directed_graph import ForceLayout
 from dao.youtube_api import YTData
 from matplotlib import pyplot as plt
@@ -27,6 +29,13 @@ try:
 except FileNotFoundError as e:
 	pass
 
+# Snapshots of both datasets, the newer one being derived from the older one (only rows that changed are parsed).
+# Once built, next runs read USER's comparisons through the snapshots indexes without parsing the zips again.
+if load_snapshot(TOURNESOL_DATASET_PATH_1) is None:
+	build_snapshot(TOURNESOL_DATASET_PATH_1)
+if load_snapshot(TOURNESOL_DATASET_PATH_2) is None:
+	apply_diff(TOURNESOL_DATASET_PATH_1, diff_datasets(TOURNESOL_DATASET_PATH_1, TOURNESOL_DATASET_PATH_2), TOURNESOL_DATASET_PATH_2)
+
 COMPARISONS_1 = ComparisonFile(TOURNESOL_DATASET_PATH_1)
 # INDIVIDUAL_SCORES_1 = IndividualCriteriaScoresFile(TOURNESOL_DATASET_PATH_1)
 COMPARISONS_2 = ComparisonFile(TOURNESOL_DATASET_PATH_2)
@@ -76,14 +85,14 @@ def init_graph_data():
 	links: list[_link] = list() # [(date, vid1, vid2, score[-1>1])]
 	# Get all comparisons, sorted by date then by youtube ids of the contained elements (~random)
 	def extract_comparisons(line: ComparisonLine):
-		if line.criterion != 'largely_recommended' or line.user != USER:
-			return
 		links.append((line.date, line.vid1, line.vid2, line.score/10.0))
 
 	sorted_links = list()
 	inserted = set()
 
-	COMPARISONS_1.foreach(extract_comparisons)
+	cmps_1 = COMPARISONS_1.comparisons_for_user(USER, criterion='largely_recommended')
+	for line in cmps_1:
+		extract_comparisons(line)
 	links.sort()
 	first = links.pop(0)
 	sorted_links.append(first)
@@ -94,7 +103,11 @@ def init_graph_data():
 	init_links = len(sorted_links)
 
 	links.clear()
-	COMPARISONS_2.foreach(extract_comparisons)
+	# Comparisons added or changed between the 2 datasets
+	known = set(cmps_1)
+	for line in COMPARISONS_2.comparisons_for_user(USER, criterion='largely_recommended'):
+		if line not in known:
+			extract_comparisons(line)
 	links.sort()
 	insert_links(sorted_links, inserted, links)
 
@@ -0,0 +1,92 @@
+"""
+Benchmark of TournesolInputFromPublicDataset.ratings_properties against its former implementation
+(union of python sets of groupby keys), on synthetic comparisons.
+
+Usage (from `src/py`):
+	`python -m benchmarks.ratings_properties [--users 10000] [--videos 50000] [--comparisons 1000000]`
+"""
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+from model.solidago import TournesolInputFromPublicDataset
+
+
+def legacy_ratings_properties(tinput: TournesolInputFromPublicDataset) -> pd.DataFrame:
+	# Former implementation
+	user_entities_pairs = pd.Series(
+		iter(
+			set(tinput.comparisons.groupby(["user_id", "entity_a"]).indices.keys())
+			| set(tinput.comparisons.groupby(["user_id", "entity_b"]).indices.keys())
+		)
+	)
+	dtf = pd.DataFrame([*user_entities_pairs], columns=["user_id", "entity_id"])
+	dtf["is_public"] = True
+	dtf["trust_score"] = dtf["user_id"].map(tinput.users["trust_score"])
+	scaling_calibration_user_ids = (
+		dtf[dtf.trust_score > tinput.SCALING_CALIBRATION_MIN_TRUST_SCORE]["user_id"]
+		.value_counts(sort=True)[: tinput.MAX_SCALING_CALIBRATION_USERS]
+		.index
+	)
+	dtf["is_scaling_calibration_user"] = dtf["user_id"].isin(scaling_calibration_user_ids)
+	return dtf
+
+def synthetic_input(nb_users: int, nb_videos: int, nb_comparisons: int, seed: int = 0) -> TournesolInputFromPublicDataset:
+	"""
+	Returns:
+		TournesolInputFromPublicDataset: with synthetic `users` & `comparisons` tables
+			(users activity & videos popularity following power laws, as in the public dataset)
+	"""
+	rng = np.random.default_rng(seed)
+	user_weights = 1 / np.arange(1, nb_users+1)
+	video_weights = 1 / np.arange(1, nb_videos+1) ** 0.8
+	users = pd.DataFrame({
+		"public_username": [f"user{i}" for i in range(nb_users)],
+		"trust_score": rng.random(nb_users).round(3),
+	})
+	users.index.name = "user_id"
+	comparisons = pd.DataFrame({
+		"public_username": "",
+		"criteria": rng.choice(["largely_recommended", "reliability", "importance"], nb_comparisons),
+		"score": rng.integers(-10, 11, nb_comparisons),
+		"score_max": 10,
+		"week_date": "2023-01-02",
+		"entity_a": rng.choice(nb_videos, nb_comparisons, p=video_weights/video_weights.sum()),
+		"entity_b": rng.choice(nb_videos, nb_comparisons, p=video_weights/video_weights.sum()),
+		"user_id": rng.choice(nb_users, nb_comparisons, p=user_weights/user_weights.sum()),
+	})
+	comparisons["public_username"] = users["public_username"].to_numpy()[comparisons["user_id"]]
+
+	tinput = TournesolInputFromPublicDataset(dataset_zip=None)
+	# Set tables directly, in place of loading them from a dataset zip
+	tinput.__dict__["users"] = users
+	tinput.__dict__["comparisons"] = comparisons
+	return tinput
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Compare ratings_properties implementations on synthetic data')
+	parser.add_argument('--users', help='Number of users', type=int, default=10_000)
+	parser.add_argument('--videos', help='Number of videos', type=int, default=50_000)
+	parser.add_argument('--comparisons', help='Number of comparisons', type=int, default=1_000_000)
+	parser.add_argument('--seed', help='Random seed', type=int, default=0)
+	args = vars(parser.parse_args())
+
+	tinput = synthetic_input(args['users'], args['videos'], args['comparisons'], args['seed'])
+	print(f"{len(tinput.users)} users, {len(tinput.comparisons)} comparisons")
+
+	start = time.perf_counter()
+	legacy = legacy_ratings_properties(tinput)
+	legacy_time = time.perf_counter() - start
+
+	start = time.perf_counter()
+	current = tinput.ratings_properties
+	current_time = time.perf_counter() - start
+
+	same_pairs = legacy.sort_values(["user_id", "entity_id"], ignore_index=True)[["user_id", "entity_id", "trust_score"]] \
+		.equals(current[["user_id", "entity_id", "trust_score"]])
+	print(f"legacy:  {legacy_time:8.3f}s ({len(legacy)} rows)")
+	print(f"current: {current_time:8.3f}s ({len(current)} rows) - x{legacy_time/current_time:0.1f}")
+	print(f"Same (user, entity) pairs: {same_pairs}")
+	print(f"Scaling calibration users: {legacy.is_scaling_calibration_user.sum()} (legacy) / {current.is_scaling_calibration_user.sum()} (current)")
@@ -0,0 +1,212 @@
+"""
+Benchmark of the analysis scripts core functions, on synthetic datasets of several scales (see `benchmarks.synthetic`).
+
+Each case is run `--repeat` times on each scale; results (min & median durations, dataset sizes, environment)
+are written as JSON, to be compared with a previous run given as `--baseline`.
+
+Usage (from `src/py`):
+	`python -m benchmarks.run [--scales small,medium] [--cases elastics,ranks_finder] [--output benchmark.json] [--baseline previous.json]`
+"""
+import argparse
+import contextlib
+import datetime
+import json
+import math
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable
+
+import numpy as np
+from benchmarks.synthetic import write_synthetic_dataset
+
+SCALES: dict[str, dict[str, float]] = {
+	'small': {'users': 200, 'videos': 2_000, 'density': 6},
+	'medium': {'users': 1_000, 'videos': 10_000, 'density': 8},
+	'large': {'users': 5_000, 'videos': 50_000, 'density': 10},
+}
+ELASTICS_ITERATIONS = 10 # Score updates timed per run of elastics.update_v1/update_v2
+
+
+##### CASES #####
+# Each case prepares its (untimed) inputs from the dataset path, and returns the function to be timed
+
+def _elastics_extract(dataset: str) -> Callable:
+	from elastics import extractComparisons
+	from model.tournesol_dataset.comparisons import ComparisonFile
+	return lambda: extractComparisons(ComparisonFile(dataset), None)
+
+def _elastics_update(update_name: str) -> Callable[[str], Callable]:
+	def case(dataset: str) -> Callable:
+		import elastics
+		from model.tournesol_dataset.comparisons import ComparisonFile
+		cmps = elastics.extractComparisons(ComparisonFile(dataset), None)
+		vids, src, dst, sums, counts = elastics.to_edges(cmps)
+		init = np.array([sum(s for s,_ in cmps[vid].values()) / sum(c for _,c in cmps[vid].values()) / 10 for vid in vids])
+		fixed = np.zeros(len(vids), dtype=bool)
+		update = getattr(elastics, update_name)
+		def run():
+			scores = init
+			for i in range(ELASTICS_ITERATIONS):
+				scores = update(src, dst, sums, counts, scores, fixed, 1/math.sqrt(i+1))
+		return run
+	return case
+
+def _ranks_finder_extract(dataset: str) -> Callable:
+	from ranks_finder import extractComparisons
+	from model.tournesol_dataset.comparisons import ComparisonFile
+	return lambda: extractComparisons(ComparisonFile(dataset), None)
+
+def _ranks_finder_rank(dataset: str) -> Callable:
+	from ranks_finder import extractComparisons, find_ranks
+	from model.tournesol_dataset.comparisons import ComparisonFile
+	cmps = extractComparisons(ComparisonFile(dataset), None)
+	return lambda: find_ranks(cmps)
+
+def _users_graph_load(dataset: str) -> Callable:
+	from users_graph import load_graph
+	return lambda: load_graph(dataset, '')
+
+def _challenge(dataset: str) -> Callable:
+	from challenge import compute_needs_for_challenge
+	from dao.youtube_api import YoutubeAPI, YTVideo
+	from model.tournesol_dataset.comparisons import ComparisonFile
+	# Youtube metadata of all compared videos, as if already fetched (YTData being deprecated, YoutubeAPI holds them)
+	rng = np.random.default_rng(0)
+	yt_data = YoutubeAPI()
+	vids = {vid for batch in ComparisonFile(dataset).iter_batches() for col in ('vid1', 'vid2') for vid in batch[col]}
+	for vid in sorted(vids):
+		yt_data.videos[vid] = YTVideo({
+			'vid': vid,
+			'title': f"Video {vid}",
+			'duration': int(rng.integers(60, 7200)),
+			'date': (datetime.datetime(2015, 1, 1, tzinfo=datetime.timezone.utc) + datetime.timedelta(days=int(rng.integers(0, 3000)))).isoformat(),
+		})
+	return lambda: compute_needs_for_challenge(dataset, yt_data, None, None, None, 10, True)
+
+def _solidago_ratings(dataset: str) -> Callable:
+	from model.solidago import TournesolInputFromPublicDataset
+	return lambda: TournesolInputFromPublicDataset(dataset).ratings_properties
+
+CASES: dict[str, Callable[[str], Callable]] = {
+	'elastics.extractComparisons': _elastics_extract,
+	'elastics.update_v1': _elastics_update('update_v1'),
+	'elastics.update_v2': _elastics_update('update_v2'),
+	'ranks_finder.extractComparisons': _ranks_finder_extract,
+	'ranks_finder.find_ranks': _ranks_finder_rank,
+	'users_graph.load_graph': _users_graph_load,
+	'challenge.compute_needs_for_challenge': _challenge,
+	'solidago.ratings_properties': _solidago_ratings,
+}
+
+
+##### RUNNER #####
+
+def time_case(case: Callable[[str], Callable], dataset: str, repeat: int) -> dict:
+	"""
+	Returns:
+		dict: {'times': [seconds, ...], 'min': seconds, 'median': seconds}, or {'error': message} if the case failed
+	"""
+	times = []
+	try:
+		# Scripts print their progress: keep the benchmark output readable
+		with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+			fn = case(dataset)
+			for _ in range(repeat):
+				start = time.perf_counter()
+				fn()
+				times.append(time.perf_counter() - start)
+	except Exception as e:
+		return {'error': f"{type(e).__name__}: {e}"}
+	return {'times': times, 'min': min(times), 'median': statistics.median(times)}
+
+def environment() -> dict:
+	try:
+		commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		commit = None
+	return {
+		'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+		'commit': commit,
+		'python': sys.version.split()[0],
+		'platform': platform.platform(),
+		'processor': platform.processor() or platform.machine(),
+		'cpus': os.cpu_count(),
+	}
+
+def run_benchmarks(scales: list[str], cases: list[str], repeat: int, data_dir: str, seed: int = 0, snapshot: bool = False) -> dict:
+	results = []
+	datasets = dict()
+	for scale in scales:
+		dataset = os.path.join(data_dir, f"synthetic_{scale}_{seed}.zip")
+		if os.path.exists(dataset):
+			# Reuse dataset generated by a previous run
+			print(f"[{scale}] Using {dataset}")
+			datasets[scale] = None
+		else:
+			print(f"[{scale}] Generating {dataset}...")
+			datasets[scale] = write_synthetic_dataset(dataset, seed=seed, **SCALES[scale])
+		if snapshot:
+			from model.tournesol_dataset.snapshot import build_snapshot
+			build_snapshot(dataset)
+
+		for name in cases:
+			result = time_case(CASES[name], dataset, repeat)
+			results.append({'scale': scale, 'case': name, **result})
+			if 'error' in result:
+				print(f"[{scale}] {name:40s} FAILED ({result['error']})")
+			else:
+				print(f"[{scale}] {name:40s} min {result['min']:8.3f}s  median {result['median']:8.3f}s")
+
+	return {
+		'environment': environment(),
+		'parameters': {'repeat': repeat, 'seed': seed, 'snapshot': snapshot, 'scales': {s: SCALES[s] for s in scales}},
+		'datasets': datasets, # {scale: {csv file name: number of rows}} (None if reused)
+		'results': results,
+	}
+
+def compare(report: dict, baseline: dict):
+	# Print duration ratios of cases present in both reports (<1 is faster than baseline)
+	previous = {(r['scale'], r['case']): r for r in baseline['results'] if 'error' not in r}
+	print(f"\nCompared to baseline ({baseline['environment'].get('commit')}):")
+	for r in report['results']:
+		prev = previous.get((r['scale'], r['case']))
+		if prev and 'error' not in r:
+			print(f"[{r['scale']}] {r['case']:40s} x{r['median']/prev['median']:0.2f}")
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Time analysis scripts core functions on synthetic datasets')
+	parser.add_argument('--scales', help=f"Coma separated scales to run among {', '.join(SCALES)} (default: %(default)s)", type=str, default='small,medium')
+	parser.add_argument('--cases', help='Coma separated prefixes of cases to run (default: all)', type=str, default='')
+	parser.add_argument('--repeat', help='Number of timed runs per case (default: %(default)s)', type=int, default=3)
+	parser.add_argument('--seed', help='Random seed of generated datasets', type=int, default=0)
+	parser.add_argument('--data', help='Directory where to keep generated datasets (default: temporary directory)', type=str, default=None)
+	parser.add_argument('--snapshot', help='Build datasets snapshots before timing', action=argparse.BooleanOptionalAction, default=False)
+	parser.add_argument('-o', '--output', help='JSON file where to write results', type=str, default=None)
+	parser.add_argument('-b', '--baseline', help='JSON file of a previous run to compare results with', type=str, default=None)
+	args = vars(parser.parse_args())
+
+	scales = args['scales'].split(',')
+	for scale in scales:
+		if scale not in SCALES:
+			parser.error(f"Unknown scale: {scale}")
+	prefixes = args['cases'].split(',') if args['cases'] else ['']
+	cases = [c for c in CASES if any(c.startswith(p) for p in prefixes)]
+
+	with tempfile.TemporaryDirectory() as tmp:
+		data_dir = args['data'] or tmp
+		os.makedirs(data_dir, exist_ok=True)
+		report = run_benchmarks(scales, cases, args['repeat'], data_dir, args['seed'], args['snapshot'])
+
+	if args['output']:
+		with open(args['output'], 'w', encoding='utf-8') as file:
+			json.dump(report, file, indent='\t')
+		print(f"Results written to {args['output']}")
+	if args['baseline']:
+		with open(args['baseline'], 'r', encoding='utf-8') as file:
+			compare(report, json.load(file))
@@ -0,0 +1,178 @@
+"""
+Generator of synthetic datasets shaped as the Tournesol public dataset zip
+(`users.csv`, `comparisons.csv`, `vouchers.csv`, `collective_criteria_scores.csv`, `individual_criteria_scores.csv`).
+
+Users activity and videos popularity follow power laws, as in the real dataset: a few users make most comparisons,
+and a few videos are compared much more than others.
+
+Usage (from `src/py`):
+	`python -m benchmarks.synthetic data/synthetic.zip --users 1000 --videos 10000 --density 6`
+"""
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+
+CRITERIA = [
+	'largely_recommended', # Main criterion, set on every comparison
+	'reliability',
+	'importance',
+	'engaging',
+	'pedagogy',
+	'layman_friendly',
+	'diversity_inclusion',
+	'backfire_risk',
+	'better_habits',
+	'entertaining_relevance',
+]
+_ID_CHARS = np.array(list('abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_'))
+
+def _power_law(size: int, exponent: float) -> np.ndarray:
+	# Probabilities proportional to 1/rank^exponent
+	weights = 1 / np.arange(1, size+1) ** exponent
+	return weights / weights.sum()
+
+def synthetic_tables(
+	users: int = 1000,
+	videos: int = 10000,
+	density: float = 6.0,
+	activity_exponent: float = 1.0,
+	popularity_exponent: float = 0.8,
+	criteria_ratio: float = 0.3,
+	weeks: int = 52,
+	seed: int = 0,
+) -> dict[str, pd.DataFrame]:
+	"""
+	Args:
+		users (int): Number of users
+		videos (int): Number of videos
+		density (float): Average number of comparisons per video, on the main criterion (mean degree of the comparison graph)
+		activity_exponent (float): Power law exponent of the number of comparisons per user
+		popularity_exponent (float): Power law exponent of the number of comparisons per video
+		criteria_ratio (float): Part of the comparisons also rated on all optional criteria
+		weeks (int): Number of weeks over which comparisons are spread
+		seed (int): Random seed (same parameters & seed give the same dataset)
+
+	Returns:
+		dict[str, pd.DataFrame]: {csv file name: table content}
+	"""
+	rng = np.random.default_rng(seed)
+
+	usernames = np.array([f"user{i:06d}" for i in range(users)], dtype=object)
+	video_ids = np.array([''.join(c) for c in rng.choice(_ID_CHARS, (videos, 11))], dtype=object)
+	quality = rng.normal(size=videos) # Hidden video quality, driving scores
+	dates = (np.datetime64('2023-01-02') + 7*np.arange(weeks)).astype(str)
+
+	# Comparisons on the main criterion: one per (user, pair of videos)
+	nb_pairs = int(density * videos / 2)
+	user = rng.choice(users, nb_pairs, p=_power_law(users, activity_exponent))
+	vid_a = rng.choice(videos, nb_pairs, p=_power_law(videos, popularity_exponent))
+	vid_b = rng.choice(videos, nb_pairs, p=_power_law(videos, popularity_exponent))
+	pairs = pd.DataFrame({'user': user, 'a': np.minimum(vid_a, vid_b), 'b': np.maximum(vid_a, vid_b)})
+	pairs = pairs[pairs.a != pairs.b].drop_duplicates(ignore_index=True)
+	pairs['week'] = rng.integers(0, weeks, len(pairs))
+
+	# Some comparisons are also rated on optional criteria
+	detailed = rng.random(len(pairs)) < criteria_ratio
+	rows = pd.concat(
+		[pairs.assign(criteria=0)] + [pairs[detailed].assign(criteria=c) for c in range(1, len(CRITERIA))],
+		ignore_index=True,
+	)
+	noise = rng.normal(scale=0.5, size=len(rows))
+	score = np.clip(np.round((quality[rows.b] - quality[rows.a]) * 3 + noise), -10, 10).astype(int)
+	comparisons = pd.DataFrame({
+		'public_username': usernames[rows.user],
+		'video_a': video_ids[rows.a],
+		'video_b': video_ids[rows.b],
+		'criteria': np.array(CRITERIA, dtype=object)[rows.criteria],
+		'score': score,
+		'score_max': 10,
+		'week_date': dates[rows.week],
+	})
+
+	# Individual scores: one per (user, video, criteria) compared
+	ics = pd.concat([
+		rows[['user', 'a', 'criteria']].rename(columns={'a': 'video'}),
+		rows[['user', 'b', 'criteria']].rename(columns={'b': 'video'}),
+	]).drop_duplicates(ignore_index=True)
+	individual_scores = pd.DataFrame({
+		'public_username': usernames[ics.user],
+		'video': video_ids[ics.video],
+		'criteria': np.array(CRITERIA, dtype=object)[ics.criteria],
+		'score': np.clip(quality[ics.video] * 30 + rng.normal(scale=10, size=len(ics)), -100, 100).round(2),
+		'uncertainty': rng.uniform(0, 40, len(ics)).round(2),
+		'voting_right': rng.uniform(0, 1, len(ics)).round(3),
+	})
+
+	# Collective scores: one per (video, criteria) compared
+	ccs = ics[['video', 'criteria']].drop_duplicates(ignore_index=True)
+	collective_scores = pd.DataFrame({
+		'video': video_ids[ccs.video],
+		'criteria': np.array(CRITERIA, dtype=object)[ccs.criteria],
+		'score': np.clip(quality[ccs.video] * 30, -100, 100).round(2),
+		'uncertainty': rng.uniform(0, 20, len(ccs)).round(2),
+	})
+
+	# Users (trust_score is empty for some newly created users) & vouches between them
+	trust = rng.uniform(0, 1, users).round(3).astype(str)
+	trust[rng.random(users) < 0.05] = ''
+	users_table = pd.DataFrame({'public_username': usernames, 'trust_score': trust})
+	nb_vouches = users // 5
+	vouchers = pd.DataFrame({
+		'by_username': usernames[rng.choice(users, nb_vouches, p=_power_law(users, activity_exponent))],
+		'to_username': usernames[rng.choice(users, nb_vouches)],
+		'value': 1.0,
+	})
+	vouchers = vouchers[vouchers.by_username != vouchers.to_username].drop_duplicates(['by_username', 'to_username'])
+
+	return {
+		'users.csv': users_table,
+		'comparisons.csv': comparisons,
+		'vouchers.csv': vouchers,
+		'collective_criteria_scores.csv': collective_scores,
+		'individual_criteria_scores.csv': individual_scores,
+	}
+
+def write_synthetic_dataset(target, **params) -> dict[str, int]:
+	"""
+	Write a synthetic dataset zip
+
+	Args:
+		target: path or file object of the zip to write
+		params: see `synthetic_tables`
+
+	Returns:
+		dict[str, int]: {csv file name: number of rows}
+	"""
+	tables = synthetic_tables(**params)
+	with zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED) as zip_file:
+		for name, table in tables.items():
+			buffer = io.StringIO()
+			table.to_csv(buffer, index=False)
+			zip_file.writestr(name, buffer.getvalue())
+	return {name: len(table) for name, table in tables.items()}
+
+
+if __name__ == '__main__':
+	import argparse
+
+	parser = argparse.ArgumentParser(description='Generate a synthetic dataset zip shaped as the Tournesol public dataset')
+	parser.add_argument('out', help='Path of the zip to write', type=str)
+	parser.add_argument('--users', help='Number of users', type=int, default=1000)
+	parser.add_argument('--videos', help='Number of videos', type=int, default=10000)
+	parser.add_argument('--density', help='Average number of comparisons per video on the main criterion', type=float, default=6.0)
+	parser.add_argument('--activity', help='Power law exponent of the number of comparisons per user', type=float, default=1.0)
+	parser.add_argument('--popularity', help='Power law exponent of the number of comparisons per video', type=float, default=0.8)
+	parser.add_argument('--criteria', help='Part of the comparisons also rated on all optional criteria', type=float, default=0.3)
+	parser.add_argument('--weeks', help='Number of weeks over which comparisons are spread', type=int, default=52)
+	parser.add_argument('--seed', help='Random seed', type=int, default=0)
+	args = vars(parser.parse_args())
+
+	sizes = write_synthetic_dataset(args['out'],
+		users=args['users'], videos=args['videos'], density=args['density'],
+		activity_exponent=args['activity'], popularity_exponent=args['popularity'],
+		criteria_ratio=args['criteria'], weeks=args['weeks'], seed=args['seed'],
+	)
+	for name, size in sizes.items():
+		print(f"{name}: {size} rows")
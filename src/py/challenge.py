@@ -5,6 +5,7 @@ from dateutil.parser import isoparse
 import math
 import pytz
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.identifiers import UserIds
 from dao.youtube_api import YTData
 from model.tournesol_dataset.collectivecriteriascores import CollectiveCriteriaScoresFile
 from model.tournesol_dataset.individualcriteriascores import IndividualCriteriaScoresFile
@@ -23,25 +24,23 @@ def compute_needs_for_challenge(dataset: str, YTDATA: YTData, user: str, fetch_p
 
 	vid_cmps: dict[str,set[str]] = dict()
 	vid_votes: dict[str, list[int]] = dict()
-	vid_usrs: dict[str, set[str]] = dict()
+	vid_usrs: dict[str, set[int]] = dict() # {vid: {user codes (see UserIds)}}
 
 	# Gather data
 	def build_vid_votes(line: ComparisonLine):
-		if (user and line.user != user) or line.criterion != 'largely_recommended':
-			return
-
 		vid_votes.setdefault(line.vid1, [])
 		vid_votes.setdefault(line.vid2, [])
 
 		vid_votes[line.vid2].append(line.score)
 		vid_votes[line.vid1].append(-line.score)
 
-		vid_usrs.setdefault(line.vid1, set()).add(line.user)
-		vid_usrs.setdefault(line.vid2, set()).add(line.user)
+		usr = UserIds.code(line.user)
+		vid_usrs.setdefault(line.vid1, set()).add(usr)
+		vid_usrs.setdefault(line.vid2, set()).add(usr)
 
 		vid_cmps.setdefault(line.vid1, set()).add(line.vid2)
 		vid_cmps.setdefault(line.vid2, set()).add(line.vid1)
-	cmpFile.foreach(build_vid_votes)
+	cmpFile.foreach(build_vid_votes, criterion='largely_recommended', user=user or None)
 
 
 	# Remove if less than 3 different users, or 5 comparisons
@@ -168,30 +167,33 @@ def positiveInt(val):
 		pass
 	raise argparse.ArgumentTypeError(f"Expected a positive integer but value was: {val}")
 
-# Unload parameters
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
-parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
-parser.add_argument('-l', '--lng', help='Video languages to keep. All languages enabled if unset. Use letters langage code ex: "en", "fr", "sp". Use "??" for videos of unknown language. Allow coma separated values to allow multiple like "fr,en,??"', default='', type=str)
-parser.add_argument('-u', '--user', help='Get statistics for given user. If unset, will compute global statistics', type=str, default=None)
-parser.add_argument('-n', '--nb', help='Number of how much suggestions to show (default: 10)', type=positiveInt, default=10)
-parser.add_argument('-s', '--short', help='Hide video details', action=argparse.BooleanOptionalAction, default=False)
-parser.add_argument('--fetch', help='If set, will fetch youtube API for updating data', action=argparse.BooleanOptionalAction, default=False)
-
-args = vars(parser.parse_args())
-
-YTDATA = YTData()
-try:
-	YTDATA.load(args['cache'])
-except FileNotFoundError:
-	pass
-
-compute_needs_for_challenge(
-	args['tournesoldataset'],
-	YTDATA,
-	args['user'],
-	args['cache'] if args['fetch'] else None,
-	set(args['lng'].split(',')) if args['lng'] else None,
-	args['nb'],
-	args['short']
-)
+
+if __name__ == '__main__':
+
+	# Unload parameters
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
+	parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
+	parser.add_argument('-l', '--lng', help='Video languages to keep. All languages enabled if unset. Use letters langage code ex: "en", "fr", "sp". Use "??" for videos of unknown language. Allow coma separated values to allow multiple like "fr,en,??"', default='', type=str)
+	parser.add_argument('-u', '--user', help='Get statistics for given user. If unset, will compute global statistics', type=str, default=None)
+	parser.add_argument('-n', '--nb', help='Number of how much suggestions to show (default: 10)', type=positiveInt, default=10)
+	parser.add_argument('-s', '--short', help='Hide video details', action=argparse.BooleanOptionalAction, default=False)
+	parser.add_argument('--fetch', help='If set, will fetch youtube API for updating data', action=argparse.BooleanOptionalAction, default=False)
+
+	args = vars(parser.parse_args())
+
+	YTDATA = YTData()
+	try:
+		YTDATA.load(args['cache'])
+	except FileNotFoundError:
+		pass
+
+	compute_needs_for_challenge(
+		args['tournesoldataset'],
+		YTDATA,
+		args['user'],
+		args['cache'] if args['fetch'] else None,
+		set(args['lng'].split(',')) if args['lng'] else None,
+		args['nb'],
+		args['short']
+	)
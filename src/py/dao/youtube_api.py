@@ -9,6 +9,7 @@ import datetime
 import requests
 import googleapiclient.http
 import googleapiclient.discovery
+from utils import instrument
 from utils.save import load_json_gz, save_json_gz
 
 
@@ -473,9 +474,13 @@ class YoutubeAPIDelay:
 	def __enter__(self):
 		wait=self.api._delay-(time.time()-self.api._last_api_call)
 		if wait > 0:
+			instrument.count('youtube.api_delay_s', wait)
 			time.sleep(wait)
+		instrument.count('youtube.api_calls')
+		self.span = instrument.span('youtube.api_call').__enter__()
 
 	def __exit__(self, type, value, traceback):
+		self.span.__exit__(type, value, traceback)
 		self.api._last_api_call = time.time()
 
 
@@ -553,6 +558,7 @@ class YoutubeAPI:
 
 	### API ###
 
+	@instrument.timed()
 	def get_channel(self, *, handle:str=None, ytid:str=None) -> YTChannel:
 		if not handle and not ytid:
 			raise ValueError("Neither handle nor ytid parameters has been set")
@@ -566,6 +572,7 @@ class YoutubeAPI:
 			handle = handle.lower()
 		for c in self.channels.values():
 			if (handle and c.handle == handle) or (ytid and c.id == ytid):
+				instrument.count('youtube.channels.cache_hits')
 				return c
 
 		requested_channel = None
@@ -594,10 +601,13 @@ class YoutubeAPI:
 			raise e
 		return requested_channel
 
+	@instrument.timed()
 	def get_channels_by_id(self, cids:list[str], max_cache_refresh:int=100, max_video:int=0) -> dict[str, YTChannel]:
 		# Get data from cache
 		requested_cdata = {c: self.channels[c] for c in cids if c in self.channels}
 
+		instrument.count('youtube.channels.cache_hits', len(requested_cdata))
+
 		# Requesting missing data
 		toFetch = [c for c in cids if c not in requested_cdata]
 		# Also request channels not updated for a certain time
@@ -657,9 +667,11 @@ class YoutubeAPI:
 
 		return requested_cdata
 
+	@instrument.timed()
 	def get_videos_data(self, vids:list[str]) -> dict[str,YTVideo]:
 		# Get data from cache
 		requested_vdata = {v:self.videos[v] for v in vids if v in self.videos}
+		instrument.count('youtube.videos.cache_hits', len(requested_vdata))
 
 		# Requesting missing data
 		toFetch = [v for v in vids if v not in requested_vdata]
@@ -698,6 +710,7 @@ class YoutubeAPI:
 						self.save(self.autosave, print_log=False)
 
 					print(len(fetched), end=' ')
+				instrument.count('youtube.videos.fetched', len(fetched))
 				self._update_vid_channel_links(fetched)
 				print('.')
 			except Exception as e:
@@ -720,6 +733,7 @@ class YoutubeAPI:
 
 		return requested_vdata
 
+	@instrument.timed()
 	def get_channel_videos(self, *, channel:YTChannel=None, channelHandle:str=None, onlyCache:bool=False) -> dict[str,YTVideo]:
 		# Fetch channel data
 		if not channel and not channelHandle:
@@ -3,17 +3,17 @@ import math
 from datetime import datetime
 import numpy as np
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.identifiers import UserIds
+from scripts.kcore import prune_comparisons
 from dao.youtube_api import YTData
+from utils.save import load_json_gz, save_json_gz
 
 def extractComparisons(cmpFile: ComparisonFile, user: str):
 
 	cmps: dict[str, dict[str, tuple[float, float, set[str]]]] = dict() # {vid: {vid2: (sum, count)}}
-	usrs: dict[str,set[str]] = dict() # {vid: {usr1, usr2, ...}}
+	usrs: dict[str,set[int]] = dict() # {vid: {usr1, usr2, ...}} (user codes, see UserIds)
 
 	def parse_line(line: ComparisonLine):
-		if line.criterion != 'largely_recommended' or (user and user != line.user):
-			return
-
 		if not line.vid1 in cmps:
 			cmps[line.vid1] = dict()
 		if not line.vid2 in cmps:
@@ -26,94 +26,90 @@ def extractComparisons(cmpFile: ComparisonFile, user: str):
 			cmpVid1[line.vid2] = (0, 0, set())
 
 		if not user:
-			usrs.setdefault(line.vid1, set()).add(line.user)
-			usrs.setdefault(line.vid2, set()).add(line.user)
+			usr = UserIds.code(line.user)
+			usrs.setdefault(line.vid1, set()).add(usr)
+			usrs.setdefault(line.vid2, set()).add(usr)
 
 		cmpVid1[line.vid2] = (cmpVid1[line.vid2][0]-line.score, cmpVid1[line.vid2][1]+1)
 		cmpVid2[line.vid1] = (cmpVid2[line.vid1][0]+line.score, cmpVid2[line.vid1][1]+1)
 	print('Extracting comparisons...')
-	cmpFile.foreach(parse_line)
+	cmpFile.foreach(parse_line, criterion='largely_recommended', user=user or None)
 
 	# Remove vid with less than 3 comparisons or 5 users
 	print('Filtering comparisons...')
 	l = len(cmps)
-	toredo = True
-	while toredo:
-		toredo = False
-		for vid in list(cmps.keys()):
-			if not user and len(usrs[vid]) < 3:
-				cmps.pop(vid, None)
-				for sub in cmps.values():
-					sub.pop(vid, None)
-				toredo = True
-			elif len(cmps[vid]) < 3:
-				cmps.pop(vid, None)
-				for sub in cmps.values():
-					sub.pop(vid, None)
-				toredo = True
+	prune_comparisons(cmps, 3, users=None if user else usrs, min_users=3)
 
 	print(f"Videos kept for analysis: {len(cmps)}")
 	return cmps
 
 
-def update_scores_v1(cmps: dict[str, dict[str, tuple[float, float]]], scores: dict[str, float], fixed: set[str], power:float):
-	newscores: dict[str, float] = dict()
-
-	for vid in cmps:
-		if vid in fixed:
-			newscores[vid] = scores[vid]
-			continue
-
-		s1 = scores[vid]
-		move=0
-		div=1
-		for v2,sum_cnt in cmps[vid].items():
-			s2 = scores[v2]
-			w = sum_cnt[1]*power
-			if np.sign(sum_cnt[0]) != np.sign(s1-s2):
-				move += w* (sum_cnt[0]/10)
-			div += w
-
-		if div > 0:
-			newscores[vid] = s1 + move/div
-		else:
-			newscores[vid] = scores[vid]
-
-	return newscores
-
+def to_edges(cmps: dict[str, dict[str, tuple[float, float]]]) -> tuple[list[str], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Returns:
+		tuple: (vids, src, dst, sums, counts) with one edge per cmps[vids[src]][vids[dst]] = (sums, counts)
+	"""
+	vids = list(cmps.keys())
+	index = {vid: i for i,vid in enumerate(vids)}
+	src = np.repeat(np.arange(len(vids)), [len(cmps[vid]) for vid in vids])
+	dst = np.fromiter((index[v2] for vid in vids for v2 in cmps[vid]), dtype=np.int64, count=len(src))
+	sums = np.fromiter((sum_cnt[0] for vid in vids for sum_cnt in cmps[vid].values()), dtype=float, count=len(src))
+	counts = np.fromiter((sum_cnt[1] for vid in vids for sum_cnt in cmps[vid].values()), dtype=float, count=len(src))
+	return (vids, src, dst, sums, counts)
+
+
+def update_v1(src: np.ndarray, dst: np.ndarray, sums: np.ndarray, counts: np.ndarray, scores: np.ndarray, fixed: np.ndarray, power: float) -> np.ndarray:
+	"""
+	Args:
+		src, dst, sums, counts: edges, see to_edges
+		scores (np.ndarray): current score of each video
+		fixed (np.ndarray[bool]): videos keeping their current score
+		power (float): update speed
+	Returns:
+		np.ndarray: new score of each video
+	"""
+	n = len(scores)
+	w = counts*power
+	# Move only toward comparisons disagreeing with current scores
+	disagree = np.sign(sums) != np.sign(scores[src] - scores[dst])
+	move = np.bincount(src, np.where(disagree, w*(sums/10), 0), n)
+	div = 1 + np.bincount(src, w, n)
+	return np.where(fixed, scores, scores + move/div)
+
+def update_v2(src: np.ndarray, dst: np.ndarray, sums: np.ndarray, counts: np.ndarray, scores: np.ndarray, fixed: np.ndarray, power: float) -> np.ndarray:
+	"""Same arguments as update_v1"""
+	n = len(scores)
+	dist = scores[src] - scores[dst] # Between -2 & +2
+	avgvote = sums/counts # Between -10 & +10: expected direction & "length" of the distance
+	expt_dist = avgvote**3/1000 # Between -1 & +1
+	expt_note = np.clip(scores[dst] + expt_dist, -.99, .99)
+	force = counts / np.sqrt(np.exp(expt_dist - dist)) # increases if many votes OR if distance if far from expected
+
+	# Average expected note of 3 groups of comparisons (under/equal/higher), weighted by force, then average of the groups
+	group = src*3 + (np.sign(avgvote).astype(np.int64) + 1)
+	present = np.bincount(group, minlength=3*n).reshape(n, 3) > 0
+	notes = np.bincount(group, expt_note*force, 3*n).reshape(n, 3)
+	forces = np.bincount(group, force, 3*n).reshape(n, 3)
+	nb_groups = present.sum(axis=1)
+	with np.errstate(invalid='ignore', divide='ignore'):
+		moved_score = np.where(present, notes/forces, 0).sum(axis=1) / nb_groups
+
+	newscores = (scores*(1-power)) + (moved_score*power)
+	return np.where(fixed | (nb_groups == 0), scores, newscores)
+
+
+def _update_scores(update, cmps: dict[str, dict[str, tuple[float, float]]], scores: dict[str, float], fixed: set[str], power: float) -> dict[str, float]:
+	vids, src, dst, sums, counts = to_edges(cmps)
+	newscores = update(src, dst, sums, counts, np.array([scores[vid] for vid in vids]), np.array([vid in fixed for vid in vids], dtype=bool), power)
+	return dict(zip(vids, newscores.tolist()))
 
+def update_scores_v1(cmps: dict[str, dict[str, tuple[float, float]]], scores: dict[str, float], fixed: set[str], power:float):
+	"""update_v1 on dicts (converted on every call: use to_edges & update_v1 when iterating)"""
+	return _update_scores(update_v1, cmps, scores, fixed, power)
 
 def update_scores_v2(cmps: dict[str, dict[str, tuple[float, float]]], scores: dict[str, float], fixed: set[str], power:float):
-	newscores: dict[str, float] = dict()
-
-	for vid in cmps:
-		if vid in fixed:
-			newscores[vid] = scores[vid]
-			continue
-
-		# Group comparisons in 3 groups: under/equal/higher
-		under = list()
-		equal = list()
-		higher = list()
-		for v2,sum_cnt in cmps[vid].items():
-			dist = (scores[v1] - scores[v2]) # Between -2 & +2
-			avgvote = (sum_cnt[0]/sum_cnt[1]) # Between -10 & +10: expected direction & "length" of the distance
-			expt_dist = avgvote**3/1000 # Between -1 & +1
-			expt_note = np.clip(scores[v2] + expt_dist, -.99, .99)
-			force = sum_cnt[1] / math.sqrt(math.exp(expt_dist - dist)) # increases if many votes OR if distance if far from expected
-
-			(equal if avgvote == 0 else higher if avgvote > 0 else under).append( (expt_note, force) )
-
-		current_score = scores[vid]
-		moved_score = np.average([
-			(sum(v[0]*v[1] for v in l) / sum(v[1] for v in l))
-			for l in [under, equal, higher]
-			if l
-		])
-
-		newscores[vid] = (current_score*(1-power)) + (moved_score*power)
-
-	return newscores
+	"""update_v2 on dicts (converted on every call: use to_edges & update_v2 when iterating)"""
+	return _update_scores(update_v2, cmps, scores, fixed, power)
 
 
 
@@ -129,6 +125,11 @@ if __name__ == '__main__':
 	parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
 	parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
 	parser.add_argument('-u', '--user', help='Get statistics for given user only. If unset, will compute global statistics', type=str, default=None)
+	parser.add_argument('-r', '--rule', help='Score update rule (default: %(default)s)', choices=['v1', 'v2'], default='v2')
+	parser.add_argument('--tolerance', help='Stop when no score moves more than this value in an update (default: %(default)s)', type=float, default=0.001)
+	parser.add_argument('--max-iterations', help='Maximum number of updates (default: square of the number of videos)', type=int, default=0)
+	parser.add_argument('--warm', help='Scores file of a previous run (see --save), used as initial scores', type=str, default=None)
+	parser.add_argument('--save', help='File where to save computed scores (json, gzipped if ending with .gz)', type=str, default=None)
 
 	args = vars(parser.parse_args())
 
@@ -173,24 +174,31 @@ if __name__ == '__main__':
 			fixed.add(v1)
 			scores[v1] = 1 if pos else -1
 
+	# Warm start: scores of a previous run, for videos still not fixed
+	if args['warm']:
+		previous: dict[str, float] = load_json_gz(args['warm'])
+		for vid in scores:
+			if vid not in fixed and vid in previous:
+				scores[vid] = previous[vid]
+
+	vids, src, dst, sums, counts = to_edges(cmps)
+	current = np.array([scores[vid] for vid in vids])
+	is_fixed = np.array([vid in fixed for vid in vids], dtype=bool)
+	update = update_v1 if args['rule'] == 'v1' else update_v2
+
 	minmax = 999
 	t1 = datetime.now()
 	i = 0
-	for i in range(len(scores)**2):
+	diff = max_diff = 0
+	for i in range(args['max_iterations'] or len(vids)**2):
 		# Update score
-		newscores = update_scores_v2(cmps, scores, fixed, 1/math.sqrt(i+1))
+		newscores = update(src, dst, sums, counts, current, is_fixed, 1/math.sqrt(i+1))
 
 		# Compute & print difference
-		diff = 0
-		max_diff = 0
-		for key in scores:
-			dif = (scores[key] - newscores[key])
-			if dif < 0:
-				dif = -dif
-			diff += dif
-			if dif > max_diff:
-				max_diff = dif
-		scores = newscores
+		dif = np.abs(current - newscores)
+		diff = dif.sum()
+		max_diff = dif.max()
+		current = newscores
 
 		if max_diff < minmax:
 			minmax = max_diff
@@ -199,10 +207,13 @@ if __name__ == '__main__':
 		if (t2 - t1).seconds >= 1:
 			print(f"Update {i+1}: updated {diff:0.2%} (max: {max_diff:0.2%} - min: {minmax:0.2%})")
 			t1 = t2
-		if max_diff < 0.001:
+		if max_diff < args['tolerance']:
 			break
 
 	print(f"Update {i+1}: updated {diff:0.2%} (max: {max_diff:0.2%})")
+	scores = dict(zip(vids, current.tolist()))
+	if args['save']:
+		save_json_gz(args['save'], scores)
 
 
 	# # # Print # # #
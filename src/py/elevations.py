@@ -2,8 +2,8 @@
 import math
 import time
 import requests
-import itertools
 import networkx as nx
+import numpy as np
 from typing import Iterable
 from matplotlib import pyplot
 
@@ -34,6 +34,58 @@ def compute_elevation(elm1, elm2, ancest_cache):
 
 	return (elev12, elev21)
 
+def compute_elevations(anc:np.ndarray, desc:np.ndarray, size:int, rows:np.ndarray, cols:np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+	"""
+	compute_elevation of every pair (rows[x], cols[y]) at once, with matrix products:
+	sums over ancestors/descendants sets differences are expanded into sums of sets intersections sizes.
+	Only the rows & cols bitsets are unpacked, other nodes being unpacked by chunks.
+
+	Args:
+		anc (np.ndarray): anc[i] = packed bitset of the ancestors of node i (see pack_bits)
+		desc (np.ndarray): desc[i] = packed bitset of the descendants of node i
+		size (int): number of nodes
+		rows (np.ndarray): indexes of elm1 nodes
+		cols (np.ndarray): indexes of elm2 nodes
+
+	Returns:
+		tuple[np.ndarray, np.ndarray]: (elev12, elev21), of shape (len(rows), len(cols))
+	"""
+	A1, D1, A2, D2 = (unpack_bits(m, size, i) for m,i in ((anc, rows), (desc, rows), (anc, cols), (desc, cols)))
+	a1, d1, a2, d2 = (M.sum(axis=1, dtype=np.float64) for M in (A1, D1, A2, D2))
+	a1, d1, a2, d2 = a1[:,None], d1[:,None], a2[None,:], d2[None,:]
+	# As ancestors & descendants of a node are disjoint: ba1 - inter = ba1 - ba2, bd1 - inter = bd1 - bd2, ba2 - inter = ba2 - ba1
+	anc_inter = A1 @ A2.T
+	desc_inter = D1 @ D2.T
+	anc_only1 = a1 - anc_inter # len(ba1 - ba2)
+	anc_only2 = a2 - anc_inter # len(ba2 - ba1)
+	desc_only1 = d1 - desc_inter # len(bd1 - bd2)
+	desc_only2 = d2 - desc_inter # len(bd2 - bd1)
+
+	# len(bdX - ancest_cache[n][1]) = dX - len(bdX & ancest_cache[n][1]), summed over nodes n, by chunks of nodes
+	# float32 products are exact as long as their sums stay under 2**24: chunk * size <= 2**24
+	chunk = max(1, min(1024, (1 << 24) // max(size, 1)))
+	cut12 = np.zeros((len(rows), len(cols)))
+	cut21 = np.zeros((len(rows), len(cols)))
+	for start in range(0, size, chunk):
+		nodes = np.arange(start, min(start+chunk, size))
+		desc_n = unpack_bits(desc, size, nodes)
+		anc_n = unpack_bits(anc, size, nodes)
+		desc_inter1 = desc_n @ D1.T
+		desc_inter2 = desc_n @ D2.T
+		anc_inter1 = anc_n @ A1.T
+		anc_inter2 = anc_n @ A2.T
+		n = slice(start, start+chunk)
+		cut12 += A1[:,n] @ ((1-A2[:,n].T) * desc_inter2)
+		cut12 += (D1[:,n] * anc_inter1.T) @ (1-D2[:,n].T)
+		cut21 += ((1-A1[:,n]) * desc_inter1.T) @ A2[:,n].T
+		cut21 += D1[:,n] @ ((1-D2[:,n].T) * anc_inter2)
+
+	elev12 = desc_only2 + anc_only1 + 2 \
+		+ anc_only1*(d2+1) + desc_only1*(a1+1) - cut12
+	elev21 = anc_only2 + desc_only1 + 2 \
+		+ anc_only2*(d1+1) + desc_only1*(a2+1) - cut21
+	return (elev12, elev21)
+
 last_tnsl_call=time.time()
 def callTournesol(path: str, JWT:str):
 	global last_tnsl_call
@@ -67,23 +119,121 @@ def callTournesolMultiReversed(path:str, JWT:str, args:str=None) -> Iterable[dic
 		yield r
 
 # Classes
+def _bits(mask:int) -> Iterable[int]:
+	# Indexes of the bits set in mask
+	while mask:
+		low = mask & -mask
+		yield low.bit_length()-1
+		mask ^= low
+
+def pack_bits(masks:list[int], size:int) -> np.ndarray:
+	# Bitsets as rows of bytes (8 bits per byte)
+	nbytes = (size+7) // 8
+	return np.frombuffer(b''.join(mask.to_bytes(nbytes, 'little') for mask in masks), dtype=np.uint8).reshape(len(masks), nbytes)
+
+def unpack_bits(packed:np.ndarray, size:int, rows:np.ndarray) -> np.ndarray:
+	# Given rows of packed bitsets, as rows of 0/1 (float32, for matrix products)
+	return np.unpackbits(packed[rows], axis=1, count=size, bitorder='little').astype(np.float32)
+
+class Reachability():
+	"""
+	Ancestors & descendants of every node of a directed acyclic graph, as bitsets (python int, bit i being the node of index i),
+	kept up to date as edges are added or removed, instead of being searched again on every query.
+	"""
+	def __init__(self):
+		self.index:dict[Eid,int] = dict() # {node: index}
+		self.nodes:list[Eid] = [] # [node at index]
+		self.anc:list[int] = [] # [ancestors of node at index]
+		self.desc:list[int] = [] # [descendants of node at index]
+
+	def clear(self):
+		self.index.clear()
+		self.nodes.clear()
+		self.anc.clear()
+		self.desc.clear()
+
+	def node_index(self, node:Eid) -> int:
+		i = self.index.get(node)
+		if i is None:
+			i = self.index[node] = len(self.nodes)
+			self.nodes.append(node)
+			self.anc.append(0)
+			self.desc.append(0)
+		return i
+
+	def has_path(self, src:Eid, dst:Eid) -> bool:
+		return src in self.index and dst in self.index and bool(self.desc[self.index[src]] >> self.index[dst] & 1)
+
+	def ancestors(self, node:Eid) -> set[Eid]:
+		return {self.nodes[i] for i in _bits(self.anc[self.index[node]])}
+
+	def descendants(self, node:Eid) -> set[Eid]:
+		return {self.nodes[i] for i in _bits(self.desc[self.index[node]])}
+
+	def add_edge(self, src:Eid, dst:Eid):
+		# Every ancestor of src (and src) now reaches every descendant of dst (and dst). dst must not reach src.
+		s = self.node_index(src)
+		d = self.node_index(dst)
+		if self.desc[s] >> d & 1:
+			return # Already reachable: nothing new
+		ancestors = self.anc[s] | 1 << s
+		descendants = self.desc[d] | 1 << d
+		for i in _bits(ancestors):
+			self.desc[i] |= descendants
+		for i in _bits(descendants):
+			self.anc[i] |= ancestors
+
+	def remove_edges(self, G:nx.DiGraph, edges:Iterable[tuple[Eid,Eid]]):
+		"""Update after `edges` have been removed from `G` (being the graph after removal)"""
+		edges = list(edges)
+		# Only ancestors of removed edges sources may lose descendants (and descendants of destinations, ancestors)
+		ancestors = 0
+		descendants = 0
+		for src,dst in edges:
+			s = self.index[src]
+			d = self.index[dst]
+			ancestors |= self.anc[s] | 1 << s
+			descendants |= self.desc[d] | 1 << d
+
+		# Recompute from unchanged nodes, in topological order of the graph before removal (still valid after it):
+		# a node has more descendants than any of its ancestors
+		for i in sorted(_bits(ancestors), key=lambda i: self.desc[i].bit_count()):
+			self.desc[i] = 0
+			for succ in G.successors(self.nodes[i]):
+				j = self.index[succ]
+				self.desc[i] |= self.desc[j] | 1 << j
+		for i in sorted(_bits(descendants), key=lambda i: self.anc[i].bit_count()):
+			self.anc[i] = 0
+			for pred in G.predecessors(self.nodes[i]):
+				j = self.index[pred]
+				self.anc[i] |= self.anc[j] | 1 << j
+
 class CmpGraph():
 	def __init__(self):
 		self.G = nx.DiGraph() # Directed graph, from low recom to high recom
 		self.comparisons:list[Eid] = [] # From oldest (first) to newest (last)
+		self.ages:dict[tuple[Eid,Eid],int] = dict() # {comparison: number of comparisons added before it} (ordered as comparisons)
+		self.nb_added = 0
+		self.reach = Reachability()
 
 	def reset(self):
 		self.comparisons.clear()
+		self.ages.clear()
+		self.nb_added = 0
 		self.G.clear()
+		self.reach.clear()
 
 	def add_evaluation(self, elm1:Eid, elm2:Eid): # such as elm2 > elm1
 		has_removed = False
-		if elm1 in self.G and elm2 in self.G:
+		if self.reach.has_path(elm2, elm1):
 			has_removed = self._remove_old_nodes(elm1, elm2)
 
 		# Add the new comparison
+		self.ages.setdefault((elm1, elm2), self.nb_added)
+		self.nb_added += 1
 		self.comparisons.append((elm1, elm2))
 		self.G.add_edge(elm1, elm2)
+		self.reach.add_edge(elm1, elm2)
 		return has_removed
 
 	def add_evaluations(self, elms:Iterable[Eid]):
@@ -96,81 +246,101 @@ class CmpGraph():
 				lastprint_tm = time.time()
 
 	def _remove_old_nodes(self, elm1, elm2):
-		path_from_2_to_1 = list(nx.all_simple_paths(self.G, elm2, elm1)) # if not empty, means there is a series of comparisons telling that elm2 > elm1
-
-		if not path_from_2_to_1:
+		if not self.reach.has_path(elm2, elm1):
 			return False
 
 		# Told that elm2 should be better than elm1, but ancient comparisons tell that elm1 > elm2; need to remove old comparisons until it resolves the conflict
-		# Try to remove them from the oldest to the most recent until it resolves
-
-		# Find all pairs of nodes in all paths between 2 to 1
-		allpairs_inpath = list() # [(elm2, x3), (x3, x4), (x4, elm1), (elm2, x5), (x5, elm1), ...]
-		for path in map(nx.utils.pairwise, path_from_2_to_1):
-			for pair in path:
-				if pair not in allpairs_inpath:
-					allpairs_inpath.append(pair)
-
-		# Sort by oldest to most recent
-		allpairs_inpath.sort(key=lambda p: self.comparisons.index(p))
-
-		# Find what nodes to remove, oldest (first priority), then the fewest possible (second priority)
-		for maxindex in range(0,len(allpairs_inpath)):
-			for num in range(1, maxindex+1):
-				for torm in itertools.combinations(allpairs_inpath[:maxindex], num):
-					newgraph = self.G.copy()
-					newgraph.remove_edges_from(torm)
-					if not nx.has_path(newgraph, elm2, elm1):
-						# Found a set of old comparisons to remove to resolve the conflict
-						for pair in torm:
-							print(f"Removed comparison: {pair[1]} > {pair[0]} (oldest {len(self.comparisons)-self.comparisons.index(pair)}/{len(self.comparisons)} cmps)")
-							self.comparisons.remove(pair)
-						self.G.remove_edges_from(torm)
-						return True
-
-		if nx.has_path(self.G, elm2, elm1):
-			raise('!!! ERROR: A path still exists from', elm2, 'to', elm1, 'after resolution !!!')
-
-	def recommand_comparison(self):
+		# Remove the oldest possible ones (first priority), then the fewest possible (second priority)
+
+		# Comparisons in paths from 2 to 1: from a descendant of elm2 to an ancestor of elm1, sorted by oldest to most recent
+		reach = self.reach
+		i2 = reach.index[elm2]
+		i1 = reach.index[elm1]
+		from2 = reach.desc[i2] | 1 << i2
+		to1 = reach.anc[i1] | 1 << i1
+		inpath = nx.DiGraph()
+		for i in _bits(from2 & to1):
+			for succ in self.G.successors(reach.nodes[i]):
+				if to1 >> reach.index[succ] & 1:
+					inpath.add_edge(reach.nodes[i], succ)
+		allpairs_inpath = sorted(inpath.edges, key=self.ages.get)
+
+		# Fewest oldest comparisons cutting all paths: any of them must be at most the newest of the shortest cutting prefix (bisection)
+		low, high = 1, len(allpairs_inpath)
+		while low < high:
+			mid = (low + high) // 2
+			cut = inpath.copy()
+			cut.remove_edges_from(allpairs_inpath[:mid])
+			if nx.has_path(cut, elm2, elm1):
+				low = mid+1
+			else:
+				high = mid
+		# Then minimum cut of paths, only through this prefix (edges without capacity cannot be cut)
+		for pair in allpairs_inpath[:low]:
+			inpath.edges[pair]['capacity'] = 1
+		_, (reachable, _) = nx.minimum_cut(inpath, elm2, elm1)
+		torm = sorted(((n1, n2) for n1 in reachable for n2 in inpath.successors(n1) if n2 not in reachable), key=self.ages.get)
+
+		# Found a set of old comparisons to remove to resolve the conflict
+		for pair in torm:
+			print(f"Removed comparison: {pair[1]} > {pair[0]} (oldest {len(self.comparisons)-self.comparisons.index(pair)}/{len(self.comparisons)} cmps)")
+			self.comparisons.remove(pair)
+			del self.ages[pair]
+		self.G.remove_edges_from(torm)
+		self.reach.remove_edges(self.G, torm)
+		return True
+
+	def recommand_comparison(self, block:int=256):
+		"""
+		Returns:
+			list[tuple[tuple[Eid,Eid],tuple[int,int]]]: best pairs of nodes to compare, with their elevations (see compute_elevation)
+		"""
 		# For printing progress
 		nbpairs = 0
 		lastprint_tm = time.time()
 
 		bestpairs:list[tuple[tuple[Eid,Eid],tuple[int,int]]] = list() # ((str1, str2), (elev+, elev-))
+		best:tuple[int,int] = None # (min, max) elevations of bestpairs
 
-		# Cache
-		ancest_cache = {n:(nx.ancestors(self.G, n), nx.descendants(self.G, n)) for n in self.G}
+		reach = self.reach
+		size = len(reach.nodes)
+		anc = pack_bits(reach.anc, size)
+		desc = pack_bits(reach.desc, size)
 
-		# Generator of pairs
+		# Pairs of nodes_to_pair, in blocks of rows, keeping only the best pairs so far
 		nodes_to_pair = [n for n in self.G if self.G.degree(n) < 10]
-		pairs = (
-			(pair, compute_elevation(pair[0], pair[1], ancest_cache))
-			for pair in itertools.combinations(nodes_to_pair, 2)
-			if not(pair[0] in ancest_cache[pair[1]][0]
-				or pair[0] in ancest_cache[pair[0]][0])
-		)
-
-		for pair in pairs:
-			nbpairs += 1
-
-			if not bestpairs:
-				bestpairs.append(pair)
+		cols = np.array([reach.index[n] for n in nodes_to_pair], dtype=np.int64)
+		for start in range(0, len(cols), block):
+			rows = cols[start:start+block]
+			elev12, elev21 = compute_elevations(anc, desc, size, rows, cols)
+			# Only pairs (in combinations order) not already ordered by existing comparisons
+			valid = np.triu(np.ones((len(rows), len(cols)), dtype=bool), start+1)
+			valid &= ((anc[rows][:,cols >> 3] | desc[rows][:,cols >> 3]) >> (cols & 7).astype(np.uint8) & 1) == 0
+			if not valid.any():
 				continue
-
-			if nbpairs % 1000 == 0:
-				tm = time.time()
-				if tm - lastprint_tm > 5:
-					print(f"Fetching pairs... - {nbpairs/1000:.0f}k", bestpairs)
-					lastprint_tm = tm
-
-			if pair[1] == bestpairs[0][1]:
-				# Same
-				bestpairs.append(pair)
-			elif (min(pair[1]) > min(bestpairs[0][1])
-				or min(pair[1]) == min(bestpairs[0][1]) and max(pair[1]) > max(bestpairs[0][1])
-			): # Better
+			nbpairs += int(valid.sum())
+
+			low = np.where(valid, np.minimum(elev12, elev21), -1)
+			high = np.where(low == low.max(), np.maximum(elev12, elev21), -1)
+			first = np.unravel_index(np.argmax(high), high.shape) # first pair of the block with best (min, max)
+			key = (int(low[first]), int(high[first]))
+			if best is None or key > best: # Better
+				best = key
 				bestpairs.clear()
-				bestpairs.append(pair)
+				first_elevs = (int(elev12[first]), int(elev21[first]))
+			elif key < best:
+				continue
+			else:
+				first_elevs = bestpairs[0][1]
+
+			# Same
+			for r,c in zip(*np.nonzero(valid & (elev12 == first_elevs[0]) & (elev21 == first_elevs[1]))):
+				bestpairs.append(((reach.nodes[rows[r]], reach.nodes[cols[c]]), first_elevs))
+
+			tm = time.time()
+			if tm - lastprint_tm > 5:
+				print(f"Fetching pairs... - {nbpairs/1000:.0f}k", bestpairs)
+				lastprint_tm = tm
 		return bestpairs
 
 	def draw(self, outputfile:str):
@@ -188,8 +358,8 @@ class CmpGraph():
 		mind=None
 		maxd=None
 		for n in self.G:
-			anc = len(nx.ancestors(self.G, n))
-			dec = len(nx.descendants(self.G, n))
+			anc = self.reach.anc[self.reach.index[n]].bit_count()
+			dec = self.reach.desc[self.reach.index[n]].bit_count()
 
 			x = anc-dec
 			y = anc+dec
@@ -215,7 +385,7 @@ class CmpGraph():
 		print('Preparing graph...')
 
 		# Print connexions from min to max node
-		if nx.has_path(self.G, mind, maxd):
+		if self.reach.has_path(mind, maxd):
 			path_min_to_max = nx.shortest_path(self.G, source=mind, target=maxd)
 			l_x=[]
 			l_y=[]
@@ -1,63 +1,95 @@
 import argparse
 import math
-import random
-import time
-from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from typing import Callable
+import numpy as np
+import pandas as pd
+from model.tournesol_dataset.comparisons import ComparisonFile
 from dao.youtube_api import YTData
-from scripts.elo import updateRating
+from scripts.elo import BT_PRIOR, ELO_TOLERANCE, bradley_terry, run_competition
 
-def compute_elo_ranking(cmpFile:ComparisonFile, YTDATA: YTData, user: str):
+def extract_comparisons(cmpFile:ComparisonFile, YTDATA: YTData, user: str, criterion: str='largely_recommended') -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+	"""
+	Comparisons between videos having Youtube data (if YTDATA is set)
 
-	elo: dict[str,float] = dict() # vid: elo
-
-	comps: list[tuple[str,str,float]] = list()
-	def elo_update_line_parser(line: ComparisonLine):
-		if line.criterion != 'largely_recommended' \
-			or (user and user != line.user) \
-			or (not line.vid1 in YTDATA.videos) or (not line.vid2 in YTDATA.videos) \
-			or (not YTDATA.videos[line.vid1].get('title', '')) or (not YTDATA.videos[line.vid2].get('title', '')):
-			return
-
-		comps.append((line.vid1, line.vid2, line.score/-10.0))
-		elo.setdefault(line.vid1, 1000.0)
-		elo.setdefault(line.vid2, 1000.0)
+	Returns:
+		tuple: (vid1 index, vid2 index, outcome (-1: vid2 best, 1: vid1 best), vids)
+			Videos indexed by order of first appearance (vid1 then vid2 of each comparison)
+	"""
 	print('Extracting comparisons...')
-	cmpFile.foreach(elo_update_line_parser)
-
-
-	ELO_POWER: float = math.sqrt(1/len(elo))
-	print(f"Running competition:", end=' ')
-	start = 0
-	for i in range(1,len(elo)):
-		now = time.time()
-		if now > start + 1:
-			print(i, end=' ', flush=True)
-			start = now
-		# Shuffle comps
-		random.shuffle(comps)
-
-		for c in comps:
-			updatedElo = updateRating(elo[c[0]], elo[c[1]], c[2], ELO_POWER)
-			elo[c[0]] = updatedElo[0]
-			elo[c[1]] = updatedElo[1]
-		if min(elo.values()) <= 0:
-			break
-
-	print(i)
-
-	sortedKeys = sorted(elo.keys(), key=elo.get, reverse=True)
+	known = {vid for vid,video in YTDATA.videos.items() if video.get('title', '')} if YTDATA else None
+	vid1, vid2, score = [np.array([], dtype=object)], [np.array([], dtype=object)], [np.array([], dtype=np.int8)]
+	for batch in cmpFile.iter_batches(criterion=criterion, user=user or None):
+		if known is None:
+			mask = slice(None)
+		else:
+			mask = (pd.Series(batch['vid1']).isin(known) & pd.Series(batch['vid2']).isin(known)).to_numpy()
+		vid1.append(batch['vid1'][mask])
+		vid2.append(batch['vid2'][mask])
+		score.append(batch['score'][mask])
+
+	codes, vids = pd.factorize(np.column_stack((np.concatenate(vid1), np.concatenate(vid2))).ravel())
+	return (codes[0::2], codes[1::2], np.concatenate(score) / -10.0, np.asarray(vids, dtype=object))
+
+def _print_ranking(ranking: dict[str, any], YTDATA: YTData, fmt: Callable[[any], str]):
+	sortedKeys = list(ranking.keys())
 
 	# Show top
 	for vid in sortedKeys[:10]:
-		print(f"{elo[vid]: 7.2f}", YTDATA.videos.get(vid, vid))
+		print(fmt(ranking[vid]), YTDATA.videos.get(vid, vid) if YTDATA else vid)
 
 	print('...')
 
 	# Show bottom
 	for vid in sortedKeys[-10:]:
-		print(f"{elo[vid]: 7.2f}", YTDATA.videos.get(vid, vid))
+		print(fmt(ranking[vid]), YTDATA.videos.get(vid, vid) if YTDATA else vid)
 	print()
 
+def compute_elo_ranking(cmpFile:ComparisonFile, YTDATA: YTData, user: str, criterion: str='largely_recommended', seed: int=None, tolerance: float=ELO_TOLERANCE) -> dict[str,float]:
+	"""
+	Returns:
+		dict[str,float]: {vid: elo}, from highest to lowest elo
+	"""
+	vid1, vid2, outcome, vids = extract_comparisons(cmpFile, YTDATA, user, criterion)
+	if not len(vids):
+		print('No comparison to rank')
+		return dict()
+
+	ELO_POWER: float = math.sqrt(1/len(vids))
+	print(f"Running competition:", end=' ', flush=True)
+	ratings, epochs = run_competition(vid1, vid2, outcome, len(vids), ELO_POWER, len(vids)-1, tolerance=tolerance, seed=seed)
+	print(epochs)
+
+	order = np.argsort(-ratings, kind='stable')
+	elo: dict[str,float] = dict(zip(vids[order].tolist(), ratings[order].tolist()))
+	_print_ranking(elo, YTDATA, lambda rating: f"{rating: 7.2f}")
+	return elo
+
+def compute_bradley_terry_ranking(cmpFile:ComparisonFile, YTDATA: YTData, user: str, criterion: str='largely_recommended', prior: float=BT_PRIOR) -> dict[str,tuple[float,float]]:
+	"""
+	Deterministic alternative to compute_elo_ranking: maximum likelihood Bradley-Terry strengths (with a weak prior) (see scripts.elo.bradley_terry),
+	given on the elo scale (same win probabilities as scripts.elo.scoreToProba, centered on 1000).
+
+	Returns:
+		dict[str,tuple[float,float]]: {vid: (elo, standard error)}, from highest to lowest elo
+	"""
+	vid1, vid2, outcome, vids = extract_comparisons(cmpFile, YTDATA, user, criterion)
+	if not len(vids):
+		print('No comparison to rank')
+		return dict()
+
+	print("Solving Bradley-Terry model:", end=' ', flush=True)
+	strengths, stderr, iterations = bradley_terry(vid1, vid2, outcome, len(vids), prior=prior)
+	print(f"{iterations} iterations")
+
+	to_elo = 400 / math.log(10)
+	order = np.argsort(-strengths, kind='stable')
+	ranking: dict[str,tuple[float,float]] = {
+		vid: (1000 + s*to_elo, e*to_elo)
+		for vid,s,e in zip(vids[order].tolist(), strengths[order].tolist(), stderr[order].tolist())
+	}
+	_print_ranking(ranking, YTDATA, lambda rating: f"{rating[0]: 7.2f} ±{rating[1]:5.1f}")
+	return ranking
+
 
 
 ################
@@ -72,6 +104,9 @@ if __name__ == '__main__':
 	parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
 	parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
 	parser.add_argument('-u', '--user', help='Get statistics for given user only. If unset, will compute global statistics', type=str, default=None)
+	parser.add_argument('--criterion', help='Criterion to rank videos on (default: %(default)s)', type=str, default='largely_recommended')
+	parser.add_argument('-m', '--method', help='elo: random order Elo competition; bt: Bradley-Terry maximum likelihood, with standard errors (default: %(default)s)', choices=['elo', 'bt'], default='elo')
+	parser.add_argument('--seed', help='Random seed of the Elo competition, for reproducible rankings', type=int, default=None)
 
 	args = vars(parser.parse_args())
 
@@ -83,4 +118,7 @@ if __name__ == '__main__':
 	except FileNotFoundError:
 		pass
 
-	compute_elo_ranking(cmpFile, YTDATA, args['user'])
+	if args['method'] == 'bt':
+		compute_bradley_terry_ranking(cmpFile, YTDATA, args['user'], args['criterion'])
+	else:
+		compute_elo_ranking(cmpFile, YTDATA, args['user'], args['criterion'], seed=args['seed'])
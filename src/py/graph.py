@@ -6,13 +6,13 @@ from dao.youtube_api import YTData
 import scripts.grapher as grph
 
 
-def graph(tournesol_dataset, YTDATA: YTData, target_user, ytdata_cache):
+def graph(tournesol_dataset, YTDATA: YTData, target_user, ytdata_cache, workers=1):
 	# Build Graph
 	graph = grph.build_graph(tournesol_dataset, target_user)
 	YTDATA.update(vids=[node for (node, byme) in graph.nodes(data='cmp_by_me') if byme], save=ytdata_cache)
 
 	# Do find most distant nodes
-	grph.add_recommended_nodes(graph, YTDATA.videos)
+	grph.add_recommended_nodes(graph, YTDATA.videos, workers)
 
 	# Sort nodes by degree
 	nodes_order = grph.get_ordered_nodes(graph)
@@ -36,19 +36,22 @@ def graph(tournesol_dataset, YTDATA: YTData, target_user, ytdata_cache):
 ################
 
 
-# Unload parameters
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
-parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
-parser.add_argument('-u', '--user', help='Get statistics for given user. If unset, will compute global statistics', type=str, default=None)
-parser.add_argument('--fetch', help='If set, will fetch youtube API for updating data', action=argparse.BooleanOptionalAction, default=False)
+if __name__ == '__main__':
 
-args = vars(parser.parse_args())
+	# Unload parameters
+	parser = argparse.ArgumentParser()
+	parser.add_argument('-t', '--tournesoldataset', help='Directory where the public dataset is located', default='data/tournesol_dataset', type=str)
+	parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
+	parser.add_argument('-u', '--user', help='Get statistics for given user. If unset, will compute global statistics', type=str, default=None)
+	parser.add_argument('--fetch', help='If set, will fetch youtube API for updating data', action=argparse.BooleanOptionalAction, default=False)
+	parser.add_argument('-w', '--workers', help='Number of processes searching for most distant nodes (default: %(default)s)', type=int, default=1)
 
-YTDATA = YTData()
-try:
-	YTDATA.load(args['cache'])
-except FileNotFoundError:
-	pass
+	args = vars(parser.parse_args())
 
-graph(args['tournesoldataset'], YTDATA, args['user'], args['cache'] if args['fetch'] else None)
+	YTDATA = YTData()
+	try:
+		YTDATA.load(args['cache'])
+	except FileNotFoundError:
+		pass
+
+	graph(args['tournesoldataset'], YTDATA, args['user'], args['cache'] if args['fetch'] else None, args['workers'])
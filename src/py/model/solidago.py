@@ -1,9 +1,12 @@
+import hashlib
+import os
 import zipfile
 from abc import ABC, abstractmethod
 from functools import cached_property
-from typing import BinaryIO, Optional, Union
+from typing import Any, BinaryIO, Callable, Optional, Union
 from urllib.request import urlretrieve
 
+import numpy as np
 import pandas as pd
 
 class TournesolInput(ABC):
@@ -96,133 +99,292 @@ class TournesolInput(ABC):
 		}
 
 
+_NO_ROWS = np.zeros(0, dtype=np.intp)
+
+# Column dtypes of the tables in memory optimized mode
+# (integer dtypes are only used if all values are integers, float32 being used otherwise)
+OPTIMIZED_DTYPES: dict[str, dict[str, str]] = {
+	"comparisons": {
+		"public_username": "category",
+		"criteria": "category",
+		"week_date": "category",
+		"score": "int8",
+		"score_max": "int16",
+		"entity_a": "Int32",
+		"entity_b": "Int32",
+		"user_id": "Int32",
+	},
+	"collective_scores": {
+		"criteria": "category",
+		"uncertainty": "float32",
+		"entity_id": "Int32",
+		"comparisons": "Int32",
+		"users": "Int32",
+	},
+	"individual_scores": {
+		"public_username": "category",
+		"criteria": "category",
+		"uncertainty": "float32",
+		"voting_right": "float32",
+		"entity_id": "Int32",
+		"comparisons": "Int32",
+		"user_id": "Int32",
+	},
+}
+
 class TournesolInputFromPublicDataset(TournesolInput):
-	def __init__(self, dataset_zip: Union[str, BinaryIO]):
+	"""
+	Tables are read from the dataset zip, and derived columns computed, on first access only.
+
+	If cache_dir is set, derived tables are also persisted there (one directory per dataset zip content hash),
+	so that next instances built from the same dataset load them instead of parsing the zip again.
+
+	If memory_optimized is set, tables use compact dtypes (see OPTIMIZED_DTYPES): categories for strings,
+	small or nullable integers for scores & ids, float32 for uncertainties. `memory_report` compares their memory use
+	before and after this optimization.
+	"""
+	def __init__(self, dataset_zip: Union[str, BinaryIO], cache_dir: Optional[str] = None, memory_optimized: bool = False):
 		if isinstance(dataset_zip, str) and (
 			dataset_zip.startswith("http://") or dataset_zip.startswith("https://")
 		):
 			dataset_zip, _headers = urlretrieve(dataset_zip)  # nosec B310
 
-		with zipfile.ZipFile(dataset_zip) as zip_file:
-			with (zipfile.Path(zip_file) / "users.csv").open(mode="rb") as users_file:
-				# keep_default_na=False is required otherwise some public usernames
-				# such as "NA" are converted to float NaN.
-				self.users = pd.read_csv(users_file, keep_default_na=False)
-				self.users.index.name = "user_id"
-				# Fill trust_score on newly created users for which it was not computed yet
-				self.users.trust_score = pd.to_numeric(self.users.trust_score).fillna(0.0)
+		self.dataset_zip = dataset_zip
+		self.cache_dir = cache_dir
+		self.memory_optimized = memory_optimized
+		self._memory_before: dict[str, int] = dict() # {table: memory use before dtypes optimization}
+		self._partitions: dict[tuple[str, str], dict[Any, np.ndarray]] = dict() # See _partition
 
-				self.username_to_user_id = pd.Series(
-					data=self.users.index, index=self.users["public_username"]
-				)
+	@cached_property
+	def dataset_hash(self) -> str:
+		"""sha256 of the dataset zip content"""
+		digest = hashlib.sha256()
+		if isinstance(self.dataset_zip, (str, os.PathLike)):
+			with open(self.dataset_zip, "rb") as file:
+				for block in iter(lambda: file.read(1 << 20), b""):
+					digest.update(block)
+		else:
+			position = self.dataset_zip.tell()
+			self.dataset_zip.seek(0)
+			for block in iter(lambda: self.dataset_zip.read(1 << 20), b""):
+				digest.update(block)
+			self.dataset_zip.seek(position)
+		return digest.hexdigest()
+
+	def _cached(self, name: str, compute: Callable[[], Any]) -> Any:
+		# Load from cache_dir if already persisted, compute (& persist) otherwise
+		if self.cache_dir is None:
+			return compute()
+		if self.memory_optimized:
+			name += ".optimized"
+		path = os.path.join(self.cache_dir, self.dataset_hash, f"{name}.pkl")
+		if os.path.isfile(path):
+			return pd.read_pickle(path)
+		value = compute()
+		os.makedirs(os.path.dirname(path), exist_ok=True)
+		pd.to_pickle(value, path + ".tmp")
+		os.replace(path + ".tmp", path) # Never leave a partially written file
+		return value
+
+	def _optimize(self, table: str, dtf: pd.DataFrame) -> pd.DataFrame:
+		# Convert columns to OPTIMIZED_DTYPES, in memory optimized mode only
+		if not self.memory_optimized:
+			return dtf
+		self._memory_before[table] = int(dtf.memory_usage(deep=True).sum())
+		for column, dtype in OPTIMIZED_DTYPES[table].items():
+			if column not in dtf:
+				continue
+			if dtype.startswith("int") and not (dtf[column] % 1 == 0).all():
+				dtype = "float32"
+			dtf[column] = dtf[column].astype(dtype)
+		return dtf
 
-			with (zipfile.Path(zip_file) / "comparisons.csv").open(mode="rb") as comparison_file:
-				# keep_default_na=False is required otherwise some public usernames
-				# such as "NA" are converted to float NaN.
-				self.comparisons = pd.read_csv(comparison_file, keep_default_na=False)
-				self.entity_id_to_video_id = pd.Series(
-					list(set(self.comparisons.video_a) | set(self.comparisons.video_b)),
-					name="video_id",
-				)
-				self.video_id_to_entity_id = {
-					video_id: entity_id
-					for (entity_id, video_id) in self.entity_id_to_video_id.items()
-				}
-				self.comparisons["entity_a"] = self.comparisons["video_a"].map(
-					self.video_id_to_entity_id
-				)
-				self.comparisons["entity_b"] = self.comparisons["video_b"].map(
-					self.video_id_to_entity_id
-				)
-				self.comparisons.drop(columns=["video_a", "video_b"], inplace=True)
-				self.comparisons = self.comparisons.join(
-					self.username_to_user_id, on="public_username"
-				)
-
-				# List of all groups of public_username,criteria,entity_id present in comparisons
-				user_entity_criteria_pairs = pd.concat([
-					self.comparisons[["public_username", "entity_a", "criteria"]]
-						.rename(columns={"entity_a": "entity_id"}),
-					self.comparisons[["public_username", "entity_b", "criteria"]]
-						.rename(columns={"entity_b": "entity_id"})
-				])  # Will contain duplicates not to be removed
-
-			with (zipfile.Path(zip_file) / "vouchers.csv").open(mode="rb") as vouchers_file:
+	def memory_report(self) -> pd.DataFrame:
+		"""
+		Returns:
+			pd.DataFrame: memory use in bytes (`before`, `after` dtypes optimization) of the tables loaded so far
+				(`before` is NaN for tables loaded from cache_dir)
+		"""
+		report = dict()
+		for table in ("users", "comparisons", "vouchers", "collective_scores", "individual_scores"):
+			if table not in self.__dict__:
+				continue # Not loaded
+			after = int(getattr(self, table).memory_usage(deep=True).sum())
+			before = self._memory_before.get(table, float("nan") if self.memory_optimized and table in OPTIMIZED_DTYPES else after)
+			report[table] = (before, after)
+		return pd.DataFrame.from_dict(report, orient="index", columns=["before", "after"])
+
+	def _read_csv(self, name: str) -> pd.DataFrame:
+		with zipfile.ZipFile(self.dataset_zip) as zip_file:
+			with (zipfile.Path(zip_file) / name).open(mode="rb") as file:
 				# keep_default_na=False is required otherwise some public usernames
 				# such as "NA" are converted to float NaN.
-				self.vouchers = pd.read_csv(vouchers_file, keep_default_na=False)
+				return pd.read_csv(file, keep_default_na=False)
 
-			with (zipfile.Path(zip_file) / "collective_criteria_scores.csv").open(mode="rb") as collective_scores_file:
-				# keep_default_na=False is required otherwise some public usernames
-				# such as "NA" are converted to float NaN.
-				self.collective_scores = pd.read_csv(collective_scores_file, keep_default_na=False)
-				# Convert video to entity_id
-				self.collective_scores["entity_id"] = self.collective_scores["video"].map(
-					self.video_id_to_entity_id
-				)
-				self.collective_scores.drop(columns=["video"], inplace=True)
-
-				# Add a column "comparisons", as the number of comparisons made to this video
-				self.collective_scores["comparisons"] = self.collective_scores.merge(
-					user_entity_criteria_pairs
-						.groupby(["entity_id", "criteria"])
-						.size()
-						.reset_index(name="comparisons"),
-					how="left",  # Keep all data from collective_criteria_scores in same order
-					on=["entity_id", "criteria"],
-				)["comparisons"]
-
-				# Add a column "users", as the number of different users who have rated this video
-				self.collective_scores["users"] = self.collective_scores.merge(
-					user_entity_criteria_pairs
-						.groupby(["entity_id", "criteria"])
-						.public_username
-						.nunique()
-						.reset_index(name="users"),
-					how="left",  # Keep all data from collective_criteria_scores in same order
-					on=["entity_id", "criteria"],
-				)["users"]
-
-			with (zipfile.Path(zip_file) / "individual_criteria_scores.csv").open(mode="rb") as individual_scores_file:
-				# keep_default_na=False is required otherwise some public usernames
-				# such as "NA" are converted to float NaN.
-				self.individual_scores = pd.read_csv(individual_scores_file, keep_default_na=False)
-				# Convert video to entity_id
-				self.individual_scores["entity_id"] = self.individual_scores["video"].map(
-					self.video_id_to_entity_id
-				)
-				self.individual_scores.drop(columns=["video"], inplace=True)
-
-				# Append as a new column the number of comparison made for every user,video,criteria
-				self.individual_scores["comparisons"] = self.individual_scores.merge(
-					user_entity_criteria_pairs
-						.groupby(["public_username", "entity_id", "criteria"])
-						.size()
-						.reset_index(name="comparisons"),
-					how="left",  # Keep all data from collective_criteria_scores in same order
-					on=["public_username", "entity_id", "criteria"],
-				)["comparisons"]
-				self.individual_scores = self.individual_scores.join(
-					self.username_to_user_id,
-					on="public_username"
-				)
+	@cached_property
+	def users(self) -> pd.DataFrame:
+		def compute():
+			users = self._read_csv("users.csv")
+			users.index.name = "user_id"
+			# Fill trust_score on newly created users for which it was not computed yet
+			users.trust_score = pd.to_numeric(users.trust_score).fillna(0.0)
+			return users
+		return self._cached("users", compute)
+
+	@cached_property
+	def username_to_user_id(self) -> pd.Series:
+		return pd.Series(data=self.users.index, index=self.users["public_username"])
+
+	@cached_property
+	def _comparisons_and_entities(self) -> tuple[pd.DataFrame, pd.Series]:
+		# Entity ids are defined while reading comparisons
+		def compute():
+			comparisons = self._read_csv("comparisons.csv")
+			entity_id_to_video_id = pd.Series(
+				sorted(set(comparisons.video_a) | set(comparisons.video_b)), # Sorted, for ids to be the same in every run
+				name="video_id",
+			)
+			video_id_to_entity_id = {
+				video_id: entity_id
+				for (entity_id, video_id) in entity_id_to_video_id.items()
+			}
+			comparisons["entity_a"] = comparisons["video_a"].map(video_id_to_entity_id)
+			comparisons["entity_b"] = comparisons["video_b"].map(video_id_to_entity_id)
+			comparisons.drop(columns=["video_a", "video_b"], inplace=True)
+			comparisons = comparisons.join(self.username_to_user_id, on="public_username")
+			return self._optimize("comparisons", comparisons), entity_id_to_video_id
+		return self._cached("comparisons", compute)
+
+	@cached_property
+	def comparisons(self) -> pd.DataFrame:
+		return self._comparisons_and_entities[0]
+
+	@cached_property
+	def entity_id_to_video_id(self) -> pd.Series:
+		return self._comparisons_and_entities[1]
+
+	@cached_property
+	def video_id_to_entity_id(self) -> dict[str, int]:
+		return {
+			video_id: entity_id
+			for (entity_id, video_id) in self.entity_id_to_video_id.items()
+		}
+
+	@cached_property
+	def _user_entity_criteria_pairs(self) -> pd.DataFrame:
+		# List of all groups of public_username,criteria,entity_id present in comparisons
+		return pd.concat([
+			self.comparisons[["public_username", "entity_a", "criteria"]]
+				.rename(columns={"entity_a": "entity_id"}),
+			self.comparisons[["public_username", "entity_b", "criteria"]]
+				.rename(columns={"entity_b": "entity_id"})
+		])  # Will contain duplicates not to be removed
+
+	@cached_property
+	def vouchers(self) -> pd.DataFrame:
+		return self._cached("vouchers", lambda: self._read_csv("vouchers.csv"))
+
+	@cached_property
+	def collective_scores(self) -> pd.DataFrame:
+		def compute():
+			collective_scores = self._read_csv("collective_criteria_scores.csv")
+			# Convert video to entity_id
+			collective_scores["entity_id"] = collective_scores["video"].map(self.video_id_to_entity_id)
+			collective_scores.drop(columns=["video"], inplace=True)
+
+			# Add a column "comparisons", as the number of comparisons made to this video
+			collective_scores["comparisons"] = collective_scores.merge(
+				self._user_entity_criteria_pairs
+					.groupby(["entity_id", "criteria"], observed=True)
+					.size()
+					.reset_index(name="comparisons"),
+				how="left",  # Keep all data from collective_criteria_scores in same order
+				on=["entity_id", "criteria"],
+			)["comparisons"]
+
+			# Add a column "users", as the number of different users who have rated this video
+			collective_scores["users"] = collective_scores.merge(
+				self._user_entity_criteria_pairs
+					.groupby(["entity_id", "criteria"], observed=True)
+					.public_username
+					.nunique()
+					.reset_index(name="users"),
+				how="left",  # Keep all data from collective_criteria_scores in same order
+				on=["entity_id", "criteria"],
+			)["users"]
+			return self._optimize("collective_scores", collective_scores)
+		return self._cached("collective_scores", compute)
+
+	@cached_property
+	def individual_scores(self) -> pd.DataFrame:
+		def compute():
+			individual_scores = self._read_csv("individual_criteria_scores.csv")
+			# Convert video to entity_id
+			individual_scores["entity_id"] = individual_scores["video"].map(self.video_id_to_entity_id)
+			individual_scores.drop(columns=["video"], inplace=True)
+
+			# Append as a new column the number of comparison made for every user,video,criteria
+			individual_scores["comparisons"] = individual_scores.merge(
+				self._user_entity_criteria_pairs
+					.groupby(["public_username", "entity_id", "criteria"], observed=True)
+					.size()
+					.reset_index(name="comparisons"),
+				how="left",  # Keep all data from collective_criteria_scores in same order
+				on=["public_username", "entity_id", "criteria"],
+			)["comparisons"]
+			individual_scores = individual_scores.join(self.username_to_user_id, on="public_username")
+			return self._optimize("individual_scores", individual_scores)
+		return self._cached("individual_scores", compute)
 
 	@classmethod
-	def download(cls) -> "TournesolInputFromPublicDataset":
-		return cls(dataset_zip="https://api.tournesol.app/exports/all")
+	def download(cls, cache_dir: Optional[str] = None) -> "TournesolInputFromPublicDataset":
+		return cls(dataset_zip="https://api.tournesol.app/exports/all", cache_dir=cache_dir)
+
+	def _partition(self, table: str, column: str) -> dict[Any, np.ndarray]:
+		"""
+		Returns:
+			dict[Any, np.ndarray]: {value: positions of the rows of table having this value in column}, built once per column.
+				Column `entity` of comparisons stands for `entity_a` or `entity_b`.
+		"""
+		key = (table, column)
+		if key not in self._partitions:
+			dtf: pd.DataFrame = getattr(self, table)
+			if table == "comparisons" and column == "entity":
+				entities = pd.Series(np.concatenate([dtf["entity_a"].to_numpy(), dtf["entity_b"].to_numpy()]))
+				positions = np.tile(np.arange(len(dtf)), 2)
+				# Sorted & unique positions (a comparison of an entity against itself is there once)
+				self._partitions[key] = {
+					entity: np.unique(positions[idx])
+					for entity, idx in entities.groupby(entities, sort=False).indices.items()
+				}
+			else:
+				self._partitions[key] = dtf.groupby(column, observed=True, sort=False).indices
+		return self._partitions[key]
+
+	def _select(self, table: str, **filters) -> pd.DataFrame:
+		# Rows of table matching all given {column: value} filters (None values being ignored), in table order.
+		# Rows are taken from the smallest matching partition, then filtered on other columns.
+		filters = {column: value for column, value in filters.items() if value is not None}
+		dtf: pd.DataFrame = getattr(self, table)
+		if not filters:
+			return dtf
+		partitions = sorted(
+			((column, value, self._partition(table, column).get(value, _NO_ROWS)) for column, value in filters.items()),
+			key=lambda cvp: len(cvp[2]),
+		)
+		rows = partitions[0][2]
+		for column, value, _ in partitions[1:]:
+			if column == "entity":
+				rows = rows[(dtf["entity_a"].to_numpy()[rows] == value) | (dtf["entity_b"].to_numpy()[rows] == value)]
+			else:
+				rows = rows[dtf[column].to_numpy()[rows] == value]
+		return dtf.iloc[rows]
 
 	def get_comparisons(self, criteria=None, user_id=None, vid=None) -> pd.DataFrame:
-		dtf = self.comparisons.copy(deep=False)
-		if criteria is not None:
-			dtf = dtf[dtf.criteria == criteria]
-		if user_id is not None:
-			dtf = dtf[dtf.user_id == user_id]
+		entity = None
 		if vid is not None:
-			_vid = self.video_id_to_entity_id.get(vid[3:] if vid[:3] == 'yt:' else vid, None)
-			if not _vid:
-				dtf = pd.DataFrame(columns=dtf.columns)
-			else:
-				dtf = dtf[(dtf.entity_a == _vid) | (dtf.entity_b == _vid)]
+			entity = self.video_id_to_entity_id.get(vid[3:] if vid[:3] == 'yt:' else vid, -1)
+		dtf = self._select("comparisons", criteria=criteria, user_id=user_id, entity=entity).copy(deep=False)
 		dtf["weight"] = 1
 		if "score_max" not in dtf:
 			# For compatibility with older datasets
@@ -238,23 +400,37 @@ class TournesolInputFromPublicDataset(TournesolInput):
 			"weight"
 		]]
 
+	@cached_property
+	def _user_entity_pairs(self) -> pd.DataFrame:
+		# Unique (user_id, entity_id) pairs present in comparisons, sorted, with the user trust_score
+		pairs = pd.DataFrame({
+			"user_id": pd.concat([self.comparisons["user_id"], self.comparisons["user_id"]], ignore_index=True),
+			"entity_id": pd.concat([self.comparisons["entity_a"], self.comparisons["entity_b"]], ignore_index=True),
+		})
+		pairs = pairs.dropna().drop_duplicates().sort_values(["user_id", "entity_id"], ignore_index=True)
+		pairs["trust_score"] = pairs["user_id"].map(self.users["trust_score"])
+		return pairs
+
+	@cached_property
+	def scaling_calibration_user_ids(self) -> pd.Index:
+		"""
+		Returns:
+			pd.Index: ids of the (at most MAX_SCALING_CALIBRATION_USERS) trusted users having rated the most entities,
+				ties being broken by lowest user_id
+		"""
+		def compute():
+			pairs = self._user_entity_pairs
+			counts = pairs[pairs.trust_score > self.SCALING_CALIBRATION_MIN_TRUST_SCORE]["user_id"].value_counts()
+			counts = counts.sort_index(kind="stable").sort_values(ascending=False, kind="stable")
+			return counts.index[: self.MAX_SCALING_CALIBRATION_USERS]
+		return self._cached("scaling_calibration_user_ids", compute)
+
 	@cached_property
 	def ratings_properties(self):
-		user_entities_pairs = pd.Series(
-			iter(
-				set(self.comparisons.groupby(["user_id", "entity_a"]).indices.keys())
-				| set(self.comparisons.groupby(["user_id", "entity_b"]).indices.keys())
-			)
-		)
-		dtf = pd.DataFrame([*user_entities_pairs], columns=["user_id", "entity_id"])
+		dtf = self._user_entity_pairs[["user_id", "entity_id"]].copy()
 		dtf["is_public"] = True
-		dtf["trust_score"] = dtf["user_id"].map(self.users["trust_score"])
-		scaling_calibration_user_ids = (
-			dtf[dtf.trust_score > self.SCALING_CALIBRATION_MIN_TRUST_SCORE]["user_id"]
-			.value_counts(sort=True)[: self.MAX_SCALING_CALIBRATION_USERS]
-			.index
-		)
-		dtf["is_scaling_calibration_user"] = dtf["user_id"].isin(scaling_calibration_user_ids)
+		dtf["trust_score"] = self._user_entity_pairs["trust_score"]
+		dtf["is_scaling_calibration_user"] = dtf["user_id"].isin(self.scaling_calibration_user_ids).astype(bool)
 		return dtf
 
 	def get_individual_scores(
@@ -263,13 +439,7 @@ class TournesolInputFromPublicDataset(TournesolInput):
 		entity_id: Optional[str] = None,
 		criteria: Optional[str] = None,
 	) -> pd.DataFrame:
-		dtf = self.individual_scores
-		if criteria is not None:
-			dtf = dtf[dtf.criteria == criteria]
-		if user_id is not None:
-			dtf = dtf[dtf.user_id == user_id]
-		if entity_id is not None:
-			dtf = dtf[dtf.entity_id == entity_id]
+		dtf = self._select("individual_scores", criteria=criteria, user_id=user_id, entity_id=entity_id)
 		return dtf[[
 			"user_id",
 			"entity_id",
@@ -285,11 +455,7 @@ class TournesolInputFromPublicDataset(TournesolInput):
 		entity_id: Optional[str] = None,
 		criteria: Optional[str] = None,
 	) -> pd.DataFrame:
-		dtf = self.collective_scores
-		if criteria is not None:
-			dtf = dtf[dtf.criteria == criteria]
-		if entity_id is not None:
-			dtf = dtf[dtf.entity_id == entity_id]
+		dtf = self._select("collective_scores", criteria=criteria, entity_id=entity_id)
 		return dtf[["entity_id", "criteria", "score", "uncertainty", "users", "comparisons"]]
 
 	def get_vouches(self):
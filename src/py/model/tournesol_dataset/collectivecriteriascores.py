@@ -1,36 +1,82 @@
-import zipfile
-from typing import Callable, Iterable
+from typing import Callable, Iterable, Iterator, NamedTuple
 
-class CCSLine:
-	def __init__(self, sp: list[str]):
+import numpy as np
+from model.tournesol_dataset.identifiers import CriterionIds, VideoIds
+from model.tournesol_dataset.csvreader import BATCH_SIZE, iter_csv_batches, iter_csv_batches_parallel
+from model.tournesol_dataset.snapshot import load_snapshot
+
+class CCSLine(NamedTuple):
+	video: str
+	criterion: str
+	score: float
+	uncertainty: float
+
+	@classmethod
+	def from_csv(cls, sp: list[str]) -> 'CCSLine':
+		"""From a split csv line (video,criteria,score,uncertainty)"""
 		try:
-			self.video = sp[0]
-			self.criterion = sp[1]
-			self.score = float(sp[2])
-			self.uncertainty = float(sp[3])
+			return cls(VideoIds.intern(sp[0]), CriterionIds.intern(sp[1]), float(sp[2]), float(sp[3]))
 		except:
 			print(sp)
 			raise
 
+	@classmethod
+	def from_batch(cls, batch: dict[str, np.ndarray]) -> Iterator['CCSLine']:
+		"""Bulk constructor: lines of a batch of columns (see CollectiveCriteriaScoresFile.iter_batches)"""
+		return map(cls._make, zip(
+			VideoIds.intern_all(batch['video']).tolist(),
+			CriterionIds.intern_all(batch['criterion']).tolist(),
+			batch['score'].tolist(),
+			batch['uncertainty'].tolist(),
+		))
+
 
 class CollectiveCriteriaScoresFile:
-	def __init__(self, source):
+	def __init__(self, source, workers: int=1):
+		"""
+		Args:
+			source: dataset zip (path or file object)
+			workers (int, optional): Number of processes parsing the csv file in parallel (not used when reading from a snapshot)
+		"""
 		self.zip = source
+		self.workers = workers
 
 	def foreach(self, fn: Callable[[CCSLine], None]):
-		with zipfile.ZipFile(self.zip) as zip_file:
-			with (zipfile.Path(zip_file) / 'collective_criteria_scores.csv').open(mode='r', encoding='utf-8') as cmpFile:
-				# video,criteria,score,uncertainty
-
-				# Skip first line (headers)
-				cmpFile.readline()
-
-				while True:
-					line = cmpFile.readline()
-					# if line is empty, end of file is reached
-					if not line:
-						break
-					fn(CCSLine(line.strip().split(',')))
+		snapshot = load_snapshot(self.zip)
+		if snapshot:
+			# Snapshot vocabularies are already interned
+			for line in map(CCSLine._make, snapshot.iter_rows('collective_criteria_scores', ['video', 'criteria', 'score', 'uncertainty'])):
+				fn(line)
+			return
+
+		for batch in self.iter_batches():
+			for line in CCSLine.from_batch(batch):
+				fn(line)
+
+	def iter_batches(self, batch_size: int=BATCH_SIZE, criterion: str=None) -> Iterator[dict[str, np.ndarray]]:
+		"""
+		Iterate over collective scores by chunks of rows, as numpy columns named as CCSLine attributes
+
+		Args:
+			batch_size (int, optional): Maximum number of rows read per batch
+			criterion (str, optional): Filter to given criterion only. None means no filtering on criteria.
+
+		Yields:
+			dict[str, np.ndarray]: columns `video`, `criterion` (str), `score` and `uncertainty` (float)
+		"""
+		columns = {'video': 'video', 'criterion': 'criteria', 'score': 'score', 'uncertainty': 'uncertainty'}
+		equals = {'criteria': criterion} if criterion is not None else None
+
+		snapshot = load_snapshot(self.zip)
+		if snapshot:
+			yield from snapshot.iter_batches('collective_criteria_scores', columns, batch_size=batch_size, equals=equals)
+			return
+
+		dtypes = {'score': 'float64', 'uncertainty': 'float64'}
+		if self.workers > 1:
+			yield from iter_csv_batches_parallel(self.zip, 'collective_criteria_scores.csv', columns, dtypes, self.workers, equals=equals)
+		else:
+			yield from iter_csv_batches(self.zip, 'collective_criteria_scores.csv', columns, dtypes, batch_size=batch_size, equals=equals)
 
 	def get_scores(self, criterion:str, vids: Iterable[str]=None) -> dict[str,dict[str,tuple[float,float]]]:
 		"""
@@ -1,39 +1,266 @@
-import zipfile
-from typing import Callable
+from typing import Callable, Iterator, NamedTuple
 
-class ComparisonLine:
-	def __init__(self, sp: dict[str,str]):
+import numpy as np
+from model.tournesol_dataset.identifiers import CriterionIds, UserIds, VideoIds
+from model.tournesol_dataset.csvreader import BATCH_SIZE, iter_csv_batches, iter_csv_batches_parallel
+from model.tournesol_dataset.snapshot import load_snapshot
+from utils import instrument
+
+class ComparisonLine(NamedTuple):
+	# Immutable & slotted: no per-instance dict, hashable, compared by values
+	user: str
+	vid1: str
+	vid2: str
+	criterion: str
+	score: int
+	date: str
+
+	@classmethod
+	def from_dict(cls, sp: dict[str,str]) -> 'ComparisonLine':
+		"""From a csv row as {column: value} (public_username,video_a,video_b,criteria,score,score_max,week_date)"""
 		try:
-			# score,score_max,week_date
-			self.user = sp['public_username']
-			self.vid1 = sp['video_a']
-			self.vid2 = sp['video_b']
-			self.criterion = sp['criteria']
-			self.score = int(float(sp['score']))
-			self.date = sp['week_date']
+			return cls(
+				UserIds.intern(sp['public_username']),
+				VideoIds.intern(sp['video_a']),
+				VideoIds.intern(sp['video_b']),
+				CriterionIds.intern(sp['criteria']),
+				int(float(sp['score'])),
+				sp['week_date'],
+			)
 		except:
 			print(sp)
 			raise
 
+	@classmethod
+	def from_batch(cls, batch: dict[str, np.ndarray]) -> Iterator['ComparisonLine']:
+		"""Bulk constructor: lines of a batch of columns (see ComparisonFile.iter_batches)"""
+		return map(cls._make, zip(
+			UserIds.intern_all(batch['user']).tolist(),
+			VideoIds.intern_all(batch['vid1']).tolist(),
+			VideoIds.intern_all(batch['vid2']).tolist(),
+			CriterionIds.intern_all(batch['criterion']).tolist(),
+			batch['score'].tolist(),
+			batch['date'].tolist(),
+		))
+
 
 class ComparisonFile:
-	def __init__(self, source):
+	def __init__(self, source, workers: int=1):
+		"""
+		Args:
+			source: dataset zip (path or file object)
+			workers (int, optional): Number of processes parsing the csv file in parallel (not used when reading from a snapshot)
+		"""
 		self.zip = source
+		self.workers = workers
+
+	def foreach(self, fn: Callable[[ComparisonLine], None], **filters):
+		"""
+		Args:
+			fn (function(ComparisonLine)): called on every comparison, in file order
+			filters: `criterion`, `user`, `video`, `since` and/or `until`, as in `iter_batches`
+		"""
+		snapshot = load_snapshot(self.zip)
+		filters = {k:v for k,v in filters.items() if v is not None}
+		with instrument.span('ComparisonFile.foreach', snapshot=snapshot is not None, **filters):
+			if snapshot and not filters:
+				# Snapshot vocabularies are already interned
+				for line in map(ComparisonLine._make, snapshot.iter_rows('comparisons', ['user', 'video_a', 'video_b', 'criteria', 'score', 'week_date'])):
+					fn(line)
+				instrument.count('comparisons.rows', len(snapshot['comparisons']))
+				return
+
+			for batch in self.iter_batches(**filters):
+				for line in ComparisonLine.from_batch(batch):
+					fn(line)
+				instrument.count('comparisons.rows', len(batch['score']))
+
+	def iter_batches(self,
+		batch_size: int=BATCH_SIZE,
+		criterion: str=None,
+		user: str=None,
+		since: str=None,
+		video: str=None,
+		until: str=None,
+	) -> Iterator[dict[str, np.ndarray]]:
+		"""
+		Iterate over comparisons by chunks of rows, as numpy columns named as ComparisonLine attributes.
+		Memory use is bounded by batch_size, whatever the size of the dataset.
+		When reading from a snapshot, filtered rows are found through its indexes instead of scanning all comparisons.
+
+		Args:
+			batch_size (int, optional): Maximum number of rows read per batch (when parsing with several workers, batches are blocks of `csvreader.PARALLEL_BLOCK_SIZE` bytes instead)
+			criterion (str, optional): Filter to given criterion only. None means no filtering on criteria.
+			user (str, optional): Filter to given user only. None means no filtering on users.
+			since (str, optional): Filter to comparisons having week_date greater or equal to this date (ISO format). None means no filtering on dates.
+			video (str, optional): Filter to comparisons of given video (as vid1 or vid2). None means no filtering on videos.
+			until (str, optional): Filter to comparisons having week_date strictly lower than this date (ISO format). None means no filtering on dates.
+
+		Yields:
+			dict[str, np.ndarray]: columns `user`, `vid1`, `vid2`, `criterion`, `date` (str) and `score` (int8)
+		"""
+		snapshot = load_snapshot(self.zip)
+		if snapshot:
+			yield from snapshot.iter_batches('comparisons',
+				{'user': 'user', 'vid1': 'video_a', 'vid2': 'video_b', 'criterion': 'criteria', 'score': 'score', 'date': 'week_date'},
+				batch_size=batch_size,
+				equals={k:v for k,v in (('criteria', criterion), ('user', user), ('video', video)) if v is not None},
+				date_from=since,
+				date_to=until,
+			)
+			return
+
+		columns = {'user': 'public_username', 'vid1': 'video_a', 'vid2': 'video_b', 'criterion': 'criteria', 'score': 'score', 'date': 'week_date'}
+		equals = {k:v for k,v in (('criteria', criterion), ('public_username', user)) if v is not None}
+		if self.workers > 1:
+			batches = iter_csv_batches_parallel(self.zip, 'comparisons.csv', columns, {'score': 'int8'}, self.workers, equals=equals, date_from=since, date_to=until)
+		else:
+			batches = iter_csv_batches(self.zip, 'comparisons.csv', columns, {'score': 'int8'}, batch_size=batch_size, equals=equals, date_from=since, date_to=until)
+		if video is None:
+			yield from batches
+			return
+		for batch in batches:
+			mask = (batch['vid1'] == video) | (batch['vid2'] == video)
+			if mask.any():
+				yield _filter_batch(batch, mask)
+
+	def comparisons_for_user(self, user: str, criterion: str=None) -> list[ComparisonLine]:
+		"""
+		Returns:
+			list[ComparisonLine]: all comparisons made by given user (on given criterion only if set), in file order
+		"""
+		lines: list[ComparisonLine] = list()
+		self.foreach(lines.append, user=user, criterion=criterion)
+		return lines
+
+	def comparisons_for_video(self, video: str, criterion: str=None) -> list[ComparisonLine]:
+		"""
+		Returns:
+			list[ComparisonLine]: all comparisons involving given video (on given criterion only if set), in file order
+		"""
+		lines: list[ComparisonLine] = list()
+		self.foreach(lines.append, video=video, criterion=criterion)
+		return lines
+
+	def comparisons_between(self, date_from: str=None, date_to: str=None, criterion: str=None) -> list[ComparisonLine]:
+		"""
+		Args:
+			date_from (str, optional): Included lower bound of week_date (ISO format). None means no lower bound.
+			date_to (str, optional): Excluded upper bound of week_date (ISO format). None means no upper bound.
+
+		Returns:
+			list[ComparisonLine]: all comparisons made in given period (on given criterion only if set), in file order
+		"""
+		lines: list[ComparisonLine] = list()
+		self.foreach(lines.append, since=date_from, until=date_to, criterion=criterion)
+		return lines
+
+	def scan(self, **filters) -> 'ComparisonScan':
+		"""
+		Args:
+			filters: `criterion`, `user`, `video`, `since` and/or `until`, as in `iter_batches`, applied to all consumers of the scan
+
+		Returns:
+			ComparisonScan: a scan of this file, to which consumers are to be registered before running it
+		"""
+		return ComparisonScan(self, **filters)
+
+
+def _filter_batch(batch: dict[str, np.ndarray], mask: np.ndarray) -> dict[str, np.ndarray]:
+	return {c: v[mask] for c,v in batch.items()}
+
+
+class RetainedComparisons:
+	"""
+	Comparisons kept in memory by a ComparisonScan, to be consumed again after the scan without re-reading the file.
+	Offers the same reading methods as ComparisonFile.
+	"""
+	def __init__(self):
+		self.batches: list[dict[str, np.ndarray]] = list()
+
+	def __len__(self):
+		return sum(len(b['user']) for b in self.batches)
+
+	def iter_batches(self, criterion: str=None, user: str=None, since: str=None, video: str=None, until: str=None) -> Iterator[dict[str, np.ndarray]]:
+		for batch in self.batches:
+			mask = np.ones(len(batch['user']), dtype=bool)
+			if criterion is not None:
+				mask &= batch['criterion'] == criterion
+			if user is not None:
+				mask &= batch['user'] == user
+			if video is not None:
+				mask &= (batch['vid1'] == video) | (batch['vid2'] == video)
+			if since:
+				mask &= batch['date'] >= since
+			if until:
+				mask &= batch['date'] < until
+			if mask.any():
+				yield batch if mask.all() else _filter_batch(batch, mask)
+
+	def foreach(self, fn: Callable[[ComparisonLine], None], **filters):
+		for batch in self.iter_batches(**filters):
+			for line in ComparisonLine.from_batch(batch):
+				fn(line)
+
+
+class ComparisonScan:
+	"""
+	Feed several consumers from a single decompression & parsing pass over the comparisons file.
+
+	Usage:
+		scan = cmpFile.scan()
+		scan.add(fn1)                          # fn1(line) called on every comparison
+		scan.add_batches(fn2)                  # fn2(batch) called on every batch of comparisons (see ComparisonFile.iter_batches)
+		kept = scan.retain(lambda b: b['criterion'] == 'largely_recommended') # Keep some comparisons in memory
+		scan.then(lambda: kept.foreach(fn3))   # Second phase, once all comparisons have been read
+		scan.run()
+	"""
+	def __init__(self, cmpFile: ComparisonFile, batch_size: int=BATCH_SIZE, **filters):
+		self.cmpFile = cmpFile
+		self.batch_size = batch_size
+		self.filters = filters
+		self.line_consumers: list[Callable[[ComparisonLine], None]] = list()
+		self.batch_consumers: list[Callable[[dict[str, np.ndarray]], None]] = list()
+		self.retained: list[tuple[Callable[[dict[str, np.ndarray]], np.ndarray]|None, RetainedComparisons]] = list()
+		self.second_phase: list[Callable[[], None]] = list()
+
+	def add(self, fn: Callable[[ComparisonLine], None]):
+		self.line_consumers.append(fn)
+
+	def add_batches(self, fn: Callable[[dict[str, np.ndarray]], None]):
+		self.batch_consumers.append(fn)
+
+	def retain(self, keep: Callable[[dict[str, np.ndarray]], np.ndarray]=None) -> RetainedComparisons:
+		"""
+		Args:
+			keep (function(batch) -> boolean mask, optional): Selects comparisons to keep in memory. None keeps all of them.
 
-	def foreach(self, fn: Callable[[ComparisonLine], None]):
-		with zipfile.ZipFile(self.zip) as zip_file:
-			with (zipfile.Path(zip_file) / 'comparisons.csv').open(mode='r', encoding='utf-8') as cmpFile:
-				# public_username,video_a,video_b,criteria,score
+		Returns:
+			RetainedComparisons: filled with kept comparisons once the scan has run
+		"""
+		retained = RetainedComparisons()
+		self.retained.append((keep, retained))
+		return retained
 
-				# First line (headers)
-				firstline = list(map(lambda s: s.strip(), cmpFile.readline().split(',')))
+	def then(self, fn: Callable[[], None]):
+		"""Register a second phase step, called (in registration order) once the file has been fully read"""
+		self.second_phase.append(fn)
 
-				while True:
-					line = cmpFile.readline()
-					# if line is empty, end of file is reached
-					if not line:
-						break
+	def run(self):
+		for batch in self.cmpFile.iter_batches(batch_size=self.batch_size, **self.filters):
+			for fn in self.batch_consumers:
+				fn(batch)
+			if self.line_consumers:
+				for line in ComparisonLine.from_batch(batch):
+					for fn in self.line_consumers:
+						fn(line)
+			for keep, retained in self.retained:
+				if keep is None:
+					retained.batches.append(batch)
+					continue
+				mask = keep(batch)
+				if mask.any():
+					retained.batches.append(batch if mask.all() else _filter_batch(batch, mask))
 
-					spt = line.split(',')
-					dta = {firstline[i]: spt[i].strip() for i in range(len(spt))}
-					fn(ComparisonLine(dta))
+		for fn in self.second_phase:
+			fn()
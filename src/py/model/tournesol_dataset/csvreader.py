@@ -0,0 +1,140 @@
+import io
+import zipfile
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+BATCH_SIZE = 1<<16 # Default number of rows per batch
+PARALLEL_BLOCK_SIZE = 1<<23 # Default number of bytes parsed at once by a worker process
+
+def iter_csv_batches(
+	source,
+	member: str,
+	columns: dict[str, str],
+	dtypes: dict[str, str],
+	batch_size: int = BATCH_SIZE,
+	equals: dict[str, str] = None,
+	date_from: str = None,
+	date_to: str = None,
+) -> Iterator[dict[str, np.ndarray]]:
+	"""
+	Stream a csv file of the dataset zip by chunks of rows, as numpy columns.
+	Only one chunk is decompressed & parsed in memory at a time.
+
+	Args:
+		source: dataset zip (path or file object)
+		member (str): csv file name in the zip
+		columns (dict[str, str]): {output name: csv column}
+		dtypes (dict[str, str]): {csv column: numpy dtype} for non-string columns (others are kept as str objects)
+		batch_size (int, optional): maximum number of rows (before filtering) per batch
+		equals (dict[str, str], optional): {csv column: value} keep only rows having this value
+		date_from (str, optional): keep only rows having `week_date` greater or equal to this date (ISO format)
+		date_to (str, optional): keep only rows having `week_date` strictly lower than this date (ISO format)
+
+	Yields:
+		dict[str, np.ndarray]: {output name: column values} (empty batches are skipped)
+	"""
+	for chunk in iter_csv_chunks(source, member, batch_size):
+		batch = _to_batch(chunk, columns, dtypes, equals, date_from, date_to)
+		if batch:
+			yield batch
+
+def iter_csv_chunks(source, member: str, batch_size: int = BATCH_SIZE) -> Iterator[pd.DataFrame]:
+	"""
+	Stream a csv file of the dataset zip by chunks of at most batch_size rows, all values being kept as str
+	"""
+	with zipfile.ZipFile(source) as zip_file:
+		with (zipfile.Path(zip_file) / member).open(mode='rb') as file:
+			# keep_default_na=False is required otherwise some public usernames
+			# such as "NA" are converted to float NaN.
+			yield from pd.read_csv(file, keep_default_na=False, dtype=str, chunksize=batch_size)
+
+
+def _to_batch(chunk: pd.DataFrame, columns: dict[str, str], dtypes: dict[str, str], equals: dict[str, str], date_from: str, date_to: str, typed_str: bool=False) -> dict[str, np.ndarray]|None:
+	mask = np.ones(len(chunk), dtype=bool)
+	for column, value in (equals or {}).items():
+		mask &= (chunk[column] == value).to_numpy()
+	if date_from:
+		mask &= (chunk['week_date'] >= date_from).to_numpy()
+	if date_to:
+		mask &= (chunk['week_date'] < date_to).to_numpy()
+	if not mask.all():
+		chunk = chunk[mask]
+	if chunk.empty:
+		return None
+
+	batch: dict[str, np.ndarray] = dict()
+	for name, column in columns.items():
+		if column in dtypes:
+			values = pd.to_numeric(chunk[column]).to_numpy()
+			if np.dtype(dtypes[column]).kind == 'i' and values.dtype.kind == 'f':
+				values = np.trunc(values) # int(float(value))
+			batch[name] = values.astype(dtypes[column])
+		else:
+			# Fixed width unicode arrays are much cheaper to send back from worker processes than str objects
+			batch[name] = chunk[column].to_numpy(dtype=str if typed_str else object)
+	return batch
+
+def _parse_block(header: bytes, block: bytes, columns: dict[str, str], dtypes: dict[str, str], equals: dict[str, str], date_from: str, date_to: str) -> dict[str, np.ndarray]|None:
+	# Runs in worker processes
+	chunk = pd.read_csv(io.BytesIO(header + block), keep_default_na=False, dtype=str)
+	return _to_batch(chunk, columns, dtypes, equals, date_from, date_to, typed_str=True)
+
+def _untype_str(batch: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+	# Back to arrays of str objects, as returned by `iter_csv_batches`
+	return {name: values.astype(object) if values.dtype.kind == 'U' else values for name, values in batch.items()}
+
+def iter_csv_batches_parallel(
+	source,
+	member: str,
+	columns: dict[str, str],
+	dtypes: dict[str, str],
+	workers: int,
+	equals: dict[str, str] = None,
+	date_from: str = None,
+	date_to: str = None,
+	block_size: int = PARALLEL_BLOCK_SIZE,
+) -> Iterator[dict[str, np.ndarray]]:
+	"""
+	Same as `iter_csv_batches`, parsing being done by a pool of worker processes.
+
+	The csv file is decompressed by blocks of about block_size bytes, cut on line ends, each block being parsed
+	into typed arrays by a worker process. Batches (one per block) are yielded in the same order as in the file.
+	At most 2 blocks per worker are pending at a time, so that memory stays bounded.
+	String columns are sent back by workers as fixed width unicode arrays, and converted to arrays of str objects
+	before being yielded, so that batches have the same dtypes as the ones of `iter_csv_batches`.
+	"""
+	with zipfile.ZipFile(source) as zip_file:
+		with (zipfile.Path(zip_file) / member).open(mode='rb') as file:
+			header = file.readline()
+			with ProcessPoolExecutor(max_workers=workers) as pool:
+				pending: deque[Future] = deque()
+				remainder = b''
+				while True:
+					block = file.read(block_size)
+					if block:
+						block = remainder + block
+						cut = block.rfind(b'\n') + 1
+						if cut == 0: # No line end in block (line longer than block_size)
+							remainder = block
+							continue
+						block, remainder = block[:cut], block[cut:]
+					else:
+						# End of file: parse last line if not ended by a line end
+						block, remainder = remainder, b''
+						if not block.strip():
+							break
+
+					pending.append(pool.submit(_parse_block, header, block, columns, dtypes, equals, date_from, date_to))
+					while len(pending) >= 2*workers:
+						batch = pending.popleft().result()
+						if batch:
+							yield _untype_str(batch)
+
+				while pending:
+					batch = pending.popleft().result()
+					if batch:
+						yield _untype_str(batch)
@@ -0,0 +1,251 @@
+"""
+Differences between two Tournesol public dataset exports (e.g. two consecutive weekly zips).
+
+Rows of each csv file are identified by their key columns (see DIFF_TABLES). Both exports are streamed once to hash
+every row (only 2 hashes per row are kept in memory), then only the added, removed and changed rows are read again.
+A diff can then be applied to the snapshot of the older export to get the snapshot of the newer one, without parsing
+the whole newer export.
+
+Usage (from `src/py`):
+	`python -m model.tournesol_dataset.diff data/tournesol_dataset_old.zip data/tournesol_dataset_new.zip [--apply]`
+"""
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+from model.tournesol_dataset.csvreader import BATCH_SIZE, iter_csv_chunks
+from model.tournesol_dataset.snapshot import TABLES, DatasetSnapshot, encode_tables, load_snapshot, snapshot_path, write_snapshot
+
+# table: (csv file, key columns)
+DIFF_TABLES: dict[str, tuple[str, list[str]]] = {
+	'users': ('users.csv', ['public_username']),
+	'comparisons': ('comparisons.csv', ['public_username', 'video_a', 'video_b', 'criteria']),
+	'collective_criteria_scores': ('collective_criteria_scores.csv', ['video', 'criteria']),
+	'individual_criteria_scores': ('individual_criteria_scores.csv', ['public_username', 'video', 'criteria']),
+}
+
+
+class TableDiff:
+	"""
+	self.added: pd.DataFrame (rows of the new export whose key is not in the old one)
+	self.removed: pd.DataFrame (key columns of the rows of the old export whose key is not in the new one)
+	self.changed: pd.DataFrame (rows of the new export whose key is in the old one, with other values)
+	All values are kept as str, as in the csv files.
+	"""
+	def __init__(self, table: str, added: pd.DataFrame, removed: pd.DataFrame, changed: pd.DataFrame):
+		self.table = table
+		self.added = added
+		self.removed = removed
+		self.changed = changed
+
+	@property
+	def upserted(self) -> pd.DataFrame:
+		"""Rows of the new export that are not in the old one as is (added & changed ones)"""
+		return pd.concat([self.added, self.changed], ignore_index=True)
+
+	def __len__(self):
+		return len(self.added) + len(self.removed) + len(self.changed)
+
+	def __str__(self):
+		return f"{self.table}: +{len(self.added)} -{len(self.removed)} ~{len(self.changed)}"
+
+
+class DatasetDiff:
+	def __init__(self, tables: dict[str, TableDiff]):
+		self.tables = tables
+
+	def __getitem__(self, table: str) -> TableDiff:
+		return self.tables[table]
+
+	def __str__(self):
+		return '\n'.join(str(t) for t in self.tables.values())
+
+
+def _hash_rows(source, member: str, keys: list[str], batch_size: int) -> tuple[np.ndarray, np.ndarray, list[str]]:
+	# Returns (key hash, row hash) of every row in file order, and the csv header
+	key_hashes: list[np.ndarray] = list()
+	row_hashes: list[np.ndarray] = list()
+	header: list[str] = None
+	for chunk in iter_csv_chunks(source, member, batch_size):
+		header = header or list(chunk.columns)
+		key_hashes.append(pd.util.hash_pandas_object(chunk[keys], index=False).to_numpy())
+		row_hashes.append(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+	if header is None:
+		return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint64), list()
+	return np.concatenate(key_hashes), np.concatenate(row_hashes), header
+
+def _first_occurrences(key_hashes: np.ndarray) -> np.ndarray:
+	# Only the first row of a key is considered (as when building a snapshot)
+	first = np.zeros(len(key_hashes), dtype=bool)
+	first[np.unique(key_hashes, return_index=True)[1]] = True
+	return first
+
+def _read_rows(source, member: str, selected: np.ndarray, columns: list[str]|None, batch_size: int) -> pd.DataFrame:
+	# Rows at selected positions (boolean mask over the whole file), streamed
+	parts: list[pd.DataFrame] = list()
+	start = 0
+	for chunk in iter_csv_chunks(source, member, batch_size):
+		mask = selected[start:start+len(chunk)]
+		start += len(chunk)
+		if mask.any():
+			parts.append(chunk[mask] if columns is None else chunk.loc[mask, columns])
+	if not parts:
+		return pd.DataFrame({c: pd.Series(dtype=str) for c in (columns or [])})
+	return pd.concat(parts, ignore_index=True)
+
+def diff_table(old_source, new_source, table: str, batch_size: int = BATCH_SIZE) -> TableDiff:
+	member, keys = DIFF_TABLES[table]
+
+	old_keys, old_rows, old_header = _hash_rows(old_source, member, keys, batch_size)
+	new_keys, new_rows, new_header = _hash_rows(new_source, member, keys, batch_size)
+	old_first = _first_occurrences(old_keys)
+	new_first = _first_occurrences(new_keys)
+
+	# Row hashes of the old export, by key
+	sorter = np.argsort(old_keys[old_first])
+	old_sorted_keys = old_keys[old_first][sorter]
+	old_sorted_rows = old_rows[old_first][sorter]
+
+	pos = np.searchsorted(old_sorted_keys, new_keys).clip(max=max(len(old_sorted_keys)-1, 0))
+	in_old = (old_sorted_keys[pos] == new_keys) if len(old_sorted_keys) else np.zeros(len(new_keys), dtype=bool)
+	if old_header != new_header:
+		# A column was added or removed: all common rows changed
+		changed = new_first & in_old
+	else:
+		changed = new_first & in_old & (old_sorted_rows[pos] != new_rows)
+	added = new_first & ~in_old
+	removed = old_first & ~np.isin(old_keys, new_keys)
+
+	# Second pass, reading differing rows only
+	upserted = _read_rows(new_source, member, added | changed, None, batch_size) if (added | changed).any() else pd.DataFrame(columns=new_header, dtype=str)
+	is_added = added[added | changed] # Rows are read in file order, added & changed ones being interleaved
+	return TableDiff(table,
+		added = upserted[is_added].reset_index(drop=True),
+		removed = _read_rows(old_source, member, removed, keys, batch_size) if removed.any() else pd.DataFrame(columns=keys, dtype=str),
+		changed = upserted[~is_added].reset_index(drop=True),
+	)
+
+def diff_datasets(old_source, new_source, tables: Iterable[str] = None, batch_size: int = BATCH_SIZE) -> DatasetDiff:
+	"""
+	Args:
+		old_source: older dataset zip (path or file object)
+		new_source: newer dataset zip (path or file object)
+		tables (Iterable[str], optional): tables to compare (see DIFF_TABLES). None compares all of them.
+		batch_size (int, optional): Number of csv rows parsed at a time
+
+	Returns:
+		DatasetDiff: added, removed & changed rows of each table, going from old_source to new_source
+	"""
+	return DatasetDiff({table: diff_table(old_source, new_source, table, batch_size) for table in (tables or DIFF_TABLES)})
+
+
+# table: snapshot columns holding the key columns of DIFF_TABLES (users table rows are user codes)
+_SNAPSHOT_KEYS: dict[str, list[str]] = {
+	'users': ['user'],
+	'comparisons': ['user', 'video_a', 'video_b', 'criteria'],
+	'collective_criteria_scores': ['video', 'criteria'],
+	'individual_criteria_scores': ['user', 'video', 'criteria'],
+}
+
+def _kept_rows(snapshot: DatasetSnapshot, table: str, diff: TableDiff) -> np.ndarray:
+	# Mask of the snapshot rows neither removed nor changed by the diff
+	keys = DIFF_TABLES[table][1]
+	replaced = pd.concat([diff.removed[keys], diff.changed[keys]], ignore_index=True)
+	if replaced.empty:
+		return np.ones(len(snapshot[table]), dtype=bool)
+
+	columns = _SNAPSHOT_KEYS[table]
+	replaced_codes = [
+		replaced[key].map(lambda value, column=column: snapshot.code(column, value)).fillna(-1).to_numpy(dtype=np.int64)
+		for key, column in zip(keys, columns)
+	]
+	if table == 'users':
+		row_codes = [np.arange(snapshot.nb_users)]
+	else:
+		row_codes = [np.asarray(snapshot[table][column], dtype=np.int64) for column in columns]
+	return ~pd.MultiIndex.from_arrays(row_codes).isin(pd.MultiIndex.from_arrays(replaced_codes))
+
+def _remap(old_vocab: list[str], new_idx: dict[str, int]) -> np.ndarray:
+	# old code -> new code
+	return np.fromiter((new_idx[v] for v in old_vocab), dtype=np.int64, count=len(old_vocab))
+
+def apply_diff(source, diff: DatasetDiff, target) -> DatasetSnapshot:
+	"""
+	Build the snapshot of the target dataset zip from the (up to date) snapshot of the source dataset zip,
+	and the diff from source to target. Only the differing rows are parsed; rows of the diff are appended
+	at the end of the tables.
+
+	Args:
+		source (str): path of the older dataset zip, whose snapshot is up to date
+		diff (DatasetDiff): diff from source to target, on all tables
+		target (str): path of the newer dataset zip
+
+	Returns:
+		DatasetSnapshot: the snapshot of target
+	"""
+	old = load_snapshot(source)
+	if old is None:
+		raise ValueError(f"Cannot apply diff: no up to date snapshot of {source}")
+	if snapshot_path(source) == snapshot_path(target):
+		raise ValueError(f"Cannot apply diff: {source} and {target} share the same snapshot directory")
+	missing = [table for table in DIFF_TABLES if table not in diff.tables]
+	if missing:
+		raise ValueError(f"Cannot apply diff: missing tables {', '.join(missing)}")
+
+	kept = {table: _kept_rows(old, table, diff[table]) for table in DIFF_TABLES}
+	users, cmps, ccs, ics = (diff[table].upserted for table in ('users', 'comparisons', 'collective_criteria_scores', 'individual_criteria_scores'))
+
+	# Vocabularies: old ones, completed by the values of the new rows
+	users_vocab: list[str] = [old.users[i] for i in np.flatnonzero(kept['users'])] + list(dict.fromkeys(users['public_username']))
+	nb_users = len(users_vocab)
+	users_vocab = list(dict.fromkeys(users_vocab + old.users + list(cmps['public_username']) + list(ics['public_username'])))
+	videos_vocab: list[str] = sorted(set(old.videos) | set(cmps['video_a']) | set(cmps['video_b']) | set(ccs['video']) | set(ics['video']))
+	criteria_vocab: list[str] = sorted(set(old.criteria) | set(cmps['criteria']) | set(ccs['criteria']) | set(ics['criteria']))
+	dates_vocab: list[str] = sorted(set(old.dates) | set(cmps['week_date'] if 'week_date' in cmps else ['']))
+
+	users_idx = {u:i for i,u in enumerate(users_vocab)}
+	videos_idx = {v:i for i,v in enumerate(videos_vocab)}
+	criteria_idx = {c:i for i,c in enumerate(criteria_vocab)}
+	dates_idx = {d:i for i,d in enumerate(dates_vocab)}
+	added = encode_tables(users, cmps, ccs, ics, users_idx, videos_idx, criteria_idx, dates_idx)
+
+	videos_remap = _remap(old.videos, videos_idx)
+	remaps = {
+		'user': _remap(old.users, users_idx),
+		'video': videos_remap,
+		'video_a': videos_remap,
+		'video_b': videos_remap,
+		'criteria': _remap(old.criteria, criteria_idx),
+		'week_date': _remap(old.dates, dates_idx),
+	}
+	columns: dict[str, dict[str, np.ndarray]] = dict()
+	for table, dtypes in TABLES.items():
+		columns[table] = dict()
+		for column in dtypes:
+			values = np.asarray(old[table][column])[kept[table]]
+			if column in remaps:
+				values = remaps[column][values]
+			columns[table][column] = np.concatenate([values, np.asarray(added[table][column], dtype=values.dtype if column in remaps else None)])
+
+	return write_snapshot(target, columns, users_vocab, nb_users, videos_vocab, criteria_vocab, dates_vocab)
+
+
+if __name__ == '__main__':
+	import argparse
+	import time
+
+	parser = argparse.ArgumentParser(description='Compare two Tournesol public dataset zips')
+	parser.add_argument('old', help='Path of the older public dataset zip', type=str)
+	parser.add_argument('new', help='Path of the newer public dataset zip', type=str)
+	parser.add_argument('--apply', help='Build the snapshot of the newer zip from the snapshot of the older one', action='store_true')
+	args = vars(parser.parse_args())
+
+	start = time.time()
+	diff = diff_datasets(args['old'], args['new'])
+	print(diff)
+	print(f"Compared in {time.time()-start:0.3f}s")
+
+	if args['apply']:
+		start = time.time()
+		snapshot = apply_diff(args['old'], diff, args['new'])
+		print(f"{args['new']} -> {snapshot.directory}: {len(snapshot['comparisons'])} comparisons in {time.time()-start:0.3f}s")
@@ -0,0 +1,64 @@
+from typing import Iterable
+
+import numpy as np
+import pandas as pd
+
+class IdRegistry:
+	"""
+	Two-way mapping between string identifiers (usernames, video ids, criteria) and dense integer codes (0, 1, 2, ...).
+
+	Every dataset reader goes through the registries below, so that:
+	- a given identifier is held by a single str object, whatever how many rows refer to it
+	- structures built from the dataset can be keyed on codes instead of strings
+	"""
+	def __init__(self):
+		self.__codes: dict[str, int] = dict()
+		self.__ids: list[str] = list()
+
+	def __len__(self):
+		return len(self.__ids)
+
+	def __contains__(self, id: str):
+		return id in self.__codes
+
+	def code(self, id: str) -> int:
+		"""Returns the code of the given identifier, registering it if new"""
+		code = self.__codes.get(id)
+		if code is None:
+			code = len(self.__ids)
+			self.__codes[id] = code
+			self.__ids.append(id)
+		return code
+
+	def get(self, id: str, default: int|None=None) -> int|None:
+		"""Returns the code of the given identifier, or default if not registered"""
+		return self.__codes.get(id, default)
+
+	def id(self, code: int) -> str:
+		return self.__ids[code]
+
+	def intern(self, id: str) -> str:
+		"""Returns the registered str object equal to the given identifier (registering it if new)"""
+		return self.__ids[self.code(id)]
+
+	def intern_all(self, ids: np.ndarray) -> np.ndarray:
+		"""Same as `intern` on every value of the given array, distinct values being looked up only once"""
+		indices, uniques = pd.factorize(ids)
+		return np.array([self.intern(id) for id in uniques.tolist()], dtype=object)[indices]
+
+	def codes(self, ids: Iterable[str]) -> np.ndarray:
+		"""Returns the codes of all the given identifiers (registering new ones)"""
+		if isinstance(ids, np.ndarray):
+			# Look up distinct values only
+			indices, uniques = pd.factorize(ids)
+			return np.fromiter((self.code(id) for id in uniques.tolist()), dtype=np.int32, count=len(uniques))[indices]
+		return np.fromiter((self.code(id) for id in ids), dtype=np.int32)
+
+	def ids(self, codes: Iterable[int]) -> np.ndarray:
+		"""Returns the identifiers of all the given codes, as an array of str objects"""
+		return np.array([self.__ids[c] for c in codes], dtype=object)
+
+
+UserIds = IdRegistry()
+VideoIds = IdRegistry()
+CriterionIds = IdRegistry()
@@ -1,39 +1,99 @@
-import zipfile
-from typing import Callable, Iterable
+from typing import Callable, Iterable, Iterator, NamedTuple
 
-class ICSLine:
-	def __init__(self, sp: list[str]):
+import numpy as np
+from model.tournesol_dataset.identifiers import CriterionIds, UserIds, VideoIds
+from model.tournesol_dataset.csvreader import BATCH_SIZE, iter_csv_batches, iter_csv_batches_parallel
+from model.tournesol_dataset.snapshot import load_snapshot
+
+class ICSLine(NamedTuple):
+	user: str
+	video: str
+	criterion: str
+	score: float # -100.0 - 100.0
+	uncertainty: float # 0.0 - 100.0
+	voting_right: float # 0.0 - 1.0
+
+	@classmethod
+	def from_csv(cls, sp: list[str]) -> 'ICSLine':
+		"""From a split csv line (public_username,video,criteria,score,uncertainty,voting_right)"""
 		try:
-			# public_username,video,criteria,score,uncertainty,voting_right
-			self.user: str = sp[0]
-			self.video: str = sp[1]
-			self.criterion: str = sp[2]
-			self.score: float = float(sp[3]) # -100.0 - 100.0
-			self.uncertainty = float(sp[4]) # 0.0 - 100.0
-			self.voting_right = float(sp[5]) # 0.0 - 1.0
+			return cls(
+				UserIds.intern(sp[0]),
+				VideoIds.intern(sp[1]),
+				CriterionIds.intern(sp[2]),
+				float(sp[3]),
+				float(sp[4]),
+				float(sp[5]),
+			)
 		except:
 			print(sp)
 			raise
 
+	@classmethod
+	def from_batch(cls, batch: dict[str, np.ndarray]) -> Iterator['ICSLine']:
+		"""Bulk constructor: lines of a batch of columns (see IndividualCriteriaScoresFile.iter_batches)"""
+		return map(cls._make, zip(
+			UserIds.intern_all(batch['user']).tolist(),
+			VideoIds.intern_all(batch['video']).tolist(),
+			CriterionIds.intern_all(batch['criterion']).tolist(),
+			batch['score'].tolist(),
+			batch['uncertainty'].tolist(),
+			batch['voting_right'].tolist(),
+		))
+
 
 class IndividualCriteriaScoresFile:
-	def __init__(self, source):
+	def __init__(self, source, workers: int=1):
+		"""
+		Args:
+			source: dataset zip (path or file object)
+			workers (int, optional): Number of processes parsing the csv file in parallel (not used when reading from a snapshot)
+		"""
 		self.zip = source
+		self.workers = workers
 
 	def foreach(self, fn: Callable[[ICSLine], None]):
-		with zipfile.ZipFile(self.zip) as zip_file:
-			with (zipfile.Path(zip_file) / 'individual_criteria_scores.csv').open(mode='r', encoding='utf-8') as cmpFile:
-				# video,criteria,score,uncertainty
-
-				# Skip first line (headers)
-				cmpFile.readline()
-
-				while True:
-					line = cmpFile.readline()
-					# if line is empty, end of file is reached
-					if not line:
-						break
-					fn(ICSLine(line.strip().split(',')))
+		snapshot = load_snapshot(self.zip)
+		if snapshot:
+			# Snapshot vocabularies are already interned
+			for line in map(ICSLine._make, snapshot.iter_rows('individual_criteria_scores', ['user', 'video', 'criteria', 'score', 'uncertainty', 'voting_right'])):
+				fn(line)
+			return
+
+		for batch in self.iter_batches():
+			for line in ICSLine.from_batch(batch):
+				fn(line)
+
+	def iter_batches(self, batch_size: int=BATCH_SIZE, criterion: str=None, user: str=None) -> Iterator[dict[str, np.ndarray]]:
+		"""
+		Iterate over individual scores by chunks of rows, as numpy columns named as ICSLine attributes
+
+		Args:
+			batch_size (int, optional): Maximum number of rows read per batch
+			criterion (str, optional): Filter to given criterion only. None means no filtering on criteria.
+			user (str, optional): Filter to given user only. None means no filtering on users.
+
+		Yields:
+			dict[str, np.ndarray]: columns `user`, `video`, `criterion` (str), `score`, `uncertainty` and `voting_right` (float)
+		"""
+		columns = {'video': 'video', 'criterion': 'criteria', 'score': 'score', 'uncertainty': 'uncertainty', 'voting_right': 'voting_right'}
+
+		snapshot = load_snapshot(self.zip)
+		if snapshot:
+			yield from snapshot.iter_batches('individual_criteria_scores',
+				{'user': 'user', **columns},
+				batch_size=batch_size,
+				equals={k:v for k,v in (('criteria', criterion), ('user', user)) if v is not None},
+			)
+			return
+
+		columns = {'user': 'public_username', **columns}
+		dtypes = {'score': 'float64', 'uncertainty': 'float64', 'voting_right': 'float64'}
+		equals = {k:v for k,v in (('criteria', criterion), ('public_username', user)) if v is not None}
+		if self.workers > 1:
+			yield from iter_csv_batches_parallel(self.zip, 'individual_criteria_scores.csv', columns, dtypes, self.workers, equals=equals)
+		else:
+			yield from iter_csv_batches(self.zip, 'individual_criteria_scores.csv', columns, dtypes, batch_size=batch_size, equals=equals)
 
 	def get_scores(self, criterion:str=None, users:Iterable[str]=None, vids:Iterable[str]=None) -> dict[str,dict[str,dict[str,tuple[float,float]]]]:
 		"""
@@ -0,0 +1,479 @@
+"""
+Columnar binary snapshot of a Tournesol public dataset zip.
+
+The snapshot is a directory stored next to the dataset zip (`<dataset>.snapshot/`), containing:
+- `meta.json`: format version, source zip size & modification time, and the vocabularies
+	(users, videos, criteria, dates) used to decode the integer columns
+- one `<table>.<column>.npy` file per column, loaded as read-only memory maps
+	(so that concurrent processes share the same pages)
+- `<table>.by_<key>.order.npy` & `<table>.by_<key>.offsets.npy` per indexed key (see INDEXES):
+	CSR index giving the rows having a given key without scanning the table
+
+Usage (from `src/py`):
+	`python -m model.tournesol_dataset.snapshot data/tournesol_dataset.zip`
+"""
+import os
+import json
+import bisect
+import zipfile
+from functools import cached_property
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+from model.tournesol_dataset.identifiers import CriterionIds, UserIds, VideoIds
+
+SNAPSHOT_VERSION = 2
+SNAPSHOT_EXT = '.snapshot'
+
+# table: {column: dtype}
+TABLES: dict[str, dict[str, str]] = {
+	'users': {
+		'trust_score': 'float64',
+	},
+	'comparisons': {
+		'user': 'int32',
+		'video_a': 'int32',
+		'video_b': 'int32',
+		'criteria': 'int8',
+		'score': 'int8',
+		'score_max': 'int8',
+		'week_date': 'int16',
+	},
+	'collective_criteria_scores': {
+		'video': 'int32',
+		'criteria': 'int8',
+		'score': 'float64',
+		'uncertainty': 'float64',
+	},
+	'individual_criteria_scores': {
+		'user': 'int32',
+		'video': 'int32',
+		'criteria': 'int8',
+		'score': 'float64',
+		'uncertainty': 'float64',
+		'voting_right': 'float64',
+	},
+}
+
+# table: {indexed key: columns holding the key (a row is indexed once per column)}
+INDEXES: dict[str, dict[str, tuple[str, ...]]] = {
+	'comparisons': {
+		'user': ('user',),
+		'video': ('video_a', 'video_b'),
+		'criteria': ('criteria',),
+		'week_date': ('week_date',),
+	},
+}
+
+def snapshot_path(source) -> str|None:
+	"""
+	Returns:
+		str|None: Directory where the snapshot of the given dataset zip is (or would be) stored.
+			None if source is not a file path (e.g. an opened file object)
+	"""
+	if not isinstance(source, (str, os.PathLike)):
+		return None
+	path = os.path.abspath(source)
+	if path.endswith('.zip'):
+		path = path[:-4]
+	return path + SNAPSHOT_EXT
+
+def _source_signature(source) -> dict[str, int]:
+	stat = os.stat(source)
+	return {'source_size': stat.st_size, 'source_mtime': stat.st_mtime_ns}
+
+
+class _Table:
+	"""Lazily memory-mapped columns of one snapshot table"""
+	def __init__(self, directory: str, name: str, size: int):
+		self.directory = directory
+		self.name = name
+		self.size = size
+		self.__columns: dict[str, np.ndarray] = dict()
+
+	def __getitem__(self, column: str) -> np.ndarray:
+		if column not in self.__columns:
+			self.__columns[column] = np.load(os.path.join(self.directory, f"{self.name}.{column}.npy"), mmap_mode='r')
+		return self.__columns[column]
+
+	def __len__(self):
+		return self.size
+
+
+class _Index:
+	"""
+	CSR index of a table on one key: rows having key code `c` are `order[offsets[c]:offsets[c+1]]`, in table order
+	"""
+	def __init__(self, order: np.ndarray, offsets: np.ndarray):
+		self.order = order
+		self.offsets = offsets
+
+	def count(self, lo: int, hi: int) -> int:
+		"""Number of rows having a key code in [lo, hi)"""
+		return int(self.offsets[hi] - self.offsets[lo])
+
+	def rows(self, lo: int, hi: int) -> np.ndarray:
+		"""Rows having a key code in [lo, hi), sorted in table order"""
+		rows = self.order[self.offsets[lo]:self.offsets[hi]]
+		return rows if hi - lo <= 1 else np.sort(rows)
+
+def _build_index(columns: list[np.ndarray], nb_codes: int) -> tuple[np.ndarray, np.ndarray]:
+	codes = np.concatenate(columns)
+	rows = np.tile(np.arange(len(columns[0]), dtype=np.int32), len(columns))
+	order = np.lexsort((rows, codes)) # By code, then by row
+	offsets = np.zeros(nb_codes+1, dtype=np.int64)
+	np.cumsum(np.bincount(codes, minlength=nb_codes), out=offsets[1:])
+	if len(columns) > 1:
+		# A row holding the same key in several columns is indexed once
+		keep = np.ones(len(order), dtype=bool)
+		keep[1:] = (codes[order[1:]] != codes[order[:-1]]) | (rows[order[1:]] != rows[order[:-1]])
+		offsets[1:] -= np.cumsum(np.bincount(codes[order[~keep]], minlength=nb_codes))
+		order = order[keep]
+	return rows[order], offsets
+
+
+class DatasetSnapshot:
+	"""
+	self.users: list[str] (user code -> public_username; first `self.nb_users` are the ones listed in users.csv)
+	self.videos: list[str] (video code -> youtube video id)
+	self.criteria: list[str] (criteria code -> criteria name)
+	self.dates: list[str] (date code -> week_date, sorted so that codes compare as dates)
+	"""
+	def __init__(self, directory: str):
+		self.directory = directory
+		with open(os.path.join(directory, 'meta.json'), 'r', encoding='utf-8') as file:
+			self.meta = json.load(file)
+
+		# Vocabularies are interned, so that decoded values are the same objects as the ones of other readers
+		self.users: list[str] = [UserIds.intern(u) for u in self.meta['users']]
+		self.videos: list[str] = [VideoIds.intern(v) for v in self.meta['videos']]
+		self.criteria: list[str] = [CriterionIds.intern(c) for c in self.meta['criteria']]
+		self.dates: list[str] = self.meta['dates']
+		self.nb_users: int = self.meta['nb_users']
+		self.tables = {name: _Table(directory, name, size) for name,size in self.meta['sizes'].items()}
+		self.__indexes: dict[str, _Index] = dict()
+
+	def __getitem__(self, table: str) -> _Table:
+		return self.tables[table]
+
+	def is_fresh(self, source) -> bool:
+		return self.meta.get('version') == SNAPSHOT_VERSION and all(
+			self.meta.get(k) == v for k,v in _source_signature(source).items()
+		)
+
+	@cached_property
+	def _vocabularies(self) -> dict[str, list[str]]:
+		# column: vocabulary used to decode its codes
+		return {
+			'user': self.users,
+			'video': self.videos,
+			'video_a': self.videos,
+			'video_b': self.videos,
+			'criteria': self.criteria,
+			'week_date': self.dates,
+		}
+
+	@cached_property
+	def _decoders(self) -> dict[str, np.ndarray]:
+		return {column: np.array(vocab, dtype=object) for column,vocab in self._vocabularies.items()}
+
+	@cached_property
+	def _encoders(self) -> dict[str, dict[str, int]]:
+		return {column: {v:i for i,v in enumerate(vocab)} for column,vocab in self._vocabularies.items()}
+
+	def index(self, table: str, key: str) -> _Index|None:
+		"""
+		Returns:
+			_Index|None: index of the table rows by key (see INDEXES), None if this key is not indexed
+		"""
+		if key not in INDEXES.get(table, {}):
+			return None
+		name = f"{table}.by_{key}"
+		if name not in self.__indexes:
+			self.__indexes[name] = _Index(
+				np.load(os.path.join(self.directory, f"{name}.order.npy"), mmap_mode='r'),
+				np.load(os.path.join(self.directory, f"{name}.offsets.npy"), mmap_mode='r'),
+			)
+		return self.__indexes[name]
+
+	def code(self, column: str, value: str) -> int|None:
+		"""
+		Returns:
+			int|None: the code of value in given column, None if value is not in the snapshot
+		"""
+		return self._encoders[column].get(value)
+
+	def iter_rows(self, table: str, columns: list[str], chunk_size: int = 1<<16) -> Iterator[tuple]:
+		"""
+		Iterate over the rows of a table, decoding given columns by chunks (to keep memory bounded)
+
+		Yields:
+			tuple: one value per requested column, codes being replaced by their string value
+		"""
+		tbl = self.tables[table]
+		for start in range(0, len(tbl), chunk_size):
+			cols = []
+			for column in columns:
+				values = tbl[column][start:start+chunk_size].tolist()
+				if column in self._vocabularies:
+					vocab = self._vocabularies[column]
+					values = [vocab[v] for v in values]
+				cols.append(values)
+			yield from zip(*cols)
+
+	def iter_batches(self,
+		table: str,
+		columns: dict[str, str],
+		batch_size: int = 1<<16,
+		equals: dict[str, str] = None,
+		date_from: str = None,
+		date_to: str = None,
+	) -> Iterator[dict[str, np.ndarray]]:
+		"""
+		Same as `csvreader.iter_csv_batches`, filters being applied on codes before decoding.
+		`equals` may also filter on an indexed key (see INDEXES), such as `video` for comparisons.
+
+		When filtering, only the rows given by the most selective index are read (cost proportional to their number
+		instead of the table size).
+		"""
+		tbl = self.tables[table]
+		filters: list[tuple[tuple[str, ...], int, int, str]] = [] # (columns, min code, max code + 1, key)
+		for column, value in (equals or {}).items():
+			cols = INDEXES.get(table, {}).get(column, (column,))
+			code = self.code(cols[0], value)
+			if code is None:
+				return # No row can match
+			filters.append((cols, code, code+1, column))
+		if date_from or date_to:
+			lo = bisect.bisect_left(self.dates, date_from) if date_from else 0
+			hi = bisect.bisect_left(self.dates, date_to) if date_to else len(self.dates)
+			if lo >= hi:
+				return
+			filters.append((('week_date',), lo, hi, 'week_date'))
+
+		# Rows given by the most selective index (None: whole table)
+		candidates, nb_candidates = None, len(tbl)
+		for _, lo, hi, key in filters:
+			index = self.index(table, key)
+			if index is not None and index.count(lo, hi) < nb_candidates:
+				candidates, nb_candidates = (index, lo, hi), index.count(lo, hi)
+		if candidates is not None:
+			index, lo, hi = candidates
+			candidates = index.rows(lo, hi)
+
+		for start in range(0, nb_candidates, batch_size):
+			end = start + batch_size
+			rows = slice(start, end) if candidates is None else candidates[start:end]
+			mask = None
+			for cols, lo, hi, _ in filters:
+				m = None
+				for column in cols:
+					values = tbl[column][rows]
+					mc = (values == lo) if hi == lo+1 else ((values >= lo) & (values < hi))
+					m = mc if m is None else (m | mc)
+				mask = m if mask is None else (mask & m)
+			if mask is not None:
+				if not mask.any():
+					continue
+				if candidates is not None:
+					rows, mask = rows[mask], None
+
+			batch: dict[str, np.ndarray] = dict()
+			for name, column in columns.items():
+				values = tbl[column][rows]
+				if mask is not None:
+					values = values[mask]
+				if column in self._decoders:
+					values = self._decoders[column][values]
+				batch[name] = np.array(values)
+			yield batch
+
+def _read_csv(zip_file: zipfile.ZipFile, member: str) -> pd.DataFrame:
+	with (zipfile.Path(zip_file) / member).open(mode='rb') as file:
+		# keep_default_na=False is required otherwise some public usernames
+		# such as "NA" are converted to float NaN.
+		return pd.read_csv(file, keep_default_na=False, dtype=str)
+
+def _encode(values: pd.Series, vocab: dict[str, int]) -> np.ndarray:
+	return values.map(vocab).to_numpy()
+
+def encode_tables(
+	users: pd.DataFrame,
+	cmps: pd.DataFrame,
+	ccs: pd.DataFrame,
+	ics: pd.DataFrame,
+	users_idx: dict[str, int],
+	videos_idx: dict[str, int],
+	criteria_idx: dict[str, int],
+	dates_idx: dict[str, int],
+) -> dict[str, dict[str, np.ndarray]]:
+	"""
+	Convert the csv files content (as str DataFrames) into snapshot columns, using given vocabularies {value: code}
+
+	Returns:
+		dict[str, dict[str, np.ndarray]]: {table: {column: values}} (see TABLES)
+	"""
+	if 'week_date' not in cmps:
+		# For compatibility with older datasets
+		cmps = cmps.assign(week_date='')
+
+	return {
+		'users': {
+			# Fill trust_score on newly created users for which it was not computed yet
+			'trust_score': pd.to_numeric(users.drop_duplicates('public_username')['trust_score']).fillna(0.0).to_numpy(),
+		},
+		'comparisons': {
+			'user': _encode(cmps['public_username'], users_idx),
+			'video_a': _encode(cmps['video_a'], videos_idx),
+			'video_b': _encode(cmps['video_b'], videos_idx),
+			'criteria': _encode(cmps['criteria'], criteria_idx),
+			'score': pd.to_numeric(cmps['score']).to_numpy(),
+			# For compatibility with older datasets
+			'score_max': pd.to_numeric(cmps['score_max']).to_numpy() if 'score_max' in cmps else np.full(len(cmps), 10),
+			'week_date': _encode(cmps['week_date'], dates_idx),
+		},
+		'collective_criteria_scores': {
+			'video': _encode(ccs['video'], videos_idx),
+			'criteria': _encode(ccs['criteria'], criteria_idx),
+			'score': pd.to_numeric(ccs['score']).to_numpy(),
+			'uncertainty': pd.to_numeric(ccs['uncertainty']).to_numpy(),
+		},
+		'individual_criteria_scores': {
+			'user': _encode(ics['public_username'], users_idx),
+			'video': _encode(ics['video'], videos_idx),
+			'criteria': _encode(ics['criteria'], criteria_idx),
+			'score': pd.to_numeric(ics['score']).to_numpy(),
+			'uncertainty': pd.to_numeric(ics['uncertainty']).to_numpy(),
+			'voting_right': pd.to_numeric(ics['voting_right']).to_numpy(),
+		},
+	}
+
+def write_snapshot(
+	source,
+	columns: dict[str, dict[str, np.ndarray]],
+	users_vocab: list[str],
+	nb_users: int,
+	videos_vocab: list[str],
+	criteria_vocab: list[str],
+	dates_vocab: list[str],
+) -> DatasetSnapshot:
+	"""
+	Write the snapshot of the given dataset zip (overwrites any previous snapshot), building its indexes
+
+	Args:
+		source (str): path of the dataset zip
+		columns (dict[str, dict[str, np.ndarray]]): {table: {column: values}} (see TABLES)
+		users_vocab (list[str]): user code -> public_username; users table rows being the first nb_users ones
+		videos_vocab, criteria_vocab, dates_vocab (list[str]): sorted vocabularies
+
+	Returns:
+		DatasetSnapshot: the written snapshot
+	"""
+	directory = snapshot_path(source)
+	if directory is None:
+		raise ValueError(f"Cannot build a snapshot from {source}: a path to the dataset zip is required")
+
+	os.makedirs(directory, exist_ok=True)
+	for table, cols in columns.items():
+		for column, values in cols.items():
+			# Comparison scores are stored as int8: int(float(score)), as done by ComparisonLine
+			values = np.trunc(values) if TABLES[table][column].startswith('int') and values.dtype.kind == 'f' else values
+			np.save(os.path.join(directory, f"{table}.{column}.npy"), values.astype(TABLES[table][column]))
+
+	vocab_sizes = {'user': len(users_vocab), 'video': len(videos_vocab), 'criteria': len(criteria_vocab), 'week_date': len(dates_vocab)}
+	for table, keys in INDEXES.items():
+		for key, cols in keys.items():
+			order, offsets = _build_index([np.asarray(columns[table][c], dtype=np.int64) for c in cols], vocab_sizes[key])
+			np.save(os.path.join(directory, f"{table}.by_{key}.order.npy"), order)
+			np.save(os.path.join(directory, f"{table}.by_{key}.offsets.npy"), offsets)
+
+	# Written last, so that an interrupted conversion is never seen as a valid snapshot
+	meta = {
+		'version': SNAPSHOT_VERSION,
+		**_source_signature(source),
+		'nb_users': nb_users,
+		'sizes': {table: len(next(iter(cols.values()))) for table,cols in columns.items()},
+		'users': users_vocab,
+		'videos': videos_vocab,
+		'criteria': criteria_vocab,
+		'dates': dates_vocab,
+	}
+	with open(os.path.join(directory, 'meta.json'), 'w', encoding='utf-8') as file:
+		json.dump(meta, file, separators=(',',':'), ensure_ascii=True)
+
+	return DatasetSnapshot(directory)
+
+def build_snapshot(source) -> DatasetSnapshot:
+	"""
+	Convert the given dataset zip into its columnar snapshot (overwrites any previous snapshot)
+
+	Args:
+		source (str): path of the dataset zip
+
+	Returns:
+		DatasetSnapshot: the newly built snapshot
+	"""
+	if snapshot_path(source) is None:
+		raise ValueError(f"Cannot build a snapshot from {source}: a path to the dataset zip is required")
+
+	with zipfile.ZipFile(source) as zip_file:
+		users = _read_csv(zip_file, 'users.csv')
+		cmps = _read_csv(zip_file, 'comparisons.csv')
+		ccs = _read_csv(zip_file, 'collective_criteria_scores.csv')
+		ics = _read_csv(zip_file, 'individual_criteria_scores.csv')
+
+	# Vocabularies
+	users_vocab: list[str] = list(dict.fromkeys(users['public_username']))
+	nb_users = len(users_vocab)
+	known = set(users_vocab)
+	for u in pd.concat([cmps['public_username'], ics['public_username']]).unique():
+		if u not in known:
+			users_vocab.append(u)
+			known.add(u)
+	videos_vocab: list[str] = sorted(set(cmps['video_a']) | set(cmps['video_b']) | set(ccs['video']) | set(ics['video']))
+	criteria_vocab: list[str] = sorted(set(cmps['criteria']) | set(ccs['criteria']) | set(ics['criteria']))
+	dates_vocab: list[str] = sorted(set(cmps['week_date'])) if 'week_date' in cmps else ['']
+
+	columns = encode_tables(users, cmps, ccs, ics,
+		{u:i for i,u in enumerate(users_vocab)},
+		{v:i for i,v in enumerate(videos_vocab)},
+		{c:i for i,c in enumerate(criteria_vocab)},
+		{d:i for i,d in enumerate(dates_vocab)},
+	)
+	return write_snapshot(source, columns, users_vocab, nb_users, videos_vocab, criteria_vocab, dates_vocab)
+
+
+__SNAPSHOTS: dict[str, DatasetSnapshot] = dict()
+def load_snapshot(source) -> DatasetSnapshot|None:
+	"""
+	Returns:
+		DatasetSnapshot|None: The snapshot of the given dataset zip if it exists and is up to date, None otherwise
+	"""
+	directory = snapshot_path(source)
+	if directory is None or not os.path.isfile(os.path.join(directory, 'meta.json')):
+		return None
+
+	snapshot = __SNAPSHOTS.get(directory)
+	if snapshot is None or not snapshot.is_fresh(source):
+		try:
+			snapshot = DatasetSnapshot(directory)
+		except (OSError, ValueError, KeyError):
+			return None
+		__SNAPSHOTS[directory] = snapshot
+	return snapshot if snapshot.is_fresh(source) else None
+
+
+if __name__ == '__main__':
+	import argparse
+	import time
+
+	parser = argparse.ArgumentParser(description='Convert a Tournesol public dataset zip into a columnar snapshot for instant reloads')
+	parser.add_argument('tournesoldataset', help='Path of the public dataset zip to convert', nargs='+', type=str)
+	args = vars(parser.parse_args())
+
+	for dataset in args['tournesoldataset']:
+		start = time.time()
+		snapshot = build_snapshot(dataset)
+		end = time.time()
+		print(f"{dataset} -> {snapshot.directory}: {len(snapshot['comparisons'])} comparisons in {end-start:0.3f}s")
@@ -1,15 +1,28 @@
 import zipfile
+from typing import NamedTuple
 
-class TournesolUser:
-	def __init__(self, sp: list[str]):
+from model.tournesol_dataset.identifiers import UserIds
+from model.tournesol_dataset.snapshot import load_snapshot
+
+class TournesolUser(NamedTuple):
+	public_username: str
+	trust_score: float
+
+	@classmethod
+	def from_csv(cls, sp: list[str]) -> 'TournesolUser':
+		"""From a split csv line (public_username,trust_score)"""
 		try:
-			self.public_username = sp[0]
-			self.trust_score = float(sp[1] or '0')
+			return cls(UserIds.intern(sp[0]), float(sp[1] or '0'))
 		except:
 			print(sp)
 			raise
 
 def extractAllTournesolUsers(zip) -> set[TournesolUser]:
+	snapshot = load_snapshot(zip)
+	if snapshot:
+		trust_scores = snapshot['users']['trust_score'].tolist()
+		return {TournesolUser(snapshot.users[i], trust_scores[i]) for i in range(snapshot.nb_users)}
+
 	with zipfile.ZipFile(zip) as zip_file:
 		with (zipfile.Path(zip_file) / 'users.csv').open(mode='r', encoding='utf-8') as cmpFile:
 			# public_username,video_a,video_b,criteria,score
@@ -23,6 +36,6 @@ def extractAllTournesolUsers(zip) -> set[TournesolUser]:
 				line = cmpFile.readline()
 				# if line is empty, end of file is reached
 				if not line: break
-				users.add(TournesolUser(line.strip().split(',')))
+				users.add(TournesolUser.from_csv(line.strip().split(',')))
 
 			return users
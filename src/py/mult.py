@@ -1,8 +1,11 @@
-import sys
-import time
+import argparse
 import numpy as np
+import scipy.sparse
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
-import scripts.data_fetcher as data_fetcher
+from dao.youtube_api import YoutubeAPI
+from scripts.kcore import prune_comparisons
+
+MAX_ROUNDS = 1000 # Maximum number of affine_score refinement rounds
 
 def findUsersWeights(cmpFile: ComparisonFile):
 	users_values: dict[str, list[int]] = dict() # {uid: [0, 1, .. 10]}
@@ -55,95 +58,95 @@ def extractComparisons(cmpFile: ComparisonFile):
 
 	# Remove vid with less than 2 comparisons
 	l = len(cmps.keys())
-	toredo = True
-	while toredo:
-		toredo = False
-		for vid in list(cmps.keys()):
-			if len(cmps[vid].keys()) <= 1:
-				cmps.pop(vid, None)
-				for sub in cmps.values():
-					sub.pop(vid, None)
-				toredo = True
+	prune_comparisons(cmps, 2)
 
 	print(f"Total: {l}, Kept for analysis: {len(cmps.keys())}")
 
 	return cmps
 
 
-def affine_score(cmps: dict[str, dict[str, tuple[float, float]]], scores: dict[str, float]):
-	newscores: dict[str, float] = dict()
-	for vid in cmps:
-		#if vid == 'Ot00MptJ4xs':
-		#	print(f"{vid} ({scores[vid]:.0%})")
-		pts = 0
-		wgt = 0
-		for vid2 in cmps[vid]:
-			dif = cmps[vid][vid2][0]/cmps[vid][vid2][1] # Target difference
-			tgt = scores[vid2] * (2**(dif/10)) # -10: Want to be 2x less; 10: want to be 2x more
-			# tgt = scores[vid2] + dif # Target score
-			pts += tgt * cmps[vid][vid2][1] # Weighted target score
-			wgt += cmps[vid][vid2][1] # Weight
-
-			#if vid == 'Ot00MptJ4xs':
-			#	print(f"\t{vid2} ({scores[vid2]:.0%}) diff:{dif:.1f} {tgt:.0%} {cmps[vid][vid2][1]:.2f}")
-
-		newscores[vid] = pts/wgt
+def comparisons_matrices(cmps: dict[str, dict[str, tuple[float, float]]]) -> tuple[list[str], scipy.sparse.csr_matrix, scipy.sparse.csr_matrix]:
+	"""
+	Returns:
+		tuple: (vids, sums, counts) where sums[i,j] and counts[i,j] are cmps[vids[i]][vids[j]] (sum, count), as CSR matrices
+	"""
+	vids = list(cmps.keys())
+	index = {vid: i for i,vid in enumerate(vids)}
+	indptr = np.concatenate(([0], np.cumsum([len(cmps[vid]) for vid in vids], dtype=np.int64)))
+	cols = np.fromiter((index[vid2] for vid in vids for vid2 in cmps[vid]), dtype=np.int64, count=indptr[-1])
+	sums = np.fromiter((sum_cnt[0] for vid in vids for sum_cnt in cmps[vid].values()), dtype=float, count=indptr[-1])
+	counts = np.fromiter((sum_cnt[1] for vid in vids for sum_cnt in cmps[vid].values()), dtype=float, count=indptr[-1])
+	shape = (len(vids), len(vids))
+	# Both matrices share the same sparsity pattern (explicit zero sums are kept)
+	return (
+		vids,
+		scipy.sparse.csr_matrix((sums, cols, indptr), shape=shape),
+		scipy.sparse.csr_matrix((counts, cols, indptr), shape=shape),
+	)
+
+def affine_matrix(sums: scipy.sparse.csr_matrix, counts: scipy.sparse.csr_matrix) -> tuple[scipy.sparse.csr_matrix, np.ndarray]:
+	"""
+	Returns:
+		tuple: (targets, weights) such that affine_score is (targets @ scores) / weights
+			targets[i,j] = counts[i,j] * 2**(dif/10), with dif = sums[i,j]/counts[i,j] the target difference between i and j
+			(-10: Want to be 2x less; 10: want to be 2x more)
+			weights[i] = total weight of comparisons of i
+	"""
+	targets = counts.copy()
+	targets.data = counts.data * np.exp2(sums.data / counts.data / 10) # Same sparsity pattern (see comparisons_matrices)
+	weights = np.asarray(counts.sum(axis=1)).ravel()
+	return (targets, weights)
+
+def affine_score(targets: scipy.sparse.csr_matrix, weights: np.ndarray, scores: np.ndarray) -> np.ndarray:
+	# Weighted target score of each video
+	newscores = (targets @ scores) / weights
 
 	# Remap to [0,1]
-	m = min(newscores.values())
-	mm = max(newscores.values()) - m
-	for vid in newscores:
-		newscores[vid] = (newscores[vid]-m)/mm
-
-	return newscores
+	m = newscores.min()
+	mm = newscores.max() - m
+	return (newscores - m) / mm
 
 
 if __name__ == '__main__':
 	# Unload parameters
-	if len(sys.argv) <= 1:
-		print('ERROR: Missing arguments', file=sys.stderr)
-		print(f"""Usage: $ {sys.argv[0]} <dataDir>
-	dataDir:
-		Directory where the public dataset is located
-		(ex: /data/input/tournesol_export_2023mmddThhmmssZ)
-""")
-		exit(-1)
+	parser = argparse.ArgumentParser()
+	parser.add_argument('tournesoldataset', help='Directory where the public dataset is located (ex: /data/input/tournesol_export_2023mmddThhmmssZ)', type=str)
+	parser.add_argument('-c', '--cache', help='Youtube data cache file location', default='data/YTData_cache.json.gz', type=str)
+	args = vars(parser.parse_args())
 
-	input_dir = sys.argv[1]
+	input_dir = args['tournesoldataset']
 
 	cmps: dict[str, dict[str, tuple[float, float]]] = extractComparisons(ComparisonFile(input_dir)) # {vid: {vid2: (sum, count)}}
+	vids, sums, counts = comparisons_matrices(cmps)
+	targets, weights = affine_matrix(sums, counts)
+
+	# Initial scores: average vote, [-10,10] > [0,1]
+	scores = (np.asarray(sums.sum(axis=1)).ravel() / weights + 10) / 20
 
-	scores: dict[str, float] = dict()
-	for vdata in cmps:
-		vdata = cmps[vdata].values()
-		pts = sum([tpl[0] for tpl in vdata])
-		wgt = sum([tpl[1] for tpl in vdata])
-		scores[vdata] = ((pts/wgt + 10) / 20) # [-10,10] > [0,1]
-
-	for i in range(10):
-		newscores = affine_score(cmps, scores)
-		diff = 0
-		max_diff = 0
-		for key in scores:
-			dif = (scores[key] - newscores[key])
-			if dif < 0:
-				dif = -dif
-			diff += dif
-			if dif > max_diff:
-				max_diff = dif
+	for i in range(MAX_ROUNDS):
+		newscores = affine_score(targets, weights, scores)
+		dif = np.abs(scores - newscores)
+		diff = dif.sum()
+		max_diff = dif.max()
 
 		scores = newscores
-		print(f"Affinement {i}: updated {diff:0.2%} (max: {max_diff:0.2%})")
+		if i < 10 or i % 100 == 0 or max_diff < 0.0001:
+			print(f"Affinement {i}: updated {diff:0.2%} (max: {max_diff:0.2%})")
 		if max_diff < 0.0001:
 			break
-		time.sleep(5)
+	scores: dict[str, float] = dict(zip(vids, scores.tolist()))
 
 
 	# # # Print # # #
 
 	sorted_vids = list(scores.keys())
 	sorted_vids.sort(key=lambda x: -scores[x])
-	VIDEOS = data_fetcher.fetch_list(sorted_vids, True)
+	YTAPI = YoutubeAPI()
+	try:
+		YTAPI.load(args['cache'])
+	except FileNotFoundError:
+		pass
+	VIDEOS = YTAPI.videos
 
 	for vdata in sorted_vids:
 		if vdata in VIDEOS:
@@ -1,16 +1,15 @@
 import argparse
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.identifiers import UserIds
+from scripts.kcore import prune_comparisons
 from dao.youtube_api import YTData
 
 def extractComparisons(cmpFile: ComparisonFile, user: str):
 
 	cmps: dict[str, dict[str, tuple[float, float, set[str]]]] = dict() # {vid: {vid2: (sum, count)}}
-	usrs: dict[str,set[str]] = dict() # {vid: {usr1, usr2, ...}}
+	usrs: dict[str,set[int]] = dict() # {vid: {usr1, usr2, ...}} (user codes, see UserIds)
 
 	def parse_line(line: ComparisonLine):
-		if line.criterion != 'largely_recommended' or (user and user != line.user):
-			return
-
 		if not line.vid1 in cmps:
 			cmps[line.vid1] = dict()
 		if not line.vid2 in cmps:
@@ -23,29 +22,17 @@ def extractComparisons(cmpFile: ComparisonFile, user: str):
 			cmpVid1[line.vid2] = (0, 0, set())
 
 		if not user:
-			usrs.setdefault(line.vid1, set()).add(line.user)
-			usrs.setdefault(line.vid2, set()).add(line.user)
+			usr = UserIds.code(line.user)
+			usrs.setdefault(line.vid1, set()).add(usr)
+			usrs.setdefault(line.vid2, set()).add(usr)
 
 		cmpVid1[line.vid2] = (cmpVid1[line.vid2][0]-line.score, cmpVid1[line.vid2][1]+1)
 		cmpVid2[line.vid1] = (cmpVid2[line.vid1][0]+line.score, cmpVid2[line.vid1][1]+1)
-	cmpFile.foreach(parse_line)
+	cmpFile.foreach(parse_line, criterion='largely_recommended', user=user or None)
 
 	# Remove vid with less than 3 comparisons
 	l = len(cmps)
-	toredo = True
-	while toredo:
-		toredo = False
-		for vid in list(cmps.keys()):
-			if not user and len(usrs[vid]) < 3:
-				cmps.pop(vid, None)
-				for sub in cmps.values():
-					sub.pop(vid, None)
-				toredo = True
-			elif len(cmps[vid]) < 3:
-				cmps.pop(vid, None)
-				for sub in cmps.values():
-					sub.pop(vid, None)
-				toredo = True
+	prune_comparisons(cmps, 3, users=None if user else usrs, min_users=3)
 
 	print(f"Total: {l}, Kept for analysis: {len(cmps)}")
 
@@ -65,10 +52,10 @@ def find_ranks(cmps):
 			top.add(v1)
 		else:
 			todo.add(v1)
-	topranks = ranker(top, todo, cmps) # (ranked, not_ranked)
+	topranks = ranker(top, todo, cmps)
 	print('\tTop: ', len(topranks))
 
-	# Find fixed BOTTOM scores
+	# Find fixed BOTTOM scores, among videos not ranked from the top
 	bottom = set()
 	for v1 in list(todo):
 		neg = True
@@ -79,8 +66,11 @@ def find_ranks(cmps):
 		if neg:
 			bottom.add(v1)
 			todo.remove(v1)
-	bottomranks = ranker(bottom, topranks[1], cmps, reversed=True)
-	print('\tBottom: ', len(bottom))
+	bottomranks = ranker(bottom, todo, cmps, reversed=True)
+	print('\tBottom: ', len(bottomranks))
+
+	cycles = find_cycles(todo, cmps)
+	print(f"\tNot ranked: {len(todo)} ({sum(len(c) for c in cycles)} in {len(cycles)} cycle(s))")
 
 	unknownindex = len(topranks)
 	if todo or bottomranks:
@@ -91,31 +81,105 @@ def find_ranks(cmps):
 
 
 def ranker(top:set[str], todo:set[str], cmps:dict[str,dict[str,tuple[float,float]]], reversed=False):
+	"""
+	Rank videos of `todo` in layers after `top` (rank 0): a video is ranked right after the last video it lost against
+	(won against if reversed), once all of them are ranked. Ranked videos are removed from `todo`.
+	Videos in a cycle of lost comparisons (see find_cycles), or after one, are never ranked and stay in `todo`.
+
+	Kahn's topological sort: every video keeps the number of videos it lost against that are not ranked yet,
+	decremented as they get ranked, so each video & comparison is visited once.
+
+	Returns:
+		list[set[str]]: ranked videos, by rank (the first one being `top`)
+	"""
+	lost = (lambda score: score > 0) if reversed else (lambda score: score < 0)
+	waiting: dict[str,int] = {v1: sum(1 for sum_cnt in cmps[v1].values() if lost(sum_cnt[0])) for v1 in todo}
+
 	ranked:list[set[str]] = [top]
-	ranks:dict[str,int] = {vid:0 for vid in top}
-
-	advanced=True
-	while advanced:
-		advanced = False
-		if ranked[-1]:
-			ranked.append(set())
-		for v1 in list(todo):
-			not_yet = False
+	# Videos that lost against no one come just after top ones (or are the top ones if there are none)
+	ready = {v1 for v1,count in waiting.items() if not count}
+	if top:
+		ranked.append(ready)
+	else:
+		top.update(ready)
+
+	rnk = 0
+	while rnk < len(ranked):
+		next_rank = set()
+		for v1 in ranked[rnk]:
 			for v2,sum_cnt in cmps[v1].items():
-				if ((not reversed and sum_cnt[0] < 0) or (reversed and sum_cnt[0] > 0)) and (not v2 in ranks or v2 in ranked[-1]):
-					not_yet = True
-					break
-			if not not_yet:
-				todo.remove(v1)
-				ranks[v1] = len(ranked)-1
-				ranked[ranks[v1]].add(v1)
-				advanced = True
+				# v2 lost against v1
+				if v2 in waiting and lost(-sum_cnt[0]):
+					waiting[v2] -= 1
+					if not waiting[v2]:
+						next_rank.add(v2)
+		if next_rank:
+			if rnk+1 < len(ranked):
+				ranked[rnk+1] |= next_rank
+			else:
+				ranked.append(next_rank)
+		rnk += 1
+
+	for vids in ranked:
+		todo.difference_update(vids)
 
 	if not ranked[-1]:
 		ranked.pop()
 	return ranked
 
 
+def find_cycles(vids:set[str], cmps:dict[str,dict[str,tuple[float,float]]]) -> list[set[str]]:
+	"""
+	Cycles of lost comparisons among `vids` (A lost against B, which lost against C, ..., which lost against A):
+	strongly connected components of more than one video, found with Tarjan's algorithm (iterative).
+
+	Returns:
+		list[set[str]]: one set of videos per cycle
+	"""
+	index:dict[str,int] = dict()
+	lowlink:dict[str,int] = dict()
+	stack:list[str] = []
+	on_stack:set[str] = set()
+	cycles:list[set[str]] = []
+
+	for root in vids:
+		if root in index:
+			continue
+		# (video, iterator over the videos it lost against)
+		work = [(root, iter(cmps[root].items()))]
+		index[root] = lowlink[root] = len(index)
+		stack.append(root)
+		on_stack.add(root)
+		while work:
+			v1, neighbours = work[-1]
+			for v2,sum_cnt in neighbours:
+				if sum_cnt[0] >= 0 or v2 not in vids:
+					continue
+				if v2 not in index:
+					index[v2] = lowlink[v2] = len(index)
+					stack.append(v2)
+					on_stack.add(v2)
+					work.append((v2, iter(cmps[v2].items())))
+					break
+				if v2 in on_stack:
+					lowlink[v1] = min(lowlink[v1], index[v2])
+			else:
+				work.pop()
+				if work:
+					lowlink[work[-1][0]] = min(lowlink[work[-1][0]], lowlink[v1])
+				if lowlink[v1] == index[v1]:
+					component = set()
+					while True:
+						v2 = stack.pop()
+						on_stack.remove(v2)
+						component.add(v2)
+						if v2 == v1:
+							break
+					if len(component) > 1:
+						cycles.append(component)
+	return cycles
+
+
 ################
 ##### MAIN #####
 ################
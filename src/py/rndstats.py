@@ -2,7 +2,7 @@ import argparse
 from datetime import datetime, timedelta
 
 import numpy as np
-from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine, ComparisonScan
 from dao.youtube_api import YTData
 
 MAX_UPDATE = 2500
@@ -56,107 +56,136 @@ def _print_statistics(nb_comps: dict[str, dict[str, int]]):
 
 		print()
 
-def print_users_count_stats(cmpFile: ComparisonFile):
-	print("### Users Statistics ###")
+def _count_into(counts: dict[str, int], keys: np.ndarray):
+	# Add to counts the number of occurrences of every key, keeping keys in order of first appearance
+	keys, first, nbs = np.unique(keys, return_index=True, return_counts=True)
+	order = np.argsort(first)
+	for k, n in zip(keys[order].tolist(), nbs[order].tolist()):
+		counts[k] = counts.get(k, 0) + n
+
+def _users_count_stats(scan: ComparisonScan):
 	nb_comparisons_by_user: dict[str, dict[str, int]] = dict() # Kind, user, count
 	nb_comparisons_by_user['OVERALL'] = dict()
-	users_videos: dict[str,set[str]] = dict()
+	users_videos: dict[str, int] = dict() # user, count of distinct compared videos
 	users_active: set[str] = set()
 	last_4weeks = datetime.today() - timedelta(weeks=4.5)
 
-	def line_parser(line: ComparisonLine):
-		if not line.criterion in nb_comparisons_by_user:
-			nb_comparisons_by_user[line.criterion] = dict()
+	user_vid_pairs: list[np.ndarray] = list()
+	def batch_parser(batch: dict[str, np.ndarray]):
+		users = batch['user'].astype(str)
+		criteria = batch['criterion'].astype(str)
+		_count_into(nb_comparisons_by_user['OVERALL'], users)
+		crits, first = np.unique(criteria, return_index=True)
+		for criterion in crits[np.argsort(first)].tolist():
+			_count_into(nb_comparisons_by_user.setdefault(criterion, dict()), users[criteria == criterion])
 
-		if not line.user in nb_comparisons_by_user[line.criterion]:
-			nb_comparisons_by_user[line.criterion][line.user] = 1
-		else:
-			nb_comparisons_by_user[line.criterion][line.user] += 1
+		user_vid_pairs.append(np.unique(np.char.add(
+			np.char.add(np.concatenate((users, users)), ','),
+			np.concatenate((batch['vid1'], batch['vid2'])).astype(str)
+		)))
 
-		if not line.user in nb_comparisons_by_user['OVERALL']:
-			nb_comparisons_by_user['OVERALL'][line.user] = 1
-		else:
-			nb_comparisons_by_user['OVERALL'][line.user] += 1
+		# Dates are ISO formatted: string comparison is equivalent to date comparison
+		users_active.update(np.unique(users[batch['date'].astype(str) >= last_4weeks.isoformat()]).tolist())
 
-		if not line.user in users_videos:
-			users_videos[line.user] = set()
-		users_videos[line.user].add(line.vid1)
-		users_videos[line.user].add(line.vid2)
+	def print_stats():
+		print("### Users Statistics ###")
+		if user_vid_pairs:
+			_count_into(users_videos, np.char.partition(np.unique(np.concatenate(user_vid_pairs)), ',')[:,0])
+			user_vid_pairs.clear()
 
-		if datetime.fromisoformat(line.date) >= last_4weeks:
-			users_active.add(line.user)
+		_print_statistics(nb_comparisons_by_user)
 
+		topusers = sorted(nb_comparisons_by_user['largely_recommended'].keys(), key=nb_comparisons_by_user['largely_recommended'].get, reverse=True)
+		print('Top 100 active users (by total recommendations count - having at least 1cmp in the last 4 weeks):')
+		for i,u in enumerate(topusers[:100]):
+			print(f"-{i+1:3d}. {u} ({users_videos[u]} videos / {nb_comparisons_by_user['largely_recommended'][u]} recommendations / {nb_comparisons_by_user['OVERALL'][u]} comparisons)")
 
-	cmpFile.foreach(line_parser)
-	_print_statistics(nb_comparisons_by_user)
+	scan.add_batches(batch_parser)
+	scan.then(print_stats)
 
-	topusers = sorted(nb_comparisons_by_user['largely_recommended'].keys(), key=nb_comparisons_by_user['largely_recommended'].get, reverse=True)
-	print('Top 100 active users (by total recommendations count - having at least 1cmp in the last 4 weeks):')
-	for i,u in enumerate(topusers[:100]):
-		print(f"-{i+1:3d}. {u} ({len(users_videos[u])} videos / {nb_comparisons_by_user['largely_recommended'][u]} recommendations / {nb_comparisons_by_user['OVERALL'][u]} comparisons)")
+def print_users_count_stats(cmpFile: ComparisonFile):
+	scan = cmpFile.scan()
+	_users_count_stats(scan)
+	scan.run()
 
 
-def print_videos_count_stats(cmpFile: ComparisonFile):
-	print("### Videos Statistics ###")
+def _count_videos(scan: ComparisonScan) -> dict[str, dict[str, int]]:
 	nb_comparisons_by_video: dict[str, dict[str, int]] = dict() # Kind, video, count
 
-	def line_parser(line: ComparisonLine):
-		if not line.criterion in nb_comparisons_by_video:
-			nb_comparisons_by_video[line.criterion] = dict()
+	def batch_parser(batch: dict[str, np.ndarray]):
+		criteria = np.concatenate((batch['criterion'], batch['criterion'])).astype(str)
+		vids = np.concatenate((batch['vid1'], batch['vid2'])).astype(str)
+		crits, first = np.unique(criteria, return_index=True)
+		for criterion in crits[np.argsort(first)].tolist():
+			_count_into(nb_comparisons_by_video.setdefault(criterion, dict()), vids[criteria == criterion])
 
-		for vid in [line.vid1, line.vid2]:
-			if not vid in nb_comparisons_by_video[line.criterion]:
-				nb_comparisons_by_video[line.criterion][vid] = 1
-			else:
-				nb_comparisons_by_video[line.criterion][vid] += 1
+	scan.add_batches(batch_parser)
+	return nb_comparisons_by_video
 
-	cmpFile.foreach(line_parser)
-	_print_statistics(nb_comparisons_by_video)
+def _videos_count_stats(scan: ComparisonScan) -> dict[str, dict[str, int]]:
+	nb_comparisons_by_video = _count_videos(scan)
 
-def print_creators_stats(cmpFile: ComparisonFile, YTDATA: YTData, fetchunknown: bool):
-	print("### Channels Statistics ###")
-	nb_comparisons_by_channel: dict[str, dict[str, int]] = dict() # Kind, channel, count
+	def print_stats():
+		print("### Videos Statistics ###")
+		_print_statistics(nb_comparisons_by_video)
 
-	vids = set()
-	def _video_lister(line: ComparisonLine):
-		vids.add(line.vid1)
-		vids.add(line.vid2)
-	cmpFile.foreach(_video_lister)
+	scan.then(print_stats)
+	return nb_comparisons_by_video
 
-	if fetchunknown:
-		YTDATA.update(vids, save='data/YTData_cache.json.gz', cachedDays=122, max_update=MAX_UPDATE)
-
-	unknownvid = set()
-	def _line_parser(line: ComparisonLine):
-		if not line.criterion in nb_comparisons_by_channel:
-			nb_comparisons_by_channel[line.criterion] = dict()
-
-		for vid in [line.vid1, line.vid2]:
-			if not vid in YTDATA.videos or not YTDATA.videos[vid].channel:
-				unknownvid.add(vid)
-				continue
-
-			channel = YTDATA.videos[vid].channel
-			cname = channel['name'] or channel.id
-			if not cname in nb_comparisons_by_channel[line.criterion]:
-				nb_comparisons_by_channel[line.criterion][cname] = 1
-			else:
-				nb_comparisons_by_channel[line.criterion][cname] += 1
-	cmpFile.foreach(_line_parser)
+def print_videos_count_stats(cmpFile: ComparisonFile):
+	scan = cmpFile.scan()
+	_videos_count_stats(scan)
+	scan.run()
+
+
+def _creators_stats(scan: ComparisonScan, YTDATA: YTData, fetchunknown: bool, nb_comparisons_by_video: dict[str, dict[str, int]]=None):
+	# Channels statistics only need the number of comparisons of every video: reuse it if already computed by the scan
+	if nb_comparisons_by_video is None:
+		nb_comparisons_by_video = _count_videos(scan)
 
-	if unknownvid:
-		print(f"  Analysed: {len(vids) - len(unknownvid)}/{len(vids)} videos (Some data missing from YTData cache)")
+	def print_stats():
+		print("### Channels Statistics ###")
+		nb_comparisons_by_channel: dict[str, dict[str, int]] = dict() # Kind, channel, count
 
-	_print_statistics(nb_comparisons_by_channel)
+		vids = set()
+		for counts in nb_comparisons_by_video.values():
+			vids.update(counts.keys())
+
+		if fetchunknown:
+			YTDATA.update(vids, save='data/YTData_cache.json.gz', cachedDays=122, max_update=MAX_UPDATE)
+
+		unknownvid = set()
+		for criterion, counts in nb_comparisons_by_video.items():
+			nb_comparisons_by_channel[criterion] = dict()
+			for vid, count in counts.items():
+				if not vid in YTDATA.videos or not YTDATA.videos[vid].channel:
+					unknownvid.add(vid)
+					continue
+
+				channel = YTDATA.videos[vid].channel
+				cname = channel['name'] or channel.id
+				nb_comparisons_by_channel[criterion][cname] = nb_comparisons_by_channel[criterion].get(cname, 0) + count
+
+		if unknownvid:
+			print(f"  Analysed: {len(vids) - len(unknownvid)}/{len(vids)} videos (Some data missing from YTData cache)")
+
+		_print_statistics(nb_comparisons_by_channel)
+
+	scan.then(print_stats)
+
+def print_creators_stats(cmpFile: ComparisonFile, YTDATA: YTData, fetchunknown: bool):
+	scan = cmpFile.scan()
+	_creators_stats(scan, YTDATA, fetchunknown)
+	scan.run()
 
 
 def print_global_stats(cmpFile: ComparisonFile, cache: YTData, fetchunknown: bool):
-	print_users_count_stats(cmpFile)
-	print
-	print_videos_count_stats(cmpFile)
-	print
-	print_creators_stats(cmpFile, cache, fetchunknown)
-	print
+	# All statistics computed from a single read of the comparisons file
+	scan = cmpFile.scan()
+	_users_count_stats(scan)
+	nb_comparisons_by_video = _videos_count_stats(scan)
+	_creators_stats(scan, cache, fetchunknown, nb_comparisons_by_video)
+	scan.run()
 
 
 def print_user_specific_stats(cmpFile: ComparisonFile, YTDATA: YTData, user: str, fetchunknown: bool):
@@ -164,15 +193,12 @@ def print_user_specific_stats(cmpFile: ComparisonFile, YTDATA: YTData, user: str
 	criteria_values: dict[str, list[int]] = dict() # {criteria: [<int>, .. (index=10)<int>]}
 
 	def line_parser(line: ComparisonLine):
-		if line.user != user:
-			return
-
 		if not line.criterion in criteria_values:
 			criteria_values[line.criterion] = [0]*11
 
 		criteria_values[line.criterion][int(np.abs(line.score))] += 1
 
-	cmpFile.foreach(line_parser)
+	cmpFile.foreach(line_parser, user=user)
 
 	if fetchunknown:
 		YTDATA.update(criteria_values.keys(), save='data/YTData_cache.json.gz', cachedDays=122, max_update=MAX_UPDATE)
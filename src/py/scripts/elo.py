@@ -1,4 +1,7 @@
 import math
+import numpy as np
+import scipy.sparse
+import scipy.sparse.linalg
 
 # eloA: rating of player A
 # eloB: rating of player B
@@ -51,3 +54,157 @@ def compute_elo_rating_outcome(Ra, Rb, K, outcome):
 	upd_b = K * (pb_a - outcome)
 
 	return (upd_a, upd_b)
+
+
+# Vectorized updateRating: same formula applied on arrays of ratings & outcomes
+def updateRatings(eloA: np.ndarray, eloB: np.ndarray, outcome: np.ndarray, factor: float) -> tuple[np.ndarray, np.ndarray]:
+	currentProba = 1 / (1 + np.power(10, (eloB - eloA) / 400))
+	newProba = (outcome+1)/2*factor + currentProba*(1-factor)
+	total = eloA + eloB
+	newB = (np.log10(1/newProba - 1)*400 + total)/2
+	return (total - newB, newB)
+
+
+ELO_TOLERANCE = 2e-4 # Competition stops when the mean rating change over an epoch is below this fraction of ratings standard deviation
+
+def run_competition(
+	playerA: np.ndarray,
+	playerB: np.ndarray,
+	outcome: np.ndarray,
+	nb_players: int,
+	factor: float,
+	max_epochs: int,
+	tolerance: float = ELO_TOLERANCE,
+	seed: int = None,
+	initial: float = 1000.0,
+) -> tuple[np.ndarray, int]:
+	"""
+	Elo competition: every epoch, all comparisons are played in random order (updateRating).
+
+	Each epoch is processed in mini-batches: comparisons of a batch are computed from ratings at the start of the batch,
+	and updates of a player are summed. Batches are small enough for the most compared player to appear about 1/factor
+	times per batch, so that ratings are close to the ones of a sequential competition.
+
+	Args:
+		playerA, playerB (np.ndarray[int]): Index (in [0, nb_players[) of both players of each comparison
+		outcome (np.ndarray[float]): Result of each comparison (-1: player B win 100%, 0: draw, 1: player A win 100%)
+		nb_players (int): Number of players
+		factor (float): Update speed of ratings, between 0 and 1 (EXCLUSIVE), see updateRating
+		max_epochs (int): Maximum number of epochs
+		tolerance (float, optional): Stop when the mean rating change over an epoch is below this fraction of ratings standard deviation
+		seed (int, optional): Random seed (same inputs and seed give the same ratings)
+		initial (float, optional): Initial rating of all players
+
+	Returns:
+		tuple[np.ndarray, int]: (rating of every player, number of epochs played)
+	"""
+	rng = np.random.default_rng(seed)
+	elo = np.full(nb_players, initial, dtype=float)
+	if len(playerA) == 0:
+		return (elo, 0)
+
+	max_degree = np.bincount(np.concatenate((playerA, playerB)), minlength=nb_players).max()
+	nb_batches = min(len(playerA), max(1, math.ceil(max_degree * factor)))
+
+	epoch = 0
+	for epoch in range(1, max_epochs+1):
+		previous = elo.copy()
+		for batch in np.array_split(rng.permutation(len(playerA)), nb_batches):
+			a = playerA[batch]
+			b = playerB[batch]
+			eloA, eloB = elo[a], elo[b]
+			newA, newB = updateRatings(eloA, eloB, outcome[batch], factor)
+			elo += np.bincount(a, newA - eloA, nb_players) + np.bincount(b, newB - eloB, nb_players)
+
+		if elo.min() <= 0:
+			break
+		std = elo.std()
+		if std > 0 and np.abs(elo - previous).mean() < tolerance * std:
+			break
+
+	return (elo, epoch)
+
+
+BT_PRIOR = 0.1 # Gaussian prior precision on strengths: keeps them finite for videos never losing (or never winning)
+BT_DENSE_LIMIT = 5000 # Up to this number of players, standard errors use the exact inverse of the Hessian
+
+def bradley_terry(
+	playerA: np.ndarray,
+	playerB: np.ndarray,
+	outcome: np.ndarray,
+	nb_players: int,
+	prior: float = BT_PRIOR,
+	tolerance: float = 1e-6,
+	max_iterations: int = 100,
+) -> tuple[np.ndarray, np.ndarray, int]:
+	"""
+	Maximum a posteriori Bradley-Terry strengths, by Newton iterations on the sparse comparison graph.
+	P(A beats B) = 1 / (1 + exp(strengthB - strengthA)), each comparison counting as (outcome+1)/2 win of A
+	and (1-outcome)/2 win of B.
+
+	Args:
+		playerA, playerB (np.ndarray[int]): Index (in [0, nb_players[) of both players of each comparison
+		outcome (np.ndarray[float]): Result of each comparison (-1: player B win 100%, 0: draw, 1: player A win 100%)
+		nb_players (int): Number of players
+		prior (float, optional): Precision of the gaussian prior centered on 0 (must be > 0)
+		tolerance (float, optional): Stop when no strength moves by more than this value in an iteration
+		max_iterations (int, optional): Maximum number of Newton iterations
+
+	Returns:
+		tuple[np.ndarray, np.ndarray, int]: (strength of every player, its standard error, number of iterations)
+			Standard errors come from the inverse of the Hessian at the optimum (exact diagonal up to BT_DENSE_LIMIT players,
+			otherwise 1/sqrt of its diagonal, ignoring covariances with other players: a lower bound).
+	"""
+	# Aggregate comparisons by pair of players (i < j): count & wins of i
+	wins = (np.asarray(outcome, dtype=float) + 1) / 2
+	i = np.minimum(playerA, playerB).astype(np.int64)
+	j = np.maximum(playerA, playerB).astype(np.int64)
+	wins = np.where(i == playerA, wins, 1 - wins)
+	keep = i != j # A player against itself brings no information
+	pairs, inverse = np.unique(i[keep] * nb_players + j[keep], return_inverse=True)
+	count = np.bincount(inverse, minlength=len(pairs)).astype(float)
+	wins = np.bincount(inverse, wins[keep], minlength=len(pairs))
+	i, j = pairs // nb_players, pairs % nb_players
+
+	def log_posterior(theta: np.ndarray) -> float:
+		d = theta[i] - theta[j]
+		return -np.sum(wins * np.logaddexp(0, -d) + (count - wins) * np.logaddexp(0, d)) - prior/2 * np.dot(theta, theta)
+
+	def hessian(p: np.ndarray) -> scipy.sparse.csr_matrix:
+		# Negated Hessian of the log posterior: weighted graph laplacian + prior
+		h = count * p * (1 - p)
+		diag = np.bincount(i, h, nb_players) + np.bincount(j, h, nb_players) + prior
+		return scipy.sparse.csr_matrix(
+			(np.concatenate((-h, -h, diag)), (np.concatenate((i, j, np.arange(nb_players))), np.concatenate((j, i, np.arange(nb_players))))),
+			shape=(nb_players, nb_players),
+		)
+
+	theta = np.zeros(nb_players)
+	current = log_posterior(theta)
+	iteration = 0
+	for iteration in range(1, max_iterations+1):
+		p = 1 / (1 + np.exp(theta[j] - theta[i]))
+		residual = wins - count * p
+		gradient = np.bincount(i, residual, nb_players) - np.bincount(j, residual, nb_players) - prior * theta
+		H = hessian(p)
+		step, _ = scipy.sparse.linalg.cg(H, gradient, rtol=1e-10, M=scipy.sparse.diags(1 / H.diagonal()))
+
+		# Step halving, in case of overshoot far from the optimum
+		scale = 1.0
+		updated = log_posterior(theta + step)
+		while updated < current and scale > 1e-4:
+			scale /= 2
+			updated = log_posterior(theta + scale * step)
+		if updated < current: # No improving step left: numerically converged
+			break
+		theta += scale * step
+		current = updated
+		if np.abs(scale * step).max() < tolerance:
+			break
+
+	H = hessian(1 / (1 + np.exp(theta[j] - theta[i])))
+	if nb_players <= BT_DENSE_LIMIT:
+		stderr = np.sqrt(np.diag(np.linalg.inv(H.toarray())))
+	else:
+		stderr = 1 / np.sqrt(H.diagonal())
+	return (theta, stderr, iteration)
@@ -2,13 +2,19 @@ from typing import Callable
 import numpy as np
 from numpy._typing import NDArray
 import networkx as nx
-from numba import jit
+from numba import jit, prange
+from utils import instrument
+
+BH_LEVELS = 20 # Maximum depth of the Barnes-Hut quadtree (nodes closer than layout width / 2**BH_LEVELS share a leaf)
+BH_MIN_NODES = 2000 # From this number of nodes, layouts are to be computed with ForceLayout.iterate4 instead of the O(n²) iterations
 
 
 @jit(target_backend='cuda', nopython=True)
 def gpu_iterate(
 		n:int,
-		edges:list[float],
+		edges_ptr:NDArray,
+		edges_idx:NDArray,
+		edges_len:NDArray,
 		x: NDArray,
 		dx: NDArray,
 		attraction_factor:float=0.001,
@@ -20,6 +26,7 @@ def gpu_iterate(
 	):
 	"""
 	Args:
+		edges_ptr, edges_idx, edges_len: desired edges lengths, see ForceLayout (CSR)
 		attraction_factor (float, optional): Increased value makes edged attraction force higher. Defaults to 0.001.
 		repulsion_factor (float, optional): Increased value makes disconnected edges repulsion higher. Defaults to 0.001.
 		repulse_lower_bound (float, optional): Minimum distance between two nodes to be enforced. Defaults to 0.01.
@@ -34,8 +41,12 @@ def gpu_iterate(
 		dx *= inertia_factor
 
 		for i in range(1,n):
+			e = edges_ptr[i] # Next edge of node i (sorted by j)
 			for j in range(0,i):
-				desired_d:float = edges[int(j*n+i)]
+				desired_d:float = 0
+				if e < edges_ptr[i+1] and edges_idx[e] == j:
+					desired_d = edges_len[e]
+					e += 1
 				if desired_d < 0:
 					continue
 
@@ -64,6 +75,125 @@ def gpu_iterate(
 		x += dx
 	return (x, dx)
 
+@jit(nopython=True, parallel=True)
+def barnes_hut_repulsion(
+		x: NDArray,
+		repulsion_factor:float=0.001,
+		repulse_lower_bound:float=0.01,
+		repulse_upper_bound:float=np.inf,
+		theta:float=0.1,
+	) -> NDArray:
+	"""
+	Repulsion force on every node from all other nodes (same force as gpu_iterate between two disconnected nodes),
+	groups of nodes far enough being approximated by their center (Barnes-Hut).
+
+	The quadtree is implicit: nodes are sorted by their Morton code (interleaved bits of x & y cells indexes),
+	a tree node being a range of sorted nodes sharing a code prefix, with their center computed from cumulated positions.
+
+	Args:
+		theta (float, optional): A group of nodes is approximated when its cell is fully within repulse_upper_bound of the node,
+			and its width is less than theta times its distance to the node (0: no approximation)
+
+	Returns:
+		NDArray: [[fx, fy], ...] for every node
+	"""
+	n = len(x)
+	forces = np.zeros((n, 2))
+	if n < 2:
+		return forces
+	repulse_lower = repulse_lower_bound ** 2
+	repulse_upper = repulse_upper_bound ** 2
+	theta2 = theta ** 2
+
+	# Sort nodes by Morton code
+	low_x = x[:,0].min()
+	low_y = x[:,1].min()
+	width = max(x[:,0].max() - low_x, x[:,1].max() - low_y) * (1 + 1e-9)
+	if width <= 0:
+		width = 1.0
+	side = 1 << BH_LEVELS
+	codes = np.zeros(n, dtype=np.int64)
+	for i in range(n):
+		cx = min(int((x[i,0] - low_x) / width * side), side-1)
+		cy = min(int((x[i,1] - low_y) / width * side), side-1)
+		for b in range(BH_LEVELS-1, -1, -1):
+			codes[i] = codes[i]*4 + ((cx >> b) & 1)*2 + ((cy >> b) & 1)
+	order = np.argsort(codes)
+	codes = codes[order]
+	xs = x[order]
+	cum = np.zeros((n+1, 2))
+	for i in range(n):
+		cum[i+1] = cum[i] + xs[i]
+
+	for k in prange(n):
+		px = xs[k,0]
+		py = xs[k,1]
+		fx = 0.0
+		fy = 0.0
+		# Stack of tree nodes to visit: (start, end, level, code prefix), and their cell origin
+		stack_i = np.zeros((4*BH_LEVELS+4, 4), dtype=np.int64)
+		stack_o = np.zeros((4*BH_LEVELS+4, 2))
+		stack_i[0] = (0, n, 0, 0)
+		stack_o[0] = (low_x, low_y)
+		sp = 1
+		while sp > 0:
+			sp -= 1
+			start, end, level, prefix = stack_i[sp]
+			ox, oy = stack_o[sp]
+			cell = width / (1 << level)
+
+			# Ignore cells out of repulsion range
+			bx = max(ox - px, 0.0, px - ox - cell)
+			by = max(oy - py, 0.0, py - oy - cell)
+			if bx*bx + by*by >= repulse_upper:
+				continue
+
+			if end - start == 1 or level == BH_LEVELS:
+				# Leaf: exact repulsion from its nodes
+				for j in range(start, end):
+					if j == k:
+						continue
+					vx = px - xs[j,0]
+					vy = py - xs[j,1]
+					d2 = vx*vx + vy*vy
+					if d2 < repulse_upper:
+						if d2 < repulse_lower: # prevent divide 0
+							d2 = repulse_lower
+						fx += repulsion_factor * vx / d2
+						fy += repulsion_factor * vy / d2
+				continue
+
+			count = end - start
+			vx = px - (cum[end,0] - cum[start,0]) / count
+			vy = py - (cum[end,1] - cum[start,1]) / count
+			d2 = vx*vx + vy*vy
+			# Farthest point of the cell: cells crossing the repulsion range limit are always opened,
+			# so that the cutoff is applied to each of their nodes
+			bx = max(abs(ox - px), abs(px - ox - cell))
+			by = max(abs(oy - py), abs(py - oy - cell))
+			if (not start <= k < end) and bx*bx + by*by < repulse_upper and cell*cell < theta2*d2:
+				# Far enough, and fully in repulsion range: approximated by its center
+				if d2 < repulse_lower:
+					d2 = repulse_lower
+				fx += count * repulsion_factor * vx / d2
+				fy += count * repulsion_factor * vy / d2
+				continue
+
+			# Visit children cells
+			shift = 2*(BH_LEVELS - level - 1)
+			half = cell / 2
+			for c in range(4):
+				child = prefix*4 + c
+				lo = start + np.searchsorted(codes[start:end], child << shift)
+				hi = start + np.searchsorted(codes[start:end], (child+1) << shift)
+				if hi > lo:
+					stack_i[sp] = (lo, hi, level+1, child)
+					stack_o[sp] = (ox + (c >> 1)*half, oy + (c & 1)*half)
+					sp += 1
+		forces[order[k],0] = fx
+		forces[order[k],1] = fy
+	return forces
+
 class ForceLayout():
 	"""
 	A simple approach to force-directed graph layout.
@@ -71,8 +201,11 @@ class ForceLayout():
 	self.G: nx.Graph
 	self.n: int (number of nodes)
 	self.nodes: list(nx.NodeView) ([node1, ...])
+	self.index: dict[node, int] ({node1: 0, ...})
 	self.x: list[list[int, int]] ([[x, y], ...])
 	self.dx: list[list[int, int]] ([[dx, dy], ...])
+	self.edges_ptr, self.edges_idx, self.edges_len: desired edges lengths, in CSR format:
+		edges of node i with nodes j < i are edges_idx[edges_ptr[i]:edges_ptr[i+1]] (sorted), of lengths edges_len[edges_ptr[i]:edges_ptr[i+1]]
 	"""
 
 	def __init__(self, G: nx.Graph):
@@ -83,11 +216,15 @@ class ForceLayout():
 		self.G: nx.Graph = G
 		self.n: int = 0
 		self.nodes: list[str] = []
-		self.x: NDArray = np.array([],dtype=(float,float))
-		self.dx: NDArray = np.array([],dtype=(float,float))
-		self.edges: list[list[float]] = list()
+		self.index: dict[str, int] = dict()
+		self.x: NDArray = np.zeros((0,2))
+		self.dx: NDArray = np.zeros((0,2))
+		self.edges_ptr: NDArray = np.zeros(1, dtype=np.int64)
+		self.edges_idx: NDArray = np.zeros(0, dtype=np.int64)
+		self.edges_len: NDArray = np.zeros(0, dtype=np.int64)
 
 
+	@instrument.timed()
 	def update_graph(self,
 		pos:dict[str,tuple[float,float]]=None,
 		edge_lengths: str | Callable[[str, str, dict[str, any]], float | None]=None,
@@ -107,31 +244,39 @@ class ForceLayout():
 
 			pos (dict[node,ArrayLike[float]]):
 				Initial location of nodes (if none, will be initialized randomly)
+
+		Nodes already known keep their location & speed (unless given in pos), new nodes are added at the end:
+		after adding nodes or edges to the graph, an update costs O(nodes + edges).
 		"""
-		new_nodes: list[str] = []
-		new_x: list[tuple[float,float]] = []
-		new_dx: list[tuple[float,float]] = []
-
-		for n in self.G.nodes:
-			new_nodes.append(n)
-			if n in pos:
-				new_x.append(pos[n])
-				new_dx.append([0,0])
-			elif n in self.nodes:
-				i = self.nodes.index(n)
-				new_x.append(self.x[i])
-				new_dx.append(self.dx[i])
-			else:
-				new_x.append(np.random.rand(2))
-				new_dx.append([0,0])
-
-		self.n = len(new_nodes)
-		self.nodes = new_nodes
-		self.x = np.array(new_x,dtype=(float,float))
-		self.dx = np.array(new_dx,dtype=(float,float))
-		self.edges = np.array([0] * ((self.n-1)*self.n))
+		pos = pos or dict()
+
+		# Forget nodes removed from the graph
+		if any(n not in self.G for n in self.nodes):
+			kept = [i for i,n in enumerate(self.nodes) if n in self.G]
+			self.nodes = [self.nodes[i] for i in kept]
+			self.index = {n: i for i,n in enumerate(self.nodes)}
+			self.x = self.x[kept]
+			self.dx = self.dx[kept]
+
+		# Add new nodes
+		new_nodes = [n for n in self.G.nodes if n not in self.index]
+		for n in new_nodes:
+			self.index[n] = len(self.nodes)
+			self.nodes.append(n)
+		self.n = len(self.nodes)
+		self.x = np.concatenate((self.x, np.random.rand(len(new_nodes), 2)))
+		self.dx = np.concatenate((self.dx, np.zeros((len(new_nodes), 2))))
+
+		for n,p in pos.items():
+			i = self.index.get(n)
+			if i is not None:
+				self.x[i] = p
+				self.dx[i] = 0
 
 		# Precompute weights
+		n1s: list[int] = []
+		n2s: list[int] = []
+		lengths: list[float] = []
 		for edge in self.G.edges.data():
 			w = 0
 			if isinstance(edge_lengths, Callable): # provided weight function
@@ -139,12 +284,22 @@ class ForceLayout():
 			elif edge_lengths in edge[2]: # provided weight property's name
 				w = edge[2][edge_lengths]
 			edge[2]['fdg_d'] = w # save desired distance
-			n1 = self.nodes.index(edge[0])
-			n2 = self.nodes.index(edge[1])
-			if n2 < n1:
-				n1,n2 = n2,n1
-			self.edges[n1*self.n + n2] = w
-
+			n1 = self.index[edge[0]]
+			n2 = self.index[edge[1]]
+			if n1 != n2:
+				n1s.append(max(n1, n2))
+				n2s.append(min(n1, n2))
+				lengths.append(w or 0)
+
+		n1s = np.array(n1s, dtype=np.int64)
+		n2s = np.array(n2s, dtype=np.int64)
+		order = np.lexsort((n2s, n1s))
+		self.edges_ptr = np.concatenate(([0], np.cumsum(np.bincount(n1s, minlength=self.n)))).astype(np.int64)
+		self.edges_idx = n2s[order]
+		# Lengths have always been stored as integers (lengths under 1 act as 0: 'distance can be anything')
+		self.edges_len = np.array(lengths, dtype=float)[order].astype(np.int64)
+
+	@instrument.timed()
 	def iterate3(self,
 		attraction_factor:float=0.001,
 		repulsion_factor:float=0.001,
@@ -155,7 +310,9 @@ class ForceLayout():
 	):
 		new_x, new_dx = gpu_iterate(
 			self.n,
-			self.edges,
+			self.edges_ptr,
+			self.edges_idx,
+			self.edges_len,
 			self.x,
 			self.dx,
 			attraction_factor,
@@ -167,8 +324,54 @@ class ForceLayout():
 		)
 		self.x = new_x
 		self.dx = new_dx
+		instrument.count('force_layout.iterations', iterations)
 
 
+	@instrument.timed()
+	def iterate4(self,
+		attraction_factor:float=0.001,
+		repulsion_factor:float=0.001,
+		repulse_lower_bound:float=0.01,
+		repulse_upper_bound:float=np.inf,
+		inertia_factor:float=0.25,
+		iterations:int=1,
+		theta:float=0.1,
+	):
+		"""
+		Same forces as iterate3, in O(n.log(n) + edges) per iteration instead of O(n²):
+		repulsion between all nodes is approximated with a Barnes-Hut quadtree (see barnes_hut_repulsion),
+		then, for edges only, spring force is applied instead of the repulsion.
+
+		Args:
+			theta (float, optional): Barnes-Hut approximation threshold (0: exact, higher: faster & less precise). Defaults to 0.1,
+				for which layouts drift from the exact ones about as much as from rounding errors (with a repulse_upper_bound).
+			(others: see gpu_iterate)
+		"""
+		springs = np.flatnonzero(self.edges_len)
+		src = np.repeat(np.arange(self.n), np.diff(self.edges_ptr))[springs]
+		dst = self.edges_idx[springs]
+		desired_d = self.edges_len[springs,None]
+		repulse_lower = repulse_lower_bound ** 2
+		repulse_upper = repulse_upper_bound ** 2
+
+		for it in range(iterations):
+			self.dx *= inertia_factor
+			self.dx += barnes_hut_repulsion(self.x, repulsion_factor, repulse_lower_bound, repulse_upper_bound, theta)
+
+			vector_ji = self.x[src] - self.x[dst]
+			current_d2 = np.sum(vector_ji*vector_ji, axis=1, keepdims=True)
+			# Spring force, and no repulsion between edged nodes
+			force = attraction_factor * vector_ji * (desired_d - np.sqrt(current_d2))
+			force -= np.where(current_d2 < repulse_upper, repulsion_factor * vector_ji / np.maximum(current_d2, repulse_lower), 0)
+			for axis in range(2):
+				self.dx[:,axis] += np.bincount(src, force[:,axis], self.n) - np.bincount(dst, force[:,axis], self.n)
+
+			# Apply forces
+			self.x += self.dx
+		instrument.count('force_layout.iterations', iterations)
+
+
+	@instrument.timed()
 	def iterate2(self,
 		attraction_factor:float=0.001,
 		repulsion_factor:float=0.001,
@@ -187,19 +390,19 @@ class ForceLayout():
 		self.dx *= inertia_factor
 
 		for i in range(1,self.n):
-			ni = self.nodes[i]
+			edges = slice(self.edges_ptr[i], self.edges_ptr[i+1])
+			lengths = dict(zip(self.edges_idx[edges].tolist(), self.edges_len[edges].tolist())) # {j: desired length}
 
 			ji = -self.x[0:i] + self.x[i,None]
 			dists = np.linalg.norm(ji, axis=1)
 
 			for j in range(0,i):
-				nj = self.nodes[j]
 				vector_ji = ji[j]
 				current_d = dists[j]
 
 				# Apply spring force
-				if nj in self.G[ni]:
-					desired_d = self.edges[j*self.n + i]
+				if j in lengths:
+					desired_d = lengths[j]
 					if not desired_d:
 						continue
 
@@ -220,8 +423,10 @@ class ForceLayout():
 		dabs = np.abs(self.dx)
 		self.dx = np.where(dabs > 1, np.sign(self.dx) * np.sqrt(dabs), self.dx)
 		self.x += self.dx
+		instrument.count('force_layout.iterations')
 
 
+	@instrument.timed()
 	def iterate1(self,
 		power=0.001,
 		repulse_lower_bound=0.01,
@@ -277,6 +482,7 @@ class ForceLayout():
 
 		# Apply forces
 		self.x += self.dx
+		instrument.count('force_layout.iterations')
 		return np.linalg.norm(self.dx)
 
 	def get_pos(self):
@@ -5,26 +5,37 @@ import matplotlib
 from matplotlib.figure import Figure
 import matplotlib.pyplot as plt
 import networkx as nx
+import numpy as np
 import time
+from typing import Iterator
+from concurrent.futures import ProcessPoolExecutor
 
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
 from dao.youtube_api import YTVideo
-from scripts.force_directed_graph import ForceLayout
+from scripts.force_directed_graph import BH_MIN_NODES, ForceLayout
+from utils import instrument
 
 matplotlib.use("svg")
 
 
+
+@instrument.timed('grapher.build_graph')
 def build_graph(input_dir: str, target_user: str):
 	graph = nx.Graph()
 	comparisons = ComparisonFile(input_dir)
+	criterion = 'largely_recommended'
 
+	# Single read of the comparisons file: count comparisons of every user,
+	# and keep in memory the ones of the criterion to be parsed once users are known
+	scan = comparisons.scan()
 	users_data:dict[str, int] = dict()
-	def __fetch_usercmpscount(ldata: ComparisonLine):
-		if not ldata.user in users_data:
-			users_data[ldata.user] = 1
-		else:
-			users_data[ldata.user] = users_data[ldata.user] + 1
-	comparisons.foreach(__fetch_usercmpscount)
+	def __fetch_usercmpscount(batch: dict[str, np.ndarray]):
+		users, counts = np.unique(batch['user'].astype(str), return_counts=True)
+		for user, count in zip(users.tolist(), counts.tolist()):
+			users_data[user] = users_data.get(user, 0) + count
+	scan.add_batches(__fetch_usercmpscount)
+	criterion_comparisons = scan.retain(lambda batch: batch['criterion'] == criterion)
+	scan.run()
 
 	# Exclude users with not enough comparisons
 	other_users = {uid for uid in users_data if users_data[uid] > 2}
@@ -32,7 +43,6 @@ def build_graph(input_dir: str, target_user: str):
 		other_users.add(target_user)
 
 	# Parsing comparison data
-	criterion = 'largely_recommended'
 	def __unload_comparison_data(ldata: ComparisonLine):
 		if ldata.criterion != criterion or ldata.user not in other_users:
 			return
@@ -46,13 +56,78 @@ def build_graph(input_dir: str, target_user: str):
 		if ldata.user == target_user:
 			edge['cmp_by_me'] = True
 
-	comparisons.foreach(__unload_comparison_data)
+	criterion_comparisons.foreach(__unload_comparison_data)
 
 	return graph
 
 
 
-def add_recommended_nodes(graph: nx.Graph, videos: dict[str, YTVideo]):
+_worker_graph: tuple = None # (indptr, indices, targets, targets names ranks), set in worker processes by _init_farthest
+
+def _init_farthest(indptr: np.ndarray, indices: np.ndarray, targets: np.ndarray, rank: np.ndarray):
+	global _worker_graph
+	_worker_graph = (indptr, indices, targets, rank)
+
+def _farthest_from(sources: np.ndarray) -> tuple[int, list[tuple[int, int]]]:
+	# Runs in worker processes: breadth first search from up to 64 sources at once (one bit of the masks per source),
+	# reduced to the pairs (source, target) at the maximum distance found
+	indptr, indices, targets, rank = _worker_graph
+	no_neighbours = indptr[:-1] == indptr[1:]
+	visited = np.zeros(len(indptr)-1, dtype=np.uint64)
+	visited[targets[sources]] = np.uint64(1) << np.arange(len(sources), dtype=np.uint64)
+	frontier = visited
+	max_min, reached = 0, visited[targets] # {target: sources at distance max_min}
+	distance = 0
+	while True:
+		distance += 1
+		# Nodes next to the frontier of each source: OR of their neighbours masks
+		frontier = np.bitwise_or.reduceat(np.append(frontier[indices], np.uint64(0)), indptr[:-1]) & ~visited
+		frontier[no_neighbours] = 0
+		if not frontier.any():
+			break
+		visited = visited | frontier
+		if frontier[targets].any():
+			max_min, reached = distance, frontier[targets]
+
+	# Keep each pair once (source name < target name)
+	found = (reached[None,:] >> np.arange(len(sources), dtype=np.uint64)[:,None]) & np.uint64(1) == 1
+	found &= rank[None,:] > rank[sources][:,None]
+	return (max_min, [(int(sources[i]), int(j)) for i,j in zip(*np.nonzero(found))])
+
+def farthest_pairs(graph: nx.Graph, nodes: list[str], workers: int = 1) -> Iterator[tuple[int, list[tuple[str, str]]]]:
+	"""
+	Shortest path lengths between all pairs of `nodes` (not connected pairs being ignored), with breadth first searches from blocks of 64 source nodes at once,
+	each block being reduced to the pairs at the maximum distance found, so that all distances are never in memory.
+
+	Args:
+		graph (nx.Graph): graph, edges all having a length of 1
+		nodes (list[str]): source & target nodes
+		workers (int, optional): Number of processes running the searches
+
+	Yields:
+		tuple[int, list[tuple[str, str]]]: maximum distance of a block, and pairs (node1, node2) at this distance,
+			with node2 > node1, in `nodes` order
+	"""
+	index = {node: i for i,node in enumerate(graph.nodes)}
+	adjacency = nx.to_scipy_sparse_array(graph, nodelist=list(graph.nodes), weight=None, format='csr')
+	targets = np.array([index[node] for node in nodes], dtype=np.int64)
+	rank = np.argsort(np.argsort(np.array(nodes, dtype=str))) # Order of nodes names
+	blocks = [np.arange(start, min(start+64, len(nodes))) for start in range(0, len(nodes), 64)]
+	graph_data = (adjacency.indptr, adjacency.indices, targets, rank)
+
+	if workers > 1:
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_farthest, initargs=graph_data) as pool:
+			for max_min, pairs in pool.map(_farthest_from, blocks, chunksize=max(1, len(blocks) // (4*workers))):
+				yield (max_min, [(nodes[i], nodes[j]) for i,j in pairs])
+	else:
+		_init_farthest(*graph_data)
+		for sources in blocks:
+			max_min, pairs = _farthest_from(sources)
+			yield (max_min, [(nodes[i], nodes[j]) for i,j in pairs])
+
+
+@instrument.timed('grapher.add_recommended_nodes')
+def add_recommended_nodes(graph: nx.Graph, videos: dict[str, YTVideo], workers: int = 1):
 	# Keep only nodes compared by me
 	keep_nodes = set()
 	for edge in graph.edges.data():
@@ -80,20 +155,13 @@ def add_recommended_nodes(graph: nx.Graph, videos: dict[str, YTVideo]):
 
 	max_max_min = 0
 	paths: list[tuple[str, str]] = []
-	for node1 in nodes:
-		shrt_paths = dict() # {target: shortestpath}
-		for node2 in nodes:
-			shrt_paths[node2] = nx.shortest_path_length(graph, node1, node2, weight=None)
-
-		max_min = max(shrt_paths.values())
+	for max_min, pairs in farthest_pairs(graph, nodes, workers):
 		if max_min > max_max_min:
 			paths = []
 			max_max_min = max_min
 
 		if max_min == max_max_min:
-			for node2 in shrt_paths:
-				if node2 in nodes and node2 > node1 and shrt_paths[node2] == max_min:
-					paths.append((node1, node2))
+			paths.extend(pairs)
 
 	print('Maximum distance =', max_max_min)
 	# Sort by 1: max degree, 2: sum of degrees
@@ -119,6 +187,7 @@ def get_vids_by_me(graph: nx.Graph):
 			vids_to_show.add(edge[1])
 	return vids_to_show
 
+@instrument.timed('grapher.optimize_graph_pos')
 def optimize_graph_pos(graph: nx.Graph, pos: dict, max_duration: int):
 	# pos = nx.circular_layout(subgraph)
 	# pos = nx.random_layout(subgraph, seed=94)
@@ -138,7 +207,8 @@ def optimize_graph_pos(graph: nx.Graph, pos: dict, max_duration: int):
 			return None
 		return 1/val
 
-	gen = ForceLayout(graph, pos=pos, weight=_inv_weights)
+	gen = ForceLayout(graph)
+	gen.update_graph(pos=pos, edge_lengths=_inv_weights)
 	i = 0
 	min_move=0.005
 	begin = time.time()
@@ -150,8 +220,11 @@ def optimize_graph_pos(graph: nx.Graph, pos: dict, max_duration: int):
 
 		move = 0
 		while time.time() < refresh + 1:
-			m = gen.iterate2(time_factor=0.001, repulse_upper_bound=2, inertia_factor=0.7)
-			move = max(move, m)
+			if gen.n < BH_MIN_NODES:
+				gen.iterate2(repulse_upper_bound=2, inertia_factor=0.7)
+			else:
+				gen.iterate4(repulse_upper_bound=2, inertia_factor=0.7)
+			move = max(move, gen.get_lastiteration_movement())
 			i += 1
 			if move <= min_move/2:
 				print('No much movement: stopped !')
@@ -245,7 +318,8 @@ def draw_graph_to_file(graph: nx.Graph, pos: dict, videos: dict[str, YTVideo], f
 
 		warnings.filterwarnings("ignore", category=UserWarning)
 
-		plt.savefig(filename)
+		with instrument.span('svg.write', file=filename):
+			plt.savefig(filename)
 
 	_do_graph(pos, _prepare_image())
 
@@ -0,0 +1,44 @@
+def prune_comparisons(
+	cmps: dict[str, dict[str, any]],
+	min_neighbours: int,
+	users: dict[str, set] = None,
+	min_users: int = 0,
+) -> int:
+	"""
+	Remove (in place) videos compared to less than `min_neighbours` other remaining videos,
+	or compared by less than `min_users` distinct users (if `users` is set), until every remaining video satisfies both.
+	Result is the same as removing such videos and rescanning all videos until nothing changes (a k-core of the comparison graph),
+	but each video & comparison is only visited once, using a queue of videos to remove.
+
+	Args:
+		cmps (dict[str, dict[str, any]]): {vid: {vid2: comparison data}}, symmetric
+		min_neighbours (int): Minimum number of compared videos to be kept
+		users (dict[str, set], optional): {vid: {users having compared it}}. Not updated when removing videos: a video users count never changes.
+		min_users (int, optional): Minimum number of users to be kept (only if users is set)
+
+	Returns:
+		int: Number of removed videos
+	"""
+	degree = {vid: len(sub) for vid,sub in cmps.items()}
+	queue = [
+		vid for vid in cmps
+		if degree[vid] < min_neighbours or (users is not None and len(users.get(vid, ())) < min_users)
+	]
+	removed = set(queue)
+	while queue:
+		vid = queue.pop()
+		for vid2 in cmps[vid]:
+			if vid2 in removed:
+				continue
+			degree[vid2] -= 1
+			if degree[vid2] < min_neighbours:
+				removed.add(vid2)
+				queue.append(vid2)
+
+	for vid in removed:
+		for vid2 in cmps[vid]:
+			if vid2 not in removed:
+				cmps[vid2].pop(vid, None)
+	for vid in removed:
+		del cmps[vid]
+	return len(removed)
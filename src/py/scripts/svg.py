@@ -2,8 +2,10 @@
 import os
 import re
 import time
+from utils import instrument
 
 
+@instrument.timed('svg.optimize')
 def optimize(optimized_file: str):
 	print('Optimizing SVG...')
 	start = time.time()
@@ -68,6 +70,7 @@ def optimize(optimized_file: str):
 		optimized.flush()
 		optimized.close()
 		opt_size = os.path.getsize(optimized_file)
+		instrument.count('svg.optimized_bytes', opt_size)
 		end = time.time()
 		print(f"Optimized from {float(unopt_size)/(1024*1024):0.2f}MiB to {float(opt_size)/(1024*1024):0.2f}MiB ({1-opt_size/unopt_size:0.2%} reduction) in {end-start:0.2f}s")
 		os.remove(unoptimized_file)
@@ -1,6 +1,7 @@
 import argparse
+import numpy as np
 from model.tournesol_dataset.collectivecriteriascores import CollectiveCriteriaScoresFile
-from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.comparisons import ComparisonFile
 from dao.youtube_api import YTData
 from statistics import median
 
@@ -16,43 +17,36 @@ def get_vids_from_comparisons(tdata: str):
 	MIN_CMPS=3
 
 	cf = ComparisonFile(tdata)
+	scan = cf.scan(criterion='largely_recommended')
+
+	# Single read of the comparisons: index of distinct (user, video) pairs
+	usr_vid_pairs: list[np.ndarray] = list()
+	def batch_parser(batch: dict[str, np.ndarray]):
+		usrs = batch['user'].astype(str)
+		usr_vid_pairs.append(np.unique(np.char.add(
+			np.char.add(np.concatenate((usrs, usrs)), ','),
+			np.concatenate((batch['vid1'], batch['vid2'])).astype(str),
+		)))
+	scan.add_batches(batch_parser)
 
-	usrs_cmps: dict[str, set[str]] = dict()
-	usrs_ok: set[str] = set()
-	def line_parser_users(line: ComparisonLine):
-		if line.criterion != 'largely_recommended':
-			return
-		if line.user in usrs_ok:
-			return
-		if not line.user in usrs_cmps:
-			usrs_cmps[line.user] = set()
-		usrs_cmps[line.user].add(line.vid1)
-		usrs_cmps[line.user].add(line.vid2)
-		if len(usrs_cmps[line.user]) >= MIN_CMPS:
-			usrs_ok.add(line.user)
-			usrs_cmps.pop(line.user)
-	cf.foreach(line_parser_users)
-	# free memory: flush users_cmps
-	usrs_cmps.clear()
-
-	vid_usr: dict[str,set[str]] = dict()
 	vid_ok: set[str] = set()
-	def line_parser_videos(line: ComparisonLine):
-		if line.criterion != 'largely_recommended':
-			return
-		if line.user not in usrs_ok:
+	def filter_videos():
+		if not usr_vid_pairs:
 			return
-		for v in [line.vid1, line.vid2]:
-			if v in vid_ok:
-				continue
-			if not v in vid_usr:
-				vid_usr[v] = set()
-			vid_usr[v].add(line.user)
-			if len(vid_usr[v]) >= MIN_USERS:
-				vid_ok.add(v)
-				vid_usr.pop(v)
-	cf.foreach(line_parser_videos)
+		pairs = np.char.partition(np.unique(np.concatenate(usr_vid_pairs)), ',')
+		usr_vid_pairs.clear()
+		usrs, vids = pairs[:,0], pairs[:,2]
+
+		# Users having compared at least MIN_CMPS different videos
+		users, counts = np.unique(usrs, return_counts=True)
+		usrs_ok = users[counts >= MIN_CMPS]
+
+		# Videos compared by at least MIN_USERS of these users
+		videos, counts = np.unique(vids[np.isin(usrs, usrs_ok)], return_counts=True)
+		vid_ok.update(videos[counts >= MIN_USERS].tolist())
+	scan.then(filter_videos)
 
+	scan.run()
 	return vid_ok
 
 
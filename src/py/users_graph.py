@@ -6,10 +6,11 @@ import argparse
 import colorsys
 import time
 import warnings
-from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
+from model.tournesol_dataset.comparisons import ComparisonFile
 import numpy as np
 from scripts import svg
-from scripts.force_directed_graph import ForceLayout
+from scripts.force_directed_graph import BH_MIN_NODES, ForceLayout
+from utils import instrument
 
 # Filter users
 USER_MIN_VIDEOS = 5
@@ -19,25 +20,31 @@ TOP_EDGES = 10 # Max number of edges to keep per node
 MAX_SPRING_DURATION = 150 # seconds
 MAX_SPRING_ITERATIONS = 1e5
 
+@instrument.timed('users_graph.load_graph')
 def load_graph(datasetpath: str, limit: str):
 	graph = nx.Graph()
 	cf = ComparisonFile(datasetpath)
 	data: dict[str,set[str]] = dict() # user: {vid1, vid2, ...}
 	users_date: dict[str,str] = dict() # user: first_comparison_date
 
-	def parser(line: ComparisonLine):
-		if line.criterion != 'largely_recommended' or limit and line.date < limit:
-			return
-
-		if not line.user in data:
-			data[line.user] = set()
-			users_date[line.user] = line.date
-		elif users_date[line.user] > line.date:
-			users_date[line.user] = line.date
-
-		data[line.user].add(line.vid1)
-		data[line.user].add(line.vid2)
-	cf.foreach(parser)
+	for batch in cf.iter_batches(criterion='largely_recommended', since=limit or None):
+		if len(batch['user']) == 0:
+			continue
+		# One row per (user, video) pair of the batch, grouped by user; only aggregates are kept between batches
+		cmp_users = np.concatenate((batch['user'], batch['user']))
+		cmp_vids = np.concatenate((batch['vid1'], batch['vid2']))
+		cmp_dates = np.concatenate((batch['date'], batch['date']))
+
+		order = np.argsort(cmp_users, kind='stable')
+		cmp_users, cmp_vids, cmp_dates = cmp_users[order], cmp_vids[order], cmp_dates[order]
+		bounds = np.flatnonzero(cmp_users[1:] != cmp_users[:-1]) + 1
+		for start, end in zip(np.r_[0, bounds], np.r_[bounds, len(cmp_users)]):
+			user = cmp_users[start]
+			data.setdefault(user, set()).update(cmp_vids[start:end].tolist())
+			date = min(cmp_dates[start:end])
+			if user not in users_date or date < users_date[user]:
+				users_date[user] = date
+	data = dict(sorted(data.items())) # Same order whatever the batches
 
 	users = [u for u,d in data.items() if len(d) > USER_MIN_VIDEOS]
 	users = sorted(users, key=lambda u: len(data[u]), reverse=True)
@@ -64,6 +71,7 @@ def load_graph(datasetpath: str, limit: str):
 
 
 
+@instrument.timed('users_graph.get_graph_layout')
 def get_graph_layout(graph: nx.Graph):
 	print('Preparing graph layout', end='', flush=True)
 	start = time.time()
@@ -84,7 +92,10 @@ def get_graph_layout(graph: nx.Graph):
 			break
 
 		for _ in range(0,i):
-			LAYOUT.iterate3(attraction_factor=0.002, repulsion_factor=0.2, inertia_factor=0.5, repulse_upper_bound=2)
+			if LAYOUT.n < BH_MIN_NODES:
+				LAYOUT.iterate3(attraction_factor=0.002, repulsion_factor=0.2, inertia_factor=0.5, repulse_upper_bound=2)
+			else:
+				LAYOUT.iterate4(attraction_factor=0.002, repulsion_factor=0.2, inertia_factor=0.5, repulse_upper_bound=2)
 
 		# Estimate number of iterations so that next loop takes around 10% of the process
 		i = int(MAX_SPRING_DURATION/10 * itt / (time.time() - start))+1
@@ -102,6 +113,7 @@ def float_to_color(weight: float, min_c:float, mm_c:float) -> tuple[float,float,
 
 
 
+@instrument.timed('users_graph.graph_to_svg')
 def graph_to_svg(graph: nx.Graph, filename: str):
 	nodes = list(graph.nodes)
 	pos = get_graph_layout(graph)
@@ -181,13 +193,12 @@ def graph_to_svg(graph: nx.Graph, filename: str):
 	## Saving to file
 	##
 	print(f"Saving graph to {filename}...", end='', flush=True)
-	start = time.time()
 
 	logging.getLogger('matplotlib.font_manager').disabled = True
 	warnings.filterwarnings("ignore", category=Warning)
-	plt.savefig(filename, format='svg')
-	end = time.time()
-	print(f"({end-start:0.2f}s)")
+	with instrument.span('svg.write', file=filename) as s:
+		plt.savefig(filename, format='svg')
+	print(f"({s.duration:0.2f}s)")
 
 	# End plt
 	plt.close()
@@ -211,10 +222,9 @@ if __name__ == '__main__':
 	try:
 		# Loading data
 		print('Loading comparisons and generating graph...')
-		start = time.time()
-		graph:nx.Graph = load_graph(args['tournesoldataset'], args['limit'])
-		end = time.time()
-		print('Loaded', graph, f"in {end - start:0.3f}s")
+		with instrument.span('users_graph.main.load') as s:
+			graph:nx.Graph = load_graph(args['tournesoldataset'], args['limit'])
+		print('Loaded', graph, f"in {s.duration:0.3f}s")
 
 		# Reducing data (removing disconnected nodes)
 		largest_group = max(nx.connected_components(graph), key=len)
@@ -0,0 +1,196 @@
+"""
+Timing, counters & memory instrumentation, shared by loaders, solvers and renderers.
+
+Usage:
+
+	with instrument.span('users_graph.load_graph', limit=limit) as s:
+		graph = load_graph(...)
+	print(f"Loaded in {s.duration:0.3f}s")
+
+	@instrument.timed('ForceLayout.iterate3')
+	def iterate3(self, ...): ...
+
+	instrument.count('youtube.api_calls')
+
+Spans (nestable) and counters are always collected: they wrap whole calls or batches, never single rows.
+They are written at exit when these environment variables are set:
+	TOURNESOL_TRACE=<file.json>: trace in Chrome trace event format (to be opened in https://ui.perfetto.dev or chrome://tracing),
+		with spans durations aggregated by name, counters and peak memory. Use `-` to print the aggregated summary on stderr instead.
+	TOURNESOL_PROFILE=<file.prof>: cProfile statistics of the whole run (see `python -m pstats <file.prof>`)
+"""
+import atexit
+import cProfile
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from typing import Callable
+
+try:
+	import resource
+except ImportError: # Not available on Windows
+	resource = None
+
+TRACE_ENV = 'TOURNESOL_TRACE'
+PROFILE_ENV = 'TOURNESOL_PROFILE'
+MAX_TRACE_EVENTS = 100_000 # Spans recorded in the trace (next ones are only aggregated)
+
+_T0 = time.perf_counter()
+_lock = threading.Lock()
+_local = threading.local() # .stack: opened spans of current thread
+_events: list[dict] = [] # Chrome trace events of closed spans
+_dropped = 0 # Spans not recorded in _events (over MAX_TRACE_EVENTS)
+_totals: dict[str, list[float]] = dict() # {span name: [calls, total duration, max duration]}
+_counters: dict[str, float] = dict()
+
+
+def peak_memory_mb() -> float|None:
+	"""
+	Returns:
+		float|None: Peak resident memory of the process so far, in MiB (None if not available on this platform)
+	"""
+	if resource is None:
+		return None
+	peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss # bytes on macOS, KiB elsewhere
+	return peak / (1024*1024 if sys.platform == 'darwin' else 1024)
+
+
+class Span:
+	"""Timed section of code, see `span`. `duration` (seconds) is set when the section ends."""
+	__slots__ = ('name', 'attrs', 'start', 'duration', 'depth')
+
+	def __init__(self, name: str, attrs: dict[str, any]):
+		self.name = name
+		self.attrs = attrs
+		self.start: float = None
+		self.duration: float = None
+		self.depth: int = None
+
+	def __enter__(self) -> 'Span':
+		stack = _stack()
+		self.depth = len(stack)
+		stack.append(self)
+		self.start = time.perf_counter()
+		return self
+
+	def __exit__(self, type, value, traceback):
+		self.duration = time.perf_counter() - self.start
+		_stack().pop()
+		_record(self)
+		return False
+
+
+def _stack() -> list[Span]:
+	if not hasattr(_local, 'stack'):
+		_local.stack = []
+	return _local.stack
+
+def _record(s: Span):
+	global _dropped
+	peak = peak_memory_mb()
+	with _lock:
+		total = _totals.setdefault(s.name, [0, 0.0, 0.0])
+		total[0] += 1
+		total[1] += s.duration
+		total[2] = max(total[2], s.duration)
+
+		if len(_events) >= MAX_TRACE_EVENTS:
+			_dropped += 1
+			return
+		_events.append({
+			'name': s.name,
+			'ph': 'X', # Complete event (Chrome trace event format)
+			'ts': (s.start - _T0) * 1e6, # microseconds
+			'dur': s.duration * 1e6,
+			'pid': os.getpid(),
+			'tid': threading.get_ident(),
+			'args': {**s.attrs, 'depth': s.depth, 'peak_memory_mb': peak},
+		})
+
+
+def span(name: str, **attrs) -> Span:
+	"""
+	Args:
+		name (str): Name under which durations are aggregated
+		attrs: Details recorded with this span in the trace (must be JSON serializable)
+
+	Returns:
+		Span: context manager timing its content
+	"""
+	return Span(name, attrs)
+
+def timed(name: str=None) -> Callable:
+	"""Decorator timing every call of the function, as a span named `name` (default: function qualified name)"""
+	def decorator(fn: Callable) -> Callable:
+		span_name = name or fn.__qualname__
+		@functools.wraps(fn)
+		def wrapper(*args, **kwargs):
+			with Span(span_name, {}):
+				return fn(*args, **kwargs)
+		return wrapper
+	return decorator
+
+def count(name: str, value: float=1):
+	"""Add `value` to the counter `name` (rows parsed, API calls made, cache hits...)"""
+	with _lock:
+		_counters[name] = _counters.get(name, 0) + value
+
+
+def report() -> dict[str, any]:
+	"""
+	Returns:
+		dict: {'spans': {name: {'calls', 'total_s', 'max_s'}}, 'counters': {name: value}, 'peak_memory_mb', 'dropped_events'}
+	"""
+	with _lock:
+		return {
+			'spans': {n: {'calls': t[0], 'total_s': t[1], 'max_s': t[2]} for n,t in sorted(_totals.items(), key=lambda nt: -nt[1][1])},
+			'counters': dict(sorted(_counters.items())),
+			'peak_memory_mb': peak_memory_mb(),
+			'dropped_events': _dropped,
+		}
+
+def summary() -> str:
+	rep = report()
+	lines = [f"{'span':40s} {'calls':>8s} {'total':>10s} {'max':>10s}"]
+	for name,s in rep['spans'].items():
+		lines.append(f"{name:40s} {s['calls']:8d} {s['total_s']:9.3f}s {s['max_s']:9.3f}s")
+	for name,value in rep['counters'].items():
+		lines.append(f"{name:40s} {value:>8g}")
+	if rep['peak_memory_mb'] is not None:
+		lines.append(f"Peak memory: {rep['peak_memory_mb']:0.1f}MiB")
+	return '\n'.join(lines)
+
+def write_trace(filename: str):
+	with _lock:
+		events = list(_events)
+	with open(filename, 'w', encoding='utf-8') as file:
+		json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', **report()}, file)
+
+def reset():
+	"""Forget all spans & counters collected so far"""
+	global _dropped
+	with _lock:
+		_events.clear()
+		_totals.clear()
+		_counters.clear()
+		_dropped = 0
+
+
+def _write_trace_at_exit():
+	target = os.environ.get(TRACE_ENV)
+	if target == '-':
+		print(summary(), file=sys.stderr)
+	else:
+		write_trace(target)
+		print(f"Trace written to {target}", file=sys.stderr)
+
+if os.environ.get(TRACE_ENV):
+	atexit.register(_write_trace_at_exit)
+
+if os.environ.get(PROFILE_ENV):
+	# Profile from the first import of this module (done by dataset loaders) until exit
+	_profiler = cProfile.Profile()
+	_profiler.enable()
+	atexit.register(lambda: (_profiler.disable(), _profiler.dump_stats(os.environ[PROFILE_ENV])))
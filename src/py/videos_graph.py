@@ -10,8 +10,10 @@ from model.tournesol_dataset.individualcriteriascores import IndividualCriteriaS
 from model.tournesol_dataset.comparisons import ComparisonFile, ComparisonLine
 from scripts import svg
 from scripts.nxlayouts import radialized_layout
+from utils import instrument
 
 
+@instrument.timed('videos_graph.load_graph')
 def load_graph(datasetpath: str, limit: str, user: str):
 	graph = nx.Graph()
 	cf = ComparisonFile(datasetpath)
@@ -41,6 +43,7 @@ def load_graph(datasetpath: str, limit: str, user: str):
 def weight_to_color(weight, min_c:float, mm_c:float):
 	return colorsys.hsv_to_rgb((weight-min_c)/mm_c * (128/360), .9, .9)
 
+@instrument.timed('videos_graph.get_graph_layout')
 def get_graph_layout(graph: nx.Graph, elastic_time: int):
 	print('Preparing graph layout', end='', flush=True)
 	start = time.time()
@@ -119,12 +122,14 @@ def graph_to_svg(unorderedgraph: nx.Graph, colors: dict[str, float], filename: s
 	print(f"Saving graph to {filename}...")
 
 	warnings.filterwarnings("ignore", category=UserWarning)
-	plt.savefig(filename)
+	with instrument.span('svg.write', file=filename):
+		plt.savefig(filename)
 
 	# End plt
 	plt.close()
 
 
+@instrument.timed('videos_graph.compute_colors')
 def compute_colors(graph: nx.Graph, mode: str, tournesoldataset: str, user: str) -> dict[str, float]:
 	colors: dict[str, float] = None
 	start: float = None
@@ -241,11 +246,10 @@ if __name__ == '__main__':
 
 	# def analyse_distances(graph: nx.Graph, ytdata: YTData):
 	print('Largest connected subgraph: ', end='', flush=True)
-	start = time.time()
-	largest_group = max(nx.connected_components(graph), key=len)
-	graph.remove_nodes_from(n for n in list(graph.nodes) if not n in largest_group)
-	end = time.time()
-	print(graph, f"(duration: {end - start:0.3f}s)")
+	with instrument.span('videos_graph.main.largest_component') as s:
+		largest_group = max(nx.connected_components(graph), key=len)
+		graph.remove_nodes_from(n for n in list(graph.nodes) if not n in largest_group)
+	print(graph, f"(duration: {s.duration:0.3f}s)")
 
 	print() ##
 